@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Bot, Scenario, Step
+from .models import Bot, Scenario, ScenarioVersion, Step, StepArchive, Conversation, ChatJob
+from .search_service import filter_by_text
 from django import forms
 import json
 
@@ -30,10 +31,16 @@ class BotAdmin(admin.ModelAdmin):
 
 @admin.register(Scenario)
 class ScenarioAdmin(admin.ModelAdmin):
-    list_display = ['name', 'bot', 'created_at', 'updated_at']
+    list_display = ['name', 'bot', 'published_version', 'created_at', 'updated_at']
     list_filter = ['bot', 'created_at', 'updated_at']
-    search_fields = ['bot', 'name', 'description']
-    readonly_fields = ['created_at', 'updated_at']
+    search_fields = ['bot__name', 'name', 'description']
+    readonly_fields = ['published_version', 'created_at', 'updated_at']
+    actions = ['publish_drafts']
+
+    @admin.action(description="Опубликовать черновик scenario_data")
+    def publish_drafts(self, request, queryset):
+        for scenario in queryset:
+            scenario.publish()
     
     def scenario_preview(self, obj):
         if obj.scenario_data:
@@ -41,9 +48,56 @@ class ScenarioAdmin(admin.ModelAdmin):
             return f"{len(states)} состояний"
         return "Пустой сценарий"
 
+@admin.register(ScenarioVersion)
+class ScenarioVersionAdmin(admin.ModelAdmin):
+    list_display = ['id', 'scenario', 'content_hash', 'created_at']
+    list_filter = ['scenario']
+    readonly_fields = ['scenario', 'content_hash', 'scenario_data', 'created_at']
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Step)
 class StepAdmin(admin.ModelAdmin):
-    list_display = ['order', 'step_type', 'scenario', 'created_at']
+    list_display = ['order', 'step_type', 'scenario', 'conversation', 'created_at']
     list_filter = ['step_type', 'scenario']
     search_fields = ['content']
-    readonly_fields = ['created_at']    
+    raw_id_fields = ['conversation']
+    readonly_fields = ['created_at']
+    exclude = ['search_vector']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('search_vector')
+
+    def get_search_results(self, request, queryset, search_term):
+        # По индексу tsvector вместо ILIKE '%...%' по всей таблице шагов
+        if not search_term:
+            return queryset, False
+        return filter_by_text(queryset, search_term), False
+
+@admin.register(StepArchive)
+class StepArchiveAdmin(admin.ModelAdmin):
+    list_display = ['conversation', 'scenario', 'first_order', 'last_order', 'step_count', 'codec', 'created_at']
+    list_filter = ['codec', 'scenario']
+    raw_id_fields = ['conversation']
+    exclude = ['data']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ['end_user_id', 'bot', 'scenario', 'scenario_version', 'current_state', 'turn_count', 'updated_at']
+    list_filter = ['bot', 'updated_at']
+    search_fields = ['end_user_id']
+    raw_id_fields = ['scenario_version']
+    readonly_fields = ['created_at', 'updated_at']
+
+@admin.register(ChatJob)
+class ChatJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'bot', 'end_user_id', 'status', 'attempts', 'run_at', 'updated_at']
+    list_filter = ['status', 'bot']
+    readonly_fields = ['created_at', 'updated_at']
@@ -1,6 +1,30 @@
+import importlib.util
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+def require_redis(setting_name: str):
+    # Без клиента Redis ошибка всплыла бы только в рантайме (лимитер молча пропускает всё), поэтому падаем при старте
+    if importlib.util.find_spec('redis') is None:
+        raise ImproperlyConfigured(f"{setting_name} задан, но пакет redis не установлен")
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import authentication  # noqa: F401 — подключает сброс кэша токенов по сигналам
+        from .metrics import install_db_wrapper
+
+        connection_created.connect(install_db_wrapper, dispatch_uid='api_metrics_db_wrapper')
+
+        if settings.RATE_LIMIT_REDIS_URL:
+            require_redis('RATE_LIMIT_REDIS_URL')
+        for alias, config in settings.CACHES.items():
+            if config.get('BACKEND') == 'django.core.cache.backends.redis.RedisCache':
+                require_redis(f"CACHES['{alias}'] (RedisCache)")
@@ -0,0 +1,139 @@
+import asyncio
+import hmac
+import json
+import math
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from .authentication import CHAT_AUTHENTICATION_CLASSES, bot_scope
+from .chat_requests import aenforce_chat_rate, chat_turn_errors, validate_chat_request
+from .chat_service import arun_chat_turn, astream_chat_turn, event_stream_response
+from .job_queue import UNFINISHED_STATUSES, aenqueue_chat_job, serialize_job
+from .models import Bot, ChatJob
+from .telegram_gateway import answer_message, extract_message, get_dispatcher
+
+
+def _authenticate(request):
+    authenticators = [auth() for auth in CHAT_AUTHENTICATION_CLASSES]
+    drf_request = Request(request, authenticators=authenticators)
+    try:
+        user = drf_request.user
+    except exceptions.APIException:
+        return None, None
+    if not user or not user.is_authenticated:
+        return None, None
+    return user, drf_request.auth
+
+
+aauthenticate = sync_to_async(_authenticate)
+
+
+def api_exception_response(exc: exceptions.APIException) -> JsonResponse:
+    # Тот же формат ответа, что у обработчика исключений DRF в синхронных представлениях
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = JsonResponse(data, status=exc.status_code, safe=False)
+    if getattr(exc, 'wait', None):
+        response['Retry-After'] = str(math.ceil(exc.wait))
+    return response
+
+
+@csrf_exempt
+async def bot_chat(request, pk):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Метод не поддерживается'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    user, auth = await aauthenticate(request)
+    if user is None:
+        return JsonResponse({'error': 'Требуется аутентификация'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Невалидный JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        chat = validate_chat_request(user, auth, pk, payload)
+        bot = await Bot.objects.filter(pk=pk, user=user).afirst()
+        if bot is None:
+            raise exceptions.NotFound("Бот не найден")
+        end_user_id = chat['end_user']
+        await aenforce_chat_rate(bot, end_user_id)
+
+        if chat['stream']:
+            return event_stream_response(astream_chat_turn(bot, end_user_id, chat['message']))
+        if chat['enqueue']:
+            job = await aenqueue_chat_job(bot, end_user_id, chat['message'])
+            return JsonResponse(serialize_job(job), status=status.HTTP_202_ACCEPTED)
+
+        with chat_turn_errors():
+            bot_response_data = await arun_chat_turn(bot, end_user_id, chat['message'])
+    except exceptions.APIException as e:
+        return api_exception_response(e)
+    return JsonResponse(bot_response_data, status=status.HTTP_200_OK)
+
+
+JOB_POLL_INTERVAL = 0.25
+
+
+async def job_result(request, pk):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Метод не поддерживается'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    user, auth = await aauthenticate(request)
+    if user is None:
+        return JsonResponse({'error': 'Требуется аутентификация'}, status=status.HTTP_401_UNAUTHORIZED)
+    jobs = ChatJob.objects.filter(bot__user=user)
+    if bot_scope(auth) is not None:
+        jobs = jobs.filter(bot_id=bot_scope(auth))
+
+    try:
+        wait = min(float(request.GET.get('timeout', settings.CHAT_JOB_MAX_WAIT)), settings.CHAT_JOB_MAX_WAIT)
+    except ValueError:
+        return JsonResponse({'error': 'timeout должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+
+    deadline = time.monotonic() + wait
+    while True:
+        job = await jobs.filter(pk=pk).afirst()
+        if job is None:
+            return JsonResponse({'detail': 'Задача не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        if job.status not in UNFINISHED_STATUSES or time.monotonic() >= deadline:
+            return JsonResponse(serialize_job(job), status=status.HTTP_200_OK)
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+@csrf_exempt
+async def telegram_webhook(request, bot_id):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Метод не поддерживается'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    bot = await Bot.objects.filter(pk=bot_id).afirst()
+    bot_config = bot.bot_config if bot else {}
+    secret = bot_config.get('telegram_webhook_secret')
+    if not bot_config.get('telegram_token') or not secret:
+        return JsonResponse({'detail': 'Бот не найден'}, status=status.HTTP_404_NOT_FOUND)
+    received_secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+    if not hmac.compare_digest(received_secret, secret):
+        return JsonResponse({'detail': 'Неверный секрет вебхука'}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        update = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Невалидный JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+    message = extract_message(update)
+    if message is None:
+        return JsonResponse({})
+    chat_id, text = message
+
+    reply = await get_dispatcher().run(
+        ('telegram', bot.pk, chat_id),
+        lambda: answer_message(bot, chat_id, text),
+    )
+    # Ответ в теле вебхука экономит отдельный вызов sendMessage
+    return JsonResponse({'method': 'sendMessage', 'chat_id': chat_id, 'text': reply})
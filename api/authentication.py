@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework import exceptions, permissions
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+BOT_TOKEN_KEYWORD = 'Bot'
+BOT_TOKEN_SALT = 'api.bot-token'
+
+
+class TTLCache:
+    """Потокобезопасный LRU кэш процесса с ограниченным временем жизни записей."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: 'OrderedDict[Any, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, predicate):
+        with self._lock:
+            for key in [key for key, (_, value) in self._items.items() if predicate(key, value)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# Отзыв токена виден в этом процессе сразу, в остальных воркерах — не позже чем через TTL
+token_cache = TTLCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+user_cache = TTLCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который ходит в БД только при промахе кэша."""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, (user, token))
+        return user, token
+
+
+class BotAccess:
+    """request.auth для токена, подписанного на одного бота."""
+
+    __slots__ = ('bot_id', 'user_id')
+
+    def __init__(self, bot_id: int, user_id: int):
+        self.bot_id = bot_id
+        self.user_id = user_id
+
+
+def issue_bot_token(bot, max_age: Optional[int] = None) -> Dict[str, Any]:
+    max_age = max_age or settings.BOT_TOKEN_MAX_AGE
+    token = signing.dumps({'b': bot.pk, 'u': bot.user_id, 'exp': int(time.time()) + max_age}, salt=BOT_TOKEN_SALT)
+    return {'token': token, 'token_type': BOT_TOKEN_KEYWORD, 'expires_in': max_age}
+
+
+def get_cached_user(user_id: int) -> Optional[User]:
+    user = user_cache.get(user_id)
+    if user is None:
+        user = User.objects.filter(pk=user_id, is_active=True).first()
+        if user is None:
+            return None
+        user_cache.set(user_id, user)
+    return user
+
+
+class BotTokenAuthentication(TokenAuthentication):
+    """Подписанный токен с истечением срока, ограниченный одним ботом.
+
+    Подпись и срок проверяются без БД (HMAC на SECRET_KEY), пользователь
+    берётся из кэша процесса. Заголовок: Authorization: Bot <token>.
+    """
+
+    keyword = BOT_TOKEN_KEYWORD
+
+    def authenticate_credentials(self, key):
+        try:
+            payload = signing.loads(key, salt=BOT_TOKEN_SALT)
+            expires_at = payload['exp']
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise exceptions.AuthenticationFailed("Неверный токен бота")
+        if expires_at < time.time():
+            raise exceptions.AuthenticationFailed("Срок действия токена бота истёк")
+        user = get_cached_user(payload['u'])
+        if user is None:
+            raise exceptions.AuthenticationFailed("Пользователь неактивен или удалён")
+        return user, BotAccess(payload['b'], payload['u'])
+
+
+class BotScopePermission(permissions.BasePermission):
+    """Токен бота открывает только действия чата (bot_token_actions) этого бота."""
+
+    def has_permission(self, request, view):
+        if not isinstance(request.auth, BotAccess):
+            return True
+        if getattr(view, 'action', None) not in getattr(view, 'bot_token_actions', ()):
+            return False
+        pk = view.kwargs.get('pk')
+        return pk is None or str(pk) == str(request.auth.bot_id)
+
+
+def bot_scope(request_auth) -> Optional[int]:
+    return request_auth.bot_id if isinstance(request_auth, BotAccess) else None
+
+
+# Чат вызывается на каждое сообщение: без Basic, чтобы не считать PBKDF2 на каждый запрос
+CHAT_AUTHENTICATION_CLASSES = [BotTokenAuthentication, CachedTokenAuthentication, SessionAuthentication]
+
+
+@receiver(post_delete, sender=Token, dispatch_uid='api_token_cache_delete')
+@receiver(post_save, sender=Token, dispatch_uid='api_token_cache_save')
+def invalidate_token(sender, instance, **kwargs):
+    token_cache.discard(lambda key, value: key == instance.key)
+
+
+@receiver(post_delete, sender=User, dispatch_uid='api_auth_cache_user_delete')
+@receiver(post_save, sender=User, dispatch_uid='api_auth_cache_user_save')
+def invalidate_user(sender, instance, **kwargs):
+    user_cache.discard(lambda key, value: key == instance.pk)
+    token_cache.discard(lambda key, value: value[0].pk == instance.pk)
@@ -0,0 +1,156 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .chat_service import (
+    active_scenarios, get_conversation_context, get_or_create_active_scenario, is_failed_response, process_message,
+    update_session,
+)
+from .chatbot_service import LLMOverloadedError
+from .metrics import phase
+from .models import Bot, Scenario
+from .session_store import get_session_store
+from .step_writer import append_steps_batch, step_writer
+from .throttling import check_chat_rate
+
+logger = logging.getLogger(__name__)
+
+
+class BatchTurn:
+    __slots__ = ('bot_id', 'end_user_id', 'message', 'bot', 'scenario', 'conversation', 'response_data', 'result')
+
+    def __init__(self, item: Dict[str, Any], default_end_user: str):
+        self.bot_id = item['bot']
+        self.end_user_id = item.get('end_user') or default_end_user
+        self.message = item['message']
+        self.bot = None
+        self.scenario = None
+        self.conversation = None
+        self.response_data: Optional[Dict[str, Any]] = None
+        self.result: Optional[Dict[str, Any]] = None
+
+    def fail(self, status: str, error: str, **extra):
+        self.result = {'status': status, 'error': error, **extra}
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'bot': self.bot_id, 'end_user': self.end_user_id, **self.result}
+
+
+def _load_active_scenarios(bots: List[Bot]) -> Dict[int, Scenario]:
+    scenarios: Dict[int, Scenario] = {}
+    for scenario in active_scenarios().filter(bot__in=bots).order_by('id'):
+        scenarios.setdefault(scenario.bot_id, scenario)
+    for bot in bots:
+        if bot.pk not in scenarios:
+            scenarios[bot.pk] = get_or_create_active_scenario(bot)
+    return scenarios
+
+
+def _run_conversation_turns(turns: List[BatchTurn]):
+    # Ходы одного разговора идут по порядку: каждый следующий зависит от состояния после предыдущего
+    try:
+        for turn in turns:
+            try:
+                context = get_conversation_context(turn.bot, turn.conversation)
+                response_data = process_message(turn.bot, turn.scenario, turn.conversation, turn.message, context)
+            except LLMOverloadedError as e:
+                turn.fail('throttled', str(e), retry_after=e.retry_after)
+                continue
+            except Exception as e:
+                logger.exception("Ошибка хода в пакетном чате: %s", e)
+                turn.fail('error', str(e))
+                continue
+            if is_failed_response(response_data):
+                # Ход с ошибкой LLM не сохраняется: его можно повторить с того же состояния
+                turn.fail('error', response_data.get('error') or response_data['response'])
+                continue
+            update_session(turn.bot, turn.conversation, turn.message, response_data)
+            turn.response_data = response_data
+            turn.result = {'status': 'ok', **response_data}
+    finally:
+        close_old_connections()
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    # Пул общий на процесс: CHAT_BATCH_CONCURRENCY ограничивает все пакетные запросы воркера вместе
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.CHAT_BATCH_CONCURRENCY, thread_name_prefix='chat-batch')
+    return _executor
+
+
+def run_chat_batch(user, items: List[Dict[str, Any]], bot_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Обрабатывает пачку сообщений (bot, end_user, message) одного владельца.
+
+    bot_id ограничивает пачку одним ботом (запрос с токеном бота).
+
+    Боты, активные сценарии и разговоры загружаются общими запросами, разговоры
+    обрабатываются параллельно в ограниченном пуле потоков, шаги всех ходов
+    пишутся одним bulk_create. Ошибка одного элемента не отменяет остальные.
+    """
+    turns = [BatchTurn(item, str(user.pk)) for item in items]
+    session_store = get_session_store()
+
+    with phase('batch_load'):
+        bot_ids = {turn.bot_id for turn in turns if bot_id is None or turn.bot_id == bot_id}
+        bots = Bot.objects.filter(user=user).in_bulk(bot_ids) if bot_ids else {}
+        scenarios = _load_active_scenarios(list(bots.values()))
+        pending = []
+        for turn in turns:
+            turn.bot = bots.get(turn.bot_id)
+            if turn.bot is None:
+                turn.fail('not_found', "Бот не найден")
+                continue
+            wait = check_chat_rate(turn.bot, turn.end_user_id)
+            if wait is not None:
+                turn.fail('throttled', "Превышен лимит запросов", retry_after=wait)
+                continue
+            turn.scenario = scenarios[turn.bot_id]
+            pending.append(turn)
+        conversations = session_store.load_many([(turn.bot, turn.scenario, turn.end_user_id) for turn in pending])
+
+    groups: Dict[Any, List[BatchTurn]] = defaultdict(list)
+    for turn in pending:
+        key = (turn.scenario.pk, turn.end_user_id)
+        turn.conversation = conversations[key]
+        groups[key].append(turn)
+
+    if groups:
+        with phase('batch_engine'):
+            list(get_executor().map(_run_conversation_turns, groups.values()))
+
+    completed = [turn for turn in pending if turn.response_data is not None]
+    if completed:
+        with phase('batch_persist'):
+            steps = defaultdict(list)
+            for turn in completed:
+                steps[(turn.scenario.pk, turn.conversation.pk)].extend([
+                    (turn.message, 'user_input'), (turn.response_data['response'], 'bot_response'),
+                ])
+            try:
+                # Сессии и шаги пачки сохраняются вместе: после ошибки не остаётся хода без шагов
+                with transaction.atomic():
+                    session_store.save_many(list({id(turn.conversation): turn.conversation for turn in completed}.values()))
+                    if not settings.CHAT_STEP_WRITE_BEHIND:
+                        append_steps_batch(steps)
+            except Exception as e:
+                logger.exception("Не удалось сохранить пакет ходов чата: %s", e)
+                for turn in completed:
+                    turn.result = {**turn.result, 'status': 'persist_failed', 'error': str(e)}
+            else:
+                if settings.CHAT_STEP_WRITE_BEHIND:
+                    for (scenario_id, conversation_id), payloads in steps.items():
+                        step_writer.submit(scenario_id, payloads, conversation_id)
+
+    return [turn.as_dict() for turn in turns]
@@ -0,0 +1,308 @@
+import itertools
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, Prefetch
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import issue_bot_token
+from .chatbot_service import PseudoBot
+from .context_builder import ContextBuilder
+from .history_service import get_history_page
+from .models import Bot, Conversation, Scenario, Step
+from .scenario_compiler import compile_scenario
+from .scenario_service import ScenarioEngine, ScenarioManager
+from .serializers import BotListSerializer, BotSerializer, ScenarioSerializer
+from .step_archive import archive_conversation
+from .step_writer import append_steps
+from .views import RECENT_STEPS_LIMIT
+
+BENCH_PASSWORD = 'bench-password'
+MIN_ROUND_SECONDS = 0.002
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Benchmark:
+    def __init__(self, name: str, factory: Callable, rounds: int, max_queries: Optional[int]):
+        self.name = name
+        self.factory = factory
+        self.rounds = rounds
+        self.max_queries = max_queries
+
+    def run(self, env: 'BenchmarkEnv', rounds: Optional[int] = None) -> Dict[str, Any]:
+        func = self.factory(env)
+        func()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            func()
+        # Быстрые функции меряются пачками, чтобы шум таймера не превышал само время вызова
+        number = 1
+        while True:
+            started = time.perf_counter()
+            for _ in range(number):
+                func()
+            if time.perf_counter() - started >= MIN_ROUND_SECONDS:
+                break
+            number *= 2
+
+        timings = []
+        for _ in range(rounds or self.rounds):
+            started = time.perf_counter()
+            for _ in range(number):
+                func()
+            timings.append((time.perf_counter() - started) / number)
+        timings.sort()
+        median = statistics.median(timings)
+        return {
+            'rounds': len(timings),
+            'calls_per_round': number,
+            'min_ms': timings[0] * 1000,
+            'median_ms': median * 1000,
+            'p95_ms': timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000,
+            'ops_per_sec': 1 / median if median else 0.0,
+            'queries': queries.count,
+            'max_queries': self.max_queries,
+        }
+
+
+BENCHMARKS: List[Benchmark] = []
+
+
+def benchmark(name: str, rounds: int = 200, max_queries: Optional[int] = None):
+    def decorator(factory):
+        BENCHMARKS.append(Benchmark(name, factory, rounds, max_queries))
+        return factory
+    return decorator
+
+
+def _generate_rules(index: int, transitions: int, names: List[str]) -> List[Dict[str, Any]]:
+    match_types = itertools.cycle(['word', 'stem', 'substring', 'word', 'stem', 'regex'])
+    rules = []
+    for offset, match in zip(range(transitions), match_types):
+        rule = {'match': match, 'next': names[(index + offset + 1) % len(names)], 'priority': offset % 3}
+        if match == 'regex':
+            rule['pattern'] = rf"\bзаказ\s*№?\s*{index}-{offset}\b"
+        else:
+            rule['keywords'] = [f"слово{index}_{offset}", f"доставка товаров {offset}"]
+        rules.append(rule)
+    return rules
+
+
+def generate_scenario(states: int, transitions: int, rules: bool = False) -> Dict[str, Any]:
+    names = [f"s{index}" for index in range(states)]
+    return {
+        'initial_state': names[0],
+        'states': {
+            name: {
+                'prompt': f"Состояние {index}. Ответь пользователю коротко.",
+                'transitions': _generate_rules(index, transitions, names) if rules else {
+                    f"слово{index}_{offset}": names[(index + offset + 1) % states]
+                    for offset in range(transitions)
+                },
+                'default_next_state': names[(index + 1) % states],
+            }
+            for index, name in enumerate(names)
+        },
+    }
+
+
+class BenchmarkEnv:
+    """Данные для бенчмарков; создаются в одноразовой тестовой БД."""
+
+    def __init__(self, history_steps: int = 20000, extra_scenarios: int = 50):
+        self.user = User.objects.create_user('bench', password=BENCH_PASSWORD)
+        self.bot = Bot.objects.create(name="Бенчмарк", user=self.user, bot_config={'backend': 'pseudo'})
+        self.scenario = Scenario.objects.create(
+            name="Активный", bot=self.bot, is_active=True, scenario_data=ScenarioManager.get_default_scenario(),
+        )
+        Scenario.objects.bulk_create([
+            Scenario(name=f"Сценарий {index}", bot=self.bot, scenario_data=generate_scenario(20, 5))
+            for index in range(extra_scenarios)
+        ])
+        payloads = [
+            (f"Сообщение номер {index}. " + "Довольно длинный текст реплики. " * 5, step_type)
+            for index, step_type in zip(range(history_steps), itertools.cycle(['user_input', 'bot_response']))
+        ]
+        self.conversation = Conversation.objects.create(bot=self.bot, scenario=self.scenario, end_user_id='history')
+        for start in range(0, len(payloads), 2000):
+            append_steps(self.scenario.pk, payloads[start:start + 2000], self.conversation.pk)
+        self.conversation.refresh_from_db()
+        self.huge_scenario = generate_scenario(2000, 50)
+        self.huge_rules_scenario = generate_scenario(2000, 50, rules=True)
+
+    def api_client(self) -> APIClient:
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client
+
+    def deep_conversation(self, lines: int = 400) -> Conversation:
+        context = [
+            {'step_type': step_type, 'content': f"Реплика {index}. " + "Подробности обсуждения. " * 8}
+            for index, step_type in zip(range(lines), itertools.cycle(['user_input', 'bot_response']))
+        ]
+        summary = "\n".join(f"Пользователь: Ранняя реплика {index}." for index in range(40))
+        return Conversation(bot=self.bot, scenario=self.scenario, end_user_id='bench', context=context, summary=summary)
+
+
+def _engine_runner(scenario_data: Dict[str, Any], messages: List[str]):
+    compiled = compile_scenario(scenario_data)
+    chat_bot = PseudoBot()
+    state_names = itertools.cycle([state.name for state in compiled.states])
+    inputs = itertools.cycle(messages)
+
+    def run():
+        engine = ScenarioEngine(scenario_data, compiled, next(state_names), chat_bot)
+        engine.process_user_input(next(inputs), "Пользователь: привет\nБот: Привет!!")
+    return run
+
+
+@benchmark('engine.small', rounds=100, max_queries=0)
+def engine_small(env):
+    return _engine_runner(ScenarioManager.get_default_scenario(), ["привет", "помощь", "контакты", "спасибо", "что?"])
+
+
+@benchmark('engine.huge', rounds=100, max_queries=0)
+def engine_huge(env):
+    messages = [f"мне нужно слово{index}_{index % 50} и ещё немного текста" for index in range(0, 2000, 7)]
+    return _engine_runner(env.huge_scenario, messages + ["ни одного ключевого слова здесь нет"])
+
+
+@benchmark('engine.huge_rules', rounds=100, max_queries=0)
+def engine_huge_rules(env):
+    messages = [f"мне нужна доставка товаров {index % 50}, заказ № {index}-{index % 50}" for index in range(0, 2000, 7)]
+    return _engine_runner(env.huge_rules_scenario, messages + ["ни одного ключевого слова здесь нет"])
+
+
+@benchmark('compile.huge', rounds=5, max_queries=0)
+def compile_huge(env):
+    return lambda: compile_scenario(env.huge_scenario)
+
+
+@benchmark('compile.huge_rules', rounds=5, max_queries=0)
+def compile_huge_rules(env):
+    return lambda: compile_scenario(env.huge_rules_scenario)
+
+
+@benchmark('context.build_deep', rounds=100, max_queries=0)
+def context_build_deep(env):
+    conversation = env.deep_conversation()
+    context_builder = ContextBuilder.for_bot(env.bot)
+    return lambda: context_builder.build(conversation)
+
+
+@benchmark('context.compact_deep', rounds=200, max_queries=0)
+def context_compact_deep(env):
+    context_builder = ContextBuilder.for_bot(env.bot)
+    return lambda: context_builder.compact(env.deep_conversation())
+
+
+@benchmark('history.page', rounds=300, max_queries=1)
+def history_page(env):
+    before = env.conversation.last_step_order // 2
+    return lambda: get_history_page(env.conversation, before=before, limit=50)
+
+
+@benchmark('history.archived_page', rounds=300, max_queries=2)
+def history_archived_page(env):
+    # Отдельный сценарий: архив общего env.scenario добавил бы запрос в api.steps_page
+    scenario = Scenario.objects.create(name="Архивный", bot=env.bot)
+    conversation = Conversation.objects.create(bot=env.bot, scenario=scenario, end_user_id='archived')
+    append_steps(scenario.pk, [(f"Архивная реплика {index}", 'user_input') for index in range(2000)], conversation.pk)
+    archive_conversation(conversation.pk, 'gzip')
+    conversation.refresh_from_db()
+    before = conversation.last_step_order // 2
+    return lambda: get_history_page(conversation, before=before, limit=50)
+
+
+@benchmark('serializer.bot_list', rounds=300, max_queries=0)
+def serializer_bot_list(env):
+    bots = list(Bot.objects.filter(user=env.user).annotate(scenarios_count=Count('scenarios')))
+    return lambda: BotListSerializer(bots, many=True).data
+
+
+@benchmark('serializer.bot_detail', rounds=100, max_queries=0)
+def serializer_bot_detail(env):
+    bot = Bot.objects.prefetch_related(Prefetch(
+        'scenarios',
+        queryset=Scenario.objects.annotate(steps_count=Count('steps')).order_by('id'),
+    )).get(pk=env.bot.pk)
+    return lambda: BotSerializer(bot).data
+
+
+@benchmark('serializer.scenario_detail', rounds=300, max_queries=0)
+def serializer_scenario_detail(env):
+    scenario = Scenario.objects.annotate(steps_count=Count('steps')).prefetch_related(Prefetch(
+        'steps',
+        queryset=Step.objects.order_by('-id')[:RECENT_STEPS_LIMIT],
+        to_attr='recent_steps',
+    )).get(pk=env.scenario.pk)
+    return lambda: ScenarioSerializer(scenario).data
+
+
+@benchmark('api.bot_list', rounds=100, max_queries=2)
+def api_bot_list(env):
+    client = env.api_client()
+    return lambda: client.get('/api/bots/')
+
+
+@benchmark('api.scenario_detail', rounds=100, max_queries=2)
+def api_scenario_detail(env):
+    client = env.api_client()
+    return lambda: client.get(f'/api/scenarios/{env.scenario.pk}/')
+
+
+@benchmark('api.steps_page', rounds=200, max_queries=2)
+def api_steps_page(env):
+    client = env.api_client()
+    return lambda: client.get(f'/api/scenarios/{env.scenario.pk}/steps/?limit=50')
+
+
+@benchmark('api.steps_search', rounds=200, max_queries=1)
+def api_steps_search(env):
+    client = env.api_client()
+    return lambda: client.get('/api/steps/search/?q=Сообщение&limit=20')
+
+
+@benchmark('api.chat', rounds=200, max_queries=7)
+def api_chat(env):
+    client = env.api_client()
+    messages = itertools.cycle(["привет", "помощь", "контакты", "спасибо"])
+    return lambda: client.post(f'/api/bots/{env.bot.pk}/chat/', {'message': next(messages)}, format='json')
+
+
+@benchmark('api.chat_batch', rounds=50, max_queries=20)
+def api_chat_batch(env):
+    # 50 сообщений от 10 собеседников за один запрос; сравнивать с 50 x api.chat
+    client = env.api_client()
+    items = [
+        {'bot': env.bot.pk, 'end_user': f"batch-{index % 10}", 'message': message}
+        for index, message in zip(range(50), itertools.cycle(["привет", "помощь", "контакты", "спасибо"]))
+    ]
+    return lambda: client.post('/api/bots/chat/batch/', {'items': items}, format='json')
+
+
+@benchmark('api.chat_token', rounds=200, max_queries=7)
+def api_chat_token(env):
+    client = APIClient()
+    token, _ = Token.objects.get_or_create(user=env.user)
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return lambda: client.post(f'/api/bots/{env.bot.pk}/chat/', {'message': "привет"}, format='json')
+
+
+@benchmark('api.chat_bot_token', rounds=200, max_queries=7)
+def api_chat_bot_token(env):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bot {issue_bot_token(env.bot)['token']}")
+    return lambda: client.post(f'/api/bots/{env.bot.pk}/chat/', {'message': "привет"}, format='json')
@@ -0,0 +1,52 @@
+from contextlib import contextmanager
+from typing import Any, Dict
+
+from asgiref.sync import sync_to_async
+from rest_framework import exceptions, status
+
+from .authentication import bot_scope
+from .chatbot_service import LLMOverloadedError
+from .serializers import ChatSerializer
+from .session_store import SessionConflict
+from .throttling import check_chat_rate
+
+
+class ChatConflict(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Диалог изменён параллельным запросом"
+    default_code = 'conflict'
+
+
+def validate_chat_request(user, auth, pk, data) -> Dict[str, Any]:
+    """Проверки запроса к чату, общие для BotViewSet.chat и async_views.bot_chat.
+
+    Токен бота открывает только чат своего бота; end_user по умолчанию — владелец.
+    """
+    scope = bot_scope(auth)
+    if scope is not None and str(scope) != str(pk):
+        raise exceptions.PermissionDenied("Токен выдан для другого бота")
+    serializer = ChatSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    validated_data = dict(serializer.validated_data)
+    validated_data['end_user'] = validated_data.get('end_user') or str(user.pk)
+    return validated_data
+
+
+def enforce_chat_rate(bot, end_user_id: str):
+    wait = check_chat_rate(bot, end_user_id)
+    if wait is not None:
+        raise exceptions.Throttled(wait=wait)
+
+
+# Лимиты могут жить в Redis: проверка не должна занимать общий поток синхронного кода
+aenforce_chat_rate = sync_to_async(enforce_chat_rate, thread_sensitive=False)
+
+
+@contextmanager
+def chat_turn_errors():
+    try:
+        yield
+    except LLMOverloadedError as e:
+        raise exceptions.Throttled(wait=e.retry_after, detail=str(e))
+    except SessionConflict as e:
+        raise ChatConflict(str(e))
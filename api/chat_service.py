@@ -0,0 +1,251 @@
+import json
+import logging
+import time
+from typing import Dict, Any, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+
+from .chatbot_service import LLM_ERROR_RESPONSE, LLMOverloadedError, LLMStreamInterrupted, get_chat_backend
+from .context_builder import ContextBuilder
+from .metrics import observe_phase, phase
+from .models import Bot, Scenario
+from .scenario_service import ScenarioEngine, ScenarioManager
+from .session_store import SessionConflict, get_session_store
+from .step_writer import append_steps, step_writer
+
+logger = logging.getLogger(__name__)
+
+
+class ChatTurnError(Exception):
+    pass
+
+
+def is_failed_response(bot_response_data: Dict[str, Any]) -> bool:
+    return bool(bot_response_data.get('error')) or bot_response_data['response'] == LLM_ERROR_RESPONSE
+
+
+def active_scenarios():
+    # Чату нужен только указатель на опубликованную версию, рабочая копия сценария не читается
+    return Scenario.objects.filter(is_active=True).defer('scenario_data', 'scenario_index')
+
+
+def get_or_create_active_scenario(bot) -> Scenario:
+    active_scenario = active_scenarios().filter(bot=bot).first()
+    if not active_scenario:
+        active_scenario = _create_active_scenario(bot)
+    return active_scenario
+
+
+@transaction.atomic
+def _create_active_scenario(bot) -> Scenario:
+    # Блокировка строки бота не даёт параллельным первым сообщениям создать несколько активных сценариев
+    Bot.objects.select_for_update().filter(pk=bot.pk).first()
+    active_scenario = Scenario.objects.filter(bot=bot, is_active=True).first()
+    if not active_scenario:
+        active_scenario = Scenario.objects.create(
+            name=f"Активный сценарий для {bot.name}",
+            bot=bot,
+            is_active=True,
+            scenario_data=ScenarioManager.get_default_scenario()
+        )
+    return active_scenario
+
+
+async def aget_or_create_active_scenario(bot) -> Scenario:
+    active_scenario = await active_scenarios().filter(bot=bot).afirst()
+    if not active_scenario:
+        active_scenario = await sync_to_async(_create_active_scenario)(bot)
+    return active_scenario
+
+
+def get_conversation_context(bot, conversation) -> str:
+    return ContextBuilder.for_bot(bot).build(conversation)
+
+
+def _no_scenario_response(bot_response: str) -> Dict[str, Any]:
+    return {
+        'response': bot_response,
+        'current_state': None,
+        'is_finished': False
+    }
+
+
+def pin_scenario_version(scenario, conversation) -> Optional[int]:
+    # Новый (или завершённый и начатый заново) диалог берёт текущую опубликованную версию,
+    # начатый продолжает идти по своей, даже если сценарий переопубликовали
+    if conversation.scenario_version_id is None or not conversation.current_state:
+        conversation.scenario_version_id = scenario.published_version_id
+    return conversation.scenario_version_id
+
+
+def process_message(bot, scenario, conversation, user_message: str, context: str) -> Dict[str, Any]:
+    chat_bot = get_chat_backend(bot.bot_config)
+    version_id = pin_scenario_version(scenario, conversation)
+    if version_id:
+        scenario_engine = ScenarioEngine.for_version(version_id, conversation.current_state, chat_bot)
+        return scenario_engine.process_user_input(user_message, context)
+    return _no_scenario_response(chat_bot.generate_response(user_message))
+
+
+async def aprocess_message(bot, scenario, conversation, user_message: str, context: str) -> Dict[str, Any]:
+    chat_bot = get_chat_backend(bot.bot_config)
+    version_id = pin_scenario_version(scenario, conversation)
+    if version_id:
+        scenario_engine = await ScenarioEngine.afor_version(version_id, conversation.current_state, chat_bot)
+        return await scenario_engine.aprocess_user_input(user_message, context)
+    return _no_scenario_response(await chat_bot.agenerate_response(user_message))
+
+
+def save_conversation_steps(scenario, conversation, user_message: str, bot_response: str):
+    payloads = [(user_message, 'user_input'), (bot_response, 'bot_response')]
+    if settings.CHAT_STEP_WRITE_BEHIND:
+        step_writer.submit(scenario.pk, payloads, conversation.pk)
+    else:
+        append_steps(scenario.pk, payloads, conversation.pk)
+
+
+asave_conversation_steps = sync_to_async(save_conversation_steps)
+
+
+def update_session(bot, conversation, user_message: str, bot_response_data: Dict[str, Any]):
+    next_state = bot_response_data.get('next_state')
+    if bot_response_data['is_finished'] and conversation.current_state == next_state:
+        next_state = None
+    conversation.record_turn(user_message, bot_response_data['response'], next_state)
+    ContextBuilder.for_bot(bot).compact(conversation)
+
+
+def run_chat_turn(bot, end_user_id: str, user_message: str, strict: bool = False) -> Dict[str, Any]:
+    session_store = get_session_store()
+    for attempt in range(1, settings.CHAT_SESSION_SAVE_ATTEMPTS + 1):
+        with phase('session_load'):
+            active_scenario = get_or_create_active_scenario(bot)
+            conversation = session_store.load(bot, active_scenario, end_user_id)
+        with phase('context'):
+            conversation_context = get_conversation_context(bot, conversation)
+        with phase('engine'):
+            bot_response_data = process_message(
+                bot, active_scenario, conversation, user_message, conversation_context
+            )
+        if strict and is_failed_response(bot_response_data):
+            # Ход не сохраняется, чтобы его можно было безопасно повторить
+            raise ChatTurnError(bot_response_data.get('error') or bot_response_data['response'])
+        with phase('persist'):
+            update_session(bot, conversation, user_message, bot_response_data)
+            try:
+                # Сессия сохраняется раньше шагов: проигравший гонку ход ничего не успевает записать
+                session_store.save(conversation)
+            except SessionConflict:
+                if attempt == settings.CHAT_SESSION_SAVE_ATTEMPTS:
+                    raise
+                logger.info("Разговор %s изменён параллельно, ход выполняется заново", conversation.pk)
+                continue
+            save_conversation_steps(active_scenario, conversation, user_message, bot_response_data['response'])
+        return bot_response_data
+
+
+async def arun_chat_turn(bot, end_user_id: str, user_message: str) -> Dict[str, Any]:
+    session_store = get_session_store()
+    for attempt in range(1, settings.CHAT_SESSION_SAVE_ATTEMPTS + 1):
+        with phase('session_load'):
+            active_scenario = await aget_or_create_active_scenario(bot)
+            conversation = await session_store.aload(bot, active_scenario, end_user_id)
+        with phase('context'):
+            conversation_context = get_conversation_context(bot, conversation)
+        with phase('engine'):
+            bot_response_data = await aprocess_message(
+                bot, active_scenario, conversation, user_message, conversation_context
+            )
+        with phase('persist'):
+            update_session(bot, conversation, user_message, bot_response_data)
+            try:
+                await session_store.asave(conversation)
+            except SessionConflict:
+                if attempt == settings.CHAT_SESSION_SAVE_ATTEMPTS:
+                    raise
+                logger.info("Разговор %s изменён параллельно, ход выполняется заново", conversation.pk)
+                continue
+            await asave_conversation_steps(active_scenario, conversation, user_message, bot_response_data['response'])
+        return bot_response_data
+
+
+def event_stream_response(events) -> StreamingHttpResponse:
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def astream_chat_turn(bot, end_user_id: str, user_message: str):
+    session_store = get_session_store()
+    with phase('session_load'):
+        active_scenario = await aget_or_create_active_scenario(bot)
+        conversation = await session_store.aload(bot, active_scenario, end_user_id)
+    with phase('context'):
+        conversation_context = get_conversation_context(bot, conversation)
+
+    chat_bot = get_chat_backend(bot.bot_config)
+    version_id = pin_scenario_version(active_scenario, conversation)
+    if version_id:
+        scenario_engine = await ScenarioEngine.afor_version(version_id, conversation.current_state, chat_bot)
+        events = scenario_engine.astream_user_input(user_message, conversation_context)
+    else:
+        events = _astream_without_scenario(chat_bot, user_message)
+
+    # Тело потока отдаётся после выхода из middleware трассировки, поэтому фаза пишется в метрику явно;
+    # в её время входит только ожидание движка, но не отправка токенов медленному клиенту
+    bot_response_data = None
+    engine_time = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                event, data = await events.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                engine_time += time.perf_counter() - started
+            if event == 'token':
+                yield format_sse('token', {'text': data})
+            else:
+                bot_response_data = data
+    except LLMOverloadedError as e:
+        # Статус 200 уже отправлен, поэтому перегрузка сообщается событием потока
+        yield format_sse('error', {'detail': str(e), 'retry_after': e.retry_after})
+        return
+    finally:
+        observe_phase('engine', engine_time)
+
+    if bot_response_data is None:
+        logger.error("Движок сценария завершил поток без итогового ответа")
+        yield format_sse('error', {'detail': "Ответ бота не получен"})
+        return
+
+    with phase('persist'):
+        update_session(bot, conversation, user_message, bot_response_data)
+        try:
+            await session_store.asave(conversation)
+        except SessionConflict as e:
+            # Ответ уже ушёл клиенту токенами, повторить ход незаметно нельзя
+            yield format_sse('error', {'detail': str(e)})
+            return
+        await asave_conversation_steps(active_scenario, conversation, user_message, bot_response_data['response'])
+    yield format_sse('done', bot_response_data)
+
+
+async def _astream_without_scenario(chat_bot, user_message: str):
+    chunks = []
+    try:
+        async for chunk in chat_bot.astream_response(user_message):
+            chunks.append(chunk)
+            yield 'token', chunk
+    except LLMStreamInterrupted:
+        pass
+    yield 'done', _no_scenario_response("".join(chunks).strip())
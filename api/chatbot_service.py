@@ -1,12 +1,52 @@
-
-from openai import OpenAI
+import asyncio
+import logging
 import os
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Tuple
+
+from django.conf import settings
+
+from .metrics import record_llm_call
+
+logger = logging.getLogger(__name__)
+
+LLM_ERROR_RESPONSE = "Извините, произошла ошибка при обработке вашего запроса."
+DEFAULT_SYSTEM_PROMPT = "Ты полезный ассистент. Отвечай на русском языке."
 
 class PseudoBot:
+    def __init__(self, latency_ms: int = 0, **options):
+        self.latency = latency_ms / 1000
+
+    def generate_response(self, prompt: str, context=None):
+        started = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        response = self._reply(prompt)
+        record_llm_call('pseudo', time.perf_counter() - started)
+        return response
+
+    async def agenerate_response(self, prompt: str, context=None):
+        started = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = self._reply(prompt)
+        record_llm_call('pseudo', time.perf_counter() - started)
+        return response
+
+    async def astream_response(self, prompt: str, context=None):
+        yield await self.agenerate_response(prompt, context)
+
+    def cache_signature(self):
+        return {'backend': 'pseudo'}
+
     @staticmethod
-    def generate_response(prompt: str, context=None):
+    def _reply(prompt: str):
         prompt_lower = prompt.lower()
-        
+
         for word in ["привет", "здравствуй", "добрый день"]:
             if word in prompt_lower:
                 return "Привет!!"
@@ -14,44 +54,350 @@ class PseudoBot:
             if word in prompt_lower:
                 return "Прощай!!"
         return "Это тестовый скрипт"
-    
-    @staticmethod
-    def generate_with_context(user_prompt: str):
-        response = PseudoBot.generate_response(user_prompt)
+
+    def generate_with_context(self, user_prompt: str):
+        response = self.generate_response(user_prompt)
         string_f = f"Ввод пользователя: {user_prompt}\nВывод бота: {response}"
         return string_f
-    
+
+
+_http_client = None
+# httpx.AsyncClient привязан к циклу событий, в котором открыл соединения:
+# asgiref и asyncio.run создают новые циклы, поэтому клиент — свой у каждого цикла
+_async_http_clients: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+_http_clients_lock = threading.Lock()
+
+
+def _http_client_options():
+    import httpx
+
+    return {
+        'limits': httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        'timeout': httpx.Timeout(settings.LLM_HTTP_TIMEOUT, connect=settings.LLM_HTTP_CONNECT_TIMEOUT),
+    }
+
+
+def get_http_client(is_async: bool = False):
+    global _http_client
+
+    if is_async:
+        loop = asyncio.get_running_loop()
+        with _http_clients_lock:
+            client = _async_http_clients.get(loop)
+            if client is None:
+                from openai import DefaultAsyncHttpxClient
+
+                client = DefaultAsyncHttpxClient(**_http_client_options())
+                _async_http_clients[loop] = client
+            return client
+
+    with _http_clients_lock:
+        if _http_client is None:
+            from openai import DefaultHttpxClient
+
+            _http_client = DefaultHttpxClient(**_http_client_options())
+        return _http_client
+
+
+async def aclose_http_client():
+    """Закрывает пул соединений текущего цикла; вызывать перед завершением долгоживущего цикла."""
+    with _http_clients_lock:
+        client = _async_http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
 class DeepSeekBot:
-    def __init__(self):
+    def __init__(self, model: str = "deepseek-chat", temperature: float = 0.7, max_tokens: int = 500, **options):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.base_url = "https://api.deepseek.com"
+        self._client = None
+        self._async_clients: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+
+    def _api_key(self):
         key=os.getenv('DEEPSEEK_API_KEY', '')
         if not key:
             raise ValueError("DEEPSEEK_API_KEY не найден")
-        self.client = OpenAI(
-            api_key=key,
-            base_url="https://api.deepseek.com"
+        return key
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+
+            self._client = OpenAI(
+                api_key=self._api_key(),
+                base_url=self.base_url,
+                http_client=get_http_client(),
+            )
+        return self._client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            from openai import AsyncOpenAI
+
+            client = AsyncOpenAI(
+                api_key=self._api_key(),
+                base_url=self.base_url,
+                http_client=get_http_client(is_async=True),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    def cache_signature(self):
+        return {
+            'backend': 'deepseek',
+            'model': self.model,
+            'system_prompt': DEFAULT_SYSTEM_PROMPT,
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+        }
+
+    def _completion_kwargs(self, prompt: str, stream: bool = False):
+        return {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": DEFAULT_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            'max_tokens': self.max_tokens,
+            'temperature': self.temperature,
+            'stream': stream,
+            **({'stream_options': {'include_usage': True}} if stream else {}),
+        }
+
+    @staticmethod
+    def _record(started: float, outcome: str, usage=None):
+        record_llm_call(
+            'deepseek',
+            time.perf_counter() - started,
+            outcome,
+            tokens_in=getattr(usage, 'prompt_tokens', None),
+            tokens_out=getattr(usage, 'completion_tokens', None),
         )
 
     def generate_response(self, prompt: str, context=None):
+        started = time.perf_counter()
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": "Ты полезный ассистент. Отвечай на русском языке."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
-            
+            response = self.client.chat.completions.create(**self._completion_kwargs(prompt))
+            self._record(started, 'ok', response.usage)
+
             return response.choices[0].message.content.strip() # type: ignore
-            
+
+        except Exception as e:
+            self._record(started, 'error')
+            logger.warning("Ошибка с DeepSeek API: %s", e)
+            return LLM_ERROR_RESPONSE
+
+    async def agenerate_response(self, prompt: str, context=None):
+        started = time.perf_counter()
+        try:
+            response = await self.async_client.chat.completions.create(**self._completion_kwargs(prompt))
+            self._record(started, 'ok', response.usage)
+
+            return response.choices[0].message.content.strip() # type: ignore
+
+        except Exception as e:
+            self._record(started, 'error')
+            logger.warning("Ошибка с DeepSeek API: %s", e)
+            return LLM_ERROR_RESPONSE
+
+    async def astream_response(self, prompt: str, context=None):
+        started = time.perf_counter()
+        sent_any = False
+        usage = None
+        try:
+            stream = await self.async_client.chat.completions.create(**self._completion_kwargs(prompt, stream=True))
+            async for chunk in stream:
+                usage = chunk.usage or usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    sent_any = True
+                    yield delta
+            self._record(started, 'ok', usage)
+
         except Exception as e:
-            print(f"Ошибка с DeepSeek API: {e}")
-            return "Извините, произошла ошибка при обработке вашего запроса."
-    
+            self._record(started, 'error', usage)
+            logger.warning("Ошибка с DeepSeek API: %s", e)
+            if sent_any:
+                raise LLMStreamInterrupted() from e
+            yield LLM_ERROR_RESPONSE
+
     def generate_with_context(self, user_prompt: str):
         response = self.generate_response(user_prompt)
         return response
 
 
-chat_bot = DeepSeekBot()
\ No newline at end of file
+class LLMStreamInterrupted(Exception):
+    """Поток оборвался после первых фрагментов: ответ неполный и не должен кэшироваться."""
+
+
+class LLMOverloadedError(Exception):
+    def __init__(self, backend_name: str, retry_after: float):
+        super().__init__(f"Превышен лимит одновременных запросов к LLM ({backend_name})")
+        self.backend_name = backend_name
+        self.retry_after = retry_after
+
+
+class ConcurrencyGovernor:
+    """Ограничивает число одновременных запросов процесса к одному бэкенду LLM.
+
+    Один счётчик под threading-блокировкой общий для потоков синхронных
+    воркеров и корутин всех циклов событий. Поток ждёт на Condition,
+    корутина — на future своего цикла, который будит освободивший слот.
+    """
+
+    def __init__(self, backend_name: str, limit: int, timeout: float):
+        self.backend_name = backend_name
+        self.limit = limit
+        self.timeout = timeout
+        self._active = 0
+        self._condition = threading.Condition()
+        self._async_waiters: 'deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]' = deque()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def _release(self):
+        with self._condition:
+            self._active -= 1
+            # Будим по одному ожидающему с каждой стороны: слот достанется тому, кто успеет первым
+            self._condition.notify()
+            self._wake_async_waiter()
+
+    def _wake_async_waiter(self):
+        while self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._resolve, future)
+                return
+            except RuntimeError:
+                # Цикл уже закрыт — его корутина слот не ждёт
+                continue
+
+    def _resolve(self, future: asyncio.Future):
+        if future.done():
+            # Ожидающий успел отказаться по таймауту: передаём пробуждение следующему
+            with self._condition:
+                self._wake_async_waiter()
+            return
+        future.set_result(None)
+
+    @contextmanager
+    def acquire(self):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._active < self.limit, self.timeout):
+                raise LLMOverloadedError(self.backend_name, self.timeout)
+            self._active += 1
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _aacquire_slot(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while True:
+            with self._condition:
+                if self._active < self.limit:
+                    self._active += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter[1], max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                with self._condition:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+                raise LLMOverloadedError(self.backend_name, self.timeout) from None
+
+    @asynccontextmanager
+    async def aacquire(self):
+        await self._aacquire_slot()
+        try:
+            yield
+        finally:
+            self._release()
+
+
+class GovernedBackend:
+    def __init__(self, backend, governor: ConcurrencyGovernor):
+        self.backend = backend
+        self.governor = governor
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def generate_response(self, prompt: str, context=None):
+        with self.governor.acquire():
+            return self.backend.generate_response(prompt, context)
+
+    async def agenerate_response(self, prompt: str, context=None):
+        async with self.governor.aacquire():
+            return await self.backend.agenerate_response(prompt, context)
+
+    async def astream_response(self, prompt: str, context=None):
+        async with self.governor.aacquire():
+            async for chunk in self.backend.astream_response(prompt, context):
+                yield chunk
+
+
+CHAT_BACKENDS = {
+    'deepseek': DeepSeekBot,
+    'pseudo': PseudoBot,
+}
+
+BACKEND_OPTIONS = ('model', 'temperature', 'max_tokens', 'latency_ms')
+
+_backends = {}
+_backends_lock = threading.Lock()
+_governors = {}
+
+
+def register_backend(name: str, backend_class):
+    CHAT_BACKENDS[name] = backend_class
+
+
+def get_governor(name: str):
+    limit = settings.LLM_MAX_CONCURRENCY.get(name)
+    if not limit:
+        return None
+    governor = _governors.get(name)
+    if governor is None:
+        governor = ConcurrencyGovernor(name, limit, settings.LLM_QUEUE_TIMEOUT)
+        _governors[name] = governor
+    return governor
+
+
+def get_chat_backend(bot_config=None):
+    bot_config = bot_config or {}
+    name = bot_config.get('backend') or settings.CHAT_BACKEND
+    if name not in CHAT_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд LLM: {name}")
+    options = {key: bot_config[key] for key in BACKEND_OPTIONS if key in bot_config}
+    cache_key = (name, tuple(sorted(options.items())))
+
+    backend = _backends.get(cache_key)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(cache_key)
+            if backend is None:
+                backend = CHAT_BACKENDS[name](**options)
+                governor = get_governor(name)
+                if governor is not None:
+                    backend = GovernedBackend(backend, governor)
+                _backends[cache_key] = backend
+    return backend
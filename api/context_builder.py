@@ -0,0 +1,104 @@
+import re
+from typing import Any, Dict, List
+
+from django.conf import settings
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+ROLE_NAMES = {
+    'user_input': "Пользователь",
+    'bot_response': "Бот",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    # Грубая оценка под BPE-токенизаторы: длинные слова (особенно кириллица) бьются на несколько токенов
+    tokens = 0
+    for match in _TOKEN_RE.finditer(text):
+        tokens += len(match.group()) // 4 + 1
+    return tokens
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    tokens = 0
+    for match in _TOKEN_RE.finditer(text):
+        tokens += len(match.group()) // 4 + 1
+        if tokens > max_tokens:
+            return text[:match.start()].rstrip() + "…"
+    return text
+
+
+def format_line(line: Dict[str, Any]) -> str:
+    return f"{ROLE_NAMES.get(line['step_type'], 'Бот')}: {line['content']}"
+
+
+class ContextBuilder:
+    """Собирает контекст диалога в пределах бюджета токенов.
+
+    Свежие реплики хранятся дословно в conversation.context, вытесненные из
+    окна сжимаются до первой фразы и дописываются в conversation.summary.
+    """
+
+    def __init__(self, token_budget: int, summary_budget: int, max_lines: int, line_budget: int):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.max_lines = max_lines
+        self.line_budget = line_budget
+
+    @classmethod
+    def for_bot(cls, bot) -> 'ContextBuilder':
+        bot_config = bot.bot_config or {}
+        return cls(
+            token_budget=bot_config.get('context_token_budget', settings.CHAT_CONTEXT_TOKEN_BUDGET),
+            summary_budget=bot_config.get('summary_token_budget', settings.CHAT_SUMMARY_TOKEN_BUDGET),
+            max_lines=bot_config.get('context_turns', settings.CHAT_CONTEXT_TURNS) * 2,
+            line_budget=settings.CHAT_SUMMARY_LINE_TOKENS,
+        )
+
+    def build(self, conversation) -> str:
+        parts = []
+        remaining = self.token_budget
+        if conversation.summary:
+            summary = truncate_to_tokens(conversation.summary, min(self.summary_budget, remaining))
+            parts.append(f"Ранее в диалоге:\n{summary}")
+            remaining -= estimate_tokens(summary)
+
+        recent: List[str] = []
+        for line in reversed(conversation.context):
+            text = format_line(line)
+            cost = estimate_tokens(text)
+            if cost > remaining:
+                if not recent and remaining > 0:
+                    recent.append(truncate_to_tokens(text, remaining))
+                break
+            recent.append(text)
+            remaining -= cost
+        if recent:
+            parts.append("\n".join(reversed(recent)))
+        return "\n\n".join(parts)
+
+    def compact(self, conversation):
+        window_budget = max(self.token_budget - self.summary_budget, 0)
+        context = list(conversation.context)
+        evicted = []
+        window_tokens = sum(estimate_tokens(format_line(line)) for line in context)
+        while context and (len(context) > self.max_lines or window_tokens > window_budget):
+            line = context.pop(0)
+            window_tokens -= estimate_tokens(format_line(line))
+            evicted.append(line)
+
+        if evicted:
+            conversation.context = context
+            conversation.summary = self._extend_summary(conversation.summary, evicted)
+
+    def _extend_summary(self, summary: str, evicted: List[Dict[str, Any]]) -> str:
+        lines = summary.split("\n") if summary else []
+        for line in evicted:
+            first_sentence = _SENTENCE_END_RE.split(line['content'].strip(), maxsplit=1)[0]
+            lines.append(truncate_to_tokens(format_line({**line, 'content': first_sentence}), self.line_budget))
+
+        total = sum(estimate_tokens(line) for line in lines)
+        while lines and total > self.summary_budget:
+            total -= estimate_tokens(lines.pop(0))
+        return "\n".join(lines)
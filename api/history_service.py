@@ -0,0 +1,83 @@
+import heapq
+import json
+from operator import itemgetter
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from django.db.models import QuerySet
+
+from .models import Conversation, Step, StepArchive
+from .step_archive import iter_archived, read_archived
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ('conversation_id', 'order', 'step_type', 'content', 'created_at')
+
+
+def _history_source(owner) -> Tuple[QuerySet, str, Optional[QuerySet]]:
+    """Шаги разговора листаются по своему order (индекс conversation+order),
+    шаги сценария — по id, потому что order у разных разговоров повторяется.
+
+    Третий элемент — архивные блоки владельца, если что-то уже перенесено из Step.
+    """
+    if isinstance(owner, Conversation):
+        archives = StepArchive.objects.filter(conversation=owner) if owner.archived_steps else None
+        return Step.objects.filter(conversation=owner).defer('search_vector'), 'order', archives
+    archives = StepArchive.objects.filter(scenario=owner) if owner.archived_steps else None
+    return Step.objects.filter(scenario=owner).defer('search_vector'), 'id', archives
+
+
+def _by_key(key: str):
+    return lambda step: getattr(step, key)
+
+
+def get_history_page(owner, before: Optional[int] = None, after: Optional[int] = None,
+                     limit: int = 50) -> Dict[str, Any]:
+    queryset, key, archives = _history_source(owner)
+    if after is not None:
+        steps = list(queryset.filter(**{f'{key}__gt': after}).order_by(key)[:limit + 1])
+        if archives is not None:
+            upper = getattr(steps[-1], key) if len(steps) > limit else None
+            steps = sorted(steps + read_archived(archives, key, after, upper, False, limit + 1), key=_by_key(key))
+            steps = steps[:limit + 1]
+        has_more = len(steps) > limit
+        steps = steps[:limit]
+        newer_available, older_available = has_more, after is not None
+    else:
+        if before is not None:
+            queryset = queryset.filter(**{f'{key}__lt': before})
+        steps = list(queryset.order_by(f'-{key}')[:limit + 1])
+        if archives is not None:
+            lower = getattr(steps[-1], key) if len(steps) > limit else None
+            steps = sorted(steps + read_archived(archives, key, lower, before, True, limit + 1),
+                           key=_by_key(key), reverse=True)
+            steps = steps[:limit + 1]
+        has_more = len(steps) > limit
+        steps = steps[:limit][::-1]
+        newer_available, older_available = before is not None, has_more
+
+    return {
+        'steps': steps,
+        'before': getattr(steps[0], key) if steps and older_available else None,
+        'after': getattr(steps[-1], key) if steps and newer_available else None,
+    }
+
+
+def _archived_rows(archives: QuerySet, key: str) -> Iterator[Dict[str, Any]]:
+    for step in iter_archived(archives, key):
+        yield {field: getattr(step, field) for field in ('id',) + EXPORT_FIELDS}
+
+
+def iter_transcript(owner) -> Iterator[str]:
+    queryset, key, archives = _history_source(owner)
+    steps = (
+        queryset
+        .order_by(key)
+        .values('id', *EXPORT_FIELDS)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    # По id архив сценария пересекается с горячими шагами активных разговоров, поэтому потоки сливаются
+    if archives is not None:
+        steps = heapq.merge(_archived_rows(archives, key), steps, key=itemgetter(key))
+    for step in steps:
+        del step['id']
+        step['created_at'] = step['created_at'].isoformat()
+        yield json.dumps(step, ensure_ascii=False) + "\n"
@@ -0,0 +1,85 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+from .stemmer import stem, tokenize
+
+DEFAULT_THRESHOLD = 0.35
+
+
+def _features(stems: List[str]) -> List[str]:
+    # Основы слов и пары соседних основ: пары различают "не работает" и "работает"
+    return stems + [f"{first} {second}" for first, second in zip(stems, stems[1:])]
+
+
+def _normalize(vector: Dict[str, float]) -> Dict[str, float]:
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    if not norm:
+        return {}
+    return {term: weight / norm for term, weight in vector.items()}
+
+
+class IntentClassifier:
+    """TF-IDF классификатор по ближайшему центроиду без внешних зависимостей.
+
+    Обучается на примерах фраз для каждой метки (обычно — целевого состояния
+    перехода) при компиляции сценария; classify стоит одного прохода по
+    признакам реплики и скалярного произведения с каждым центроидом.
+    """
+
+    def __init__(self, examples: Dict[str, List[str]], threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        documents: List[Tuple[str, Dict[str, int]]] = []
+        document_frequency: Dict[str, int] = {}
+        for label, phrases in examples.items():
+            for phrase in phrases:
+                counts: Dict[str, int] = {}
+                for term in _features([stem(token) for token in tokenize(phrase)]):
+                    counts[term] = counts.get(term, 0) + 1
+                if not counts:
+                    continue
+                documents.append((label, counts))
+                for term in counts:
+                    document_frequency[term] = document_frequency.get(term, 0) + 1
+
+        total = len(documents)
+        self.idf = {term: math.log((1 + total) / (1 + frequency)) + 1 for term, frequency in document_frequency.items()}
+
+        sums: Dict[str, Dict[str, float]] = {}
+        sizes: Dict[str, int] = {}
+        for label, counts in documents:
+            vector = self._weigh(counts)
+            centroid = sums.setdefault(label, {})
+            for term, weight in vector.items():
+                centroid[term] = centroid.get(term, 0.0) + weight
+            sizes[label] = sizes.get(label, 0) + 1
+        self.centroids = {
+            label: _normalize({term: weight / sizes[label] for term, weight in centroid.items()})
+            for label, centroid in sums.items()
+        }
+
+    def _weigh(self, counts: Dict[str, int]) -> Dict[str, float]:
+        return _normalize({
+            term: (1 + math.log(count)) * self.idf[term]
+            for term, count in counts.items() if term in self.idf
+        })
+
+    def scores(self, stems: List[str]) -> Dict[str, float]:
+        counts: Dict[str, int] = {}
+        for term in _features(stems):
+            counts[term] = counts.get(term, 0) + 1
+        vector = self._weigh(counts)
+        if not vector:
+            return {}
+        return {
+            label: sum(weight * centroid.get(term, 0.0) for term, weight in vector.items())
+            for label, centroid in self.centroids.items()
+        }
+
+    def classify(self, stems: List[str]) -> Optional[Tuple[str, float]]:
+        scores = self.scores(stems)
+        if not scores:
+            return None
+        label = max(scores, key=scores.get)
+        if scores[label] < self.threshold:
+            return None
+        return label, scores[label]
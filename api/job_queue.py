@@ -0,0 +1,190 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .chat_service import ChatTurnError, run_chat_turn
+from .chatbot_service import LLMOverloadedError
+from .models import Bot, ChatJob
+from .session_store import SessionConflict
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED_STATUSES = ('queued', 'running')
+
+
+def enqueue_chat_job(bot, end_user_id: str, message: str) -> ChatJob:
+    return ChatJob.objects.create(bot=bot, end_user_id=end_user_id, message=message)
+
+
+async def aenqueue_chat_job(bot, end_user_id: str, message: str) -> ChatJob:
+    return await ChatJob.objects.acreate(bot=bot, end_user_id=end_user_id, message=message)
+
+
+def serialize_job(job: ChatJob) -> Dict[str, Any]:
+    return {
+        'job_id': job.pk,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.error or None,
+    }
+
+
+def retry_delay(attempts: int) -> float:
+    delay = settings.CHAT_JOB_RETRY_BASE_DELAY * (2 ** (attempts - 1))
+    return min(delay, settings.CHAT_JOB_RETRY_MAX_DELAY) * random.uniform(0.8, 1.2)
+
+
+def _claimable_jobs(now):
+    # Ход диалога не берётся, пока не завершены более ранние сообщения того же собеседника
+    earlier_unfinished = ChatJob.objects.filter(
+        bot_id=OuterRef('bot_id'),
+        end_user_id=OuterRef('end_user_id'),
+        status__in=UNFINISHED_STATUSES,
+        id__lt=OuterRef('id'),
+    )
+    return (
+        ChatJob.objects
+        .filter(
+            Q(status='queued', run_at__lte=now) |
+            Q(status='running', locked_until__lt=now)
+        )
+        .filter(~Exists(earlier_unfinished))
+        .order_by('run_at', 'id')
+    )
+
+
+def _bot_has_capacity(bot_id: int, now) -> bool:
+    bot = Bot.objects.select_for_update(skip_locked=True).filter(pk=bot_id).first()
+    if bot is None:
+        return False
+    limit = bot.bot_config.get('max_concurrent_jobs', settings.CHAT_JOB_BOT_CONCURRENCY)
+    running = ChatJob.objects.filter(bot_id=bot_id, status='running', locked_until__gte=now).count()
+    return running < limit
+
+
+def claim_job() -> Optional[ChatJob]:
+    now = timezone.now()
+    with transaction.atomic():
+        candidates = _claimable_jobs(now).select_for_update(skip_locked=True, of=('self',))
+        for job in candidates[:settings.CHAT_JOB_CLAIM_BATCH]:
+            if not _bot_has_capacity(job.bot_id, now):
+                continue
+            job.status = 'running'
+            job.attempts += 1
+            job.locked_until = now + timedelta(seconds=settings.CHAT_JOB_LEASE_SECONDS)
+            job.save(update_fields=['status', 'attempts', 'locked_until', 'updated_at'])
+            return job
+    return None
+
+
+# Повторять можно только ошибки, возникшие до сохранения хода: иначе повтор задвоит вызов LLM и шаги
+RETRYABLE_ERRORS = (ChatTurnError, LLMOverloadedError, SessionConflict)
+
+
+def extend_lease(job: ChatJob) -> bool:
+    locked_until = timezone.now() + timedelta(seconds=settings.CHAT_JOB_LEASE_SECONDS)
+    return bool(
+        ChatJob.objects
+        .filter(pk=job.pk, attempts=job.attempts, status='running')
+        .update(locked_until=locked_until)
+    )
+
+
+@contextmanager
+def lease_heartbeat(job: ChatJob):
+    stop_event = threading.Event()
+
+    def beat():
+        try:
+            while not stop_event.wait(settings.CHAT_JOB_LEASE_SECONDS / 3):
+                if not extend_lease(job):
+                    logger.warning("Аренда задачи чата %s перехвачена другим воркером", job.pk)
+                    return
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'chat-job-{job.pk}-lease', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        thread.join()
+
+
+def _finish_job(job: ChatJob, **fields) -> bool:
+    # Условие на attempts не даёт воркеру с истёкшей арендой перезаписать результат нового владельца
+    updated = (
+        ChatJob.objects
+        .filter(pk=job.pk, attempts=job.attempts)
+        .update(locked_until=None, updated_at=timezone.now(), **fields)
+    )
+    if not updated:
+        logger.warning("Задача чата %s (попытка %s) уже перехвачена, результат отброшен", job.pk, job.attempts)
+    return bool(updated)
+
+
+def run_job(job: ChatJob):
+    try:
+        with lease_heartbeat(job):
+            result = run_chat_turn(job.bot, job.end_user_id, job.message, strict=True)
+    except RETRYABLE_ERRORS as e:
+        logger.warning("Ошибка выполнения задачи чата %s (попытка %s): %s", job.pk, job.attempts, e)
+        if job.attempts >= settings.CHAT_JOB_MAX_ATTEMPTS:
+            _finish_job(job, status='failed', error=str(e))
+        else:
+            run_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+            _finish_job(job, status='queued', error=str(e), run_at=run_at)
+        return
+    except Exception as e:
+        logger.exception("Задача чата %s завершилась неповторяемой ошибкой: %s", job.pk, e)
+        _finish_job(job, status='failed', error=str(e))
+        return
+
+    _finish_job(job, status='done', result=result, error='')
+
+
+class ChatJobWorkerPool:
+    def __init__(self, workers: int, poll_interval: float):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+
+    def _work(self):
+        while not self.stop_event.is_set():
+            try:
+                job = claim_job()
+                if job is None:
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+                run_job(job)
+            except Exception as e:
+                logger.exception("Ошибка воркера очереди чата: %s", e)
+                self.stop_event.wait(self.poll_interval)
+            finally:
+                close_old_connections()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self._work, name=f'chat-worker-{index}', daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            self.stop_event.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .chatbot_service import LLM_ERROR_RESPONSE
+from .metrics import record_cache_result
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    # Схлопываем только пробельные символы: регистр и пунктуация меняют смысл запроса
+    return " ".join(prompt.split())
+
+
+def make_cache_key(signature: Dict[str, Any], prompt: str) -> str:
+    payload = json.dumps(
+        {'signature': signature, 'prompt': normalize_prompt(prompt)},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return 'llm:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._items: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: int):
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+CACHE_RESULTS = {'local_hits': 'local_hit', 'shared_hits': 'shared_hit', 'misses': 'miss'}
+
+
+class ResponseCache:
+    """Двухуровневый кэш ответов LLM: LRU в процессе и общий Django cache."""
+
+    def __init__(self, maxsize: int, default_ttl: int, shared_alias: Optional[str]):
+        self.local = LRUCache(maxsize)
+        self.default_ttl = default_ttl
+        self.shared_alias = shared_alias
+        self._counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def resolve_ttl(self, cache_option) -> Optional[int]:
+        if cache_option is True:
+            return self.default_ttl
+        if isinstance(cache_option, int) and not isinstance(cache_option, bool) and cache_option > 0:
+            return cache_option
+        return None
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+        record_cache_result(CACHE_RESULTS[counter])
+
+    def _shared_call(self, method, *args):
+        try:
+            return method(*args)
+        except Exception as e:
+            logger.warning("Ошибка общего кэша ответов LLM: %s", e)
+            return None
+
+    async def _ashared_call(self, method, *args):
+        try:
+            return await method(*args)
+        except Exception as e:
+            logger.warning("Ошибка общего кэша ответов LLM: %s", e)
+            return None
+
+    def get(self, key: str, ttl: Optional[int] = None) -> Optional[str]:
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+        if self.shared is not None:
+            value = self._shared_call(self.shared.get, key)
+            if value is not None:
+                # Локальная копия живёт не дольше, чем задано в состоянии сценария
+                self.local.set(key, value, ttl or self.default_ttl)
+                self._count('shared_hits')
+                return value
+        self._count('misses')
+        return None
+
+    async def aget(self, key: str, ttl: Optional[int] = None) -> Optional[str]:
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+        if self.shared is not None:
+            value = await self._ashared_call(self.shared.aget, key)
+            if value is not None:
+                # Локальная копия живёт не дольше, чем задано в состоянии сценария
+                self.local.set(key, value, ttl or self.default_ttl)
+                self._count('shared_hits')
+                return value
+        self._count('misses')
+        return None
+
+    def set(self, key: str, value: str, ttl: int):
+        if value == LLM_ERROR_RESPONSE:
+            return
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            self._shared_call(self.shared.set, key, value, ttl)
+
+    async def aset(self, key: str, value: str, ttl: int):
+        if value == LLM_ERROR_RESPONSE:
+            return
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            await self._ashared_call(self.shared.aset, key, value, ttl)
+
+    def generate(self, backend, prompt: str, ttl: int) -> str:
+        key = make_cache_key(backend.cache_signature(), prompt)
+        value = self.get(key, ttl)
+        if value is None:
+            value = backend.generate_response(prompt)
+            self.set(key, value, ttl)
+        return value
+
+    async def agenerate(self, backend, prompt: str, ttl: int) -> str:
+        key = make_cache_key(backend.cache_signature(), prompt)
+        value = await self.aget(key, ttl)
+        if value is None:
+            value = await backend.agenerate_response(prompt)
+            await self.aset(key, value, ttl)
+        return value
+
+    async def astream(self, backend, prompt: str, ttl: int):
+        key = make_cache_key(backend.cache_signature(), prompt)
+        value = await self.aget(key, ttl)
+        if value is not None:
+            yield value
+            return
+        chunks = []
+        # Оборванный поток (LLMStreamInterrupted) выходит исключением до aset и не кэшируется
+        async for chunk in backend.astream_response(prompt):
+            chunks.append(chunk)
+            yield chunk
+        await self.aset(key, "".join(chunks).strip(), ttl)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats['local_size'] = len(self.local)
+        return stats
+
+
+response_cache = ResponseCache(
+    maxsize=getattr(settings, 'LLM_CACHE_SIZE', 1024),
+    default_ttl=getattr(settings, 'LLM_CACHE_TTL', 3600),
+    shared_alias=getattr(settings, 'LLM_CACHE_ALIAS', None),
+)
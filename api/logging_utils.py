@@ -0,0 +1,29 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+from .metrics import get_request_id
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        if not getattr(record, 'request_id', None):
+            record.request_id = get_request_id() or '-'
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись журнала — одна строка JSON; поля из extra={'fields': {...}} попадают на верхний уровень."""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None) or get_request_id(),
+        }
+        payload.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
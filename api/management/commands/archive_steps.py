@@ -0,0 +1,61 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api.models import Step
+from api.step_archive import (
+    archivable_conversations, archivable_legacy_scenarios, archive_conversation, archive_legacy_steps, check_codec,
+)
+
+
+class Command(BaseCommand):
+    help = ("Переносит шаги давно неактивных разговоров (и старые шаги сценариев без разговора) "
+            "из таблицы Step в сжатый архив StepArchive")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.STEP_ARCHIVE_AFTER_DAYS,
+                            help="Архивировать разговоры без активности дольше стольких дней")
+        parser.add_argument('--codec', default=settings.STEP_ARCHIVE_CODEC, help="gzip или zstd")
+        parser.add_argument('--limit', type=int, default=None, help="Максимум разговоров (и отдельно сценариев) за запуск")
+        parser.add_argument('--dry-run', action='store_true', help="Только посчитать разговоры")
+        parser.add_argument('--vacuum', action='store_true', help="VACUUM ANALYZE таблицы шагов после переноса (Postgres)")
+
+    def handle(self, *args, older_than_days, codec, limit=None, dry_run=False, vacuum=False, **options):
+        try:
+            check_codec(codec)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        cutoff = timezone.now() - timedelta(days=older_than_days)
+        conversation_ids = archivable_conversations(cutoff).values_list('id', flat=True)
+        if limit is not None:
+            conversation_ids = conversation_ids[:limit]
+        conversation_ids = list(conversation_ids)
+        scenario_ids = archivable_legacy_scenarios(cutoff).values_list('id', flat=True)
+        if limit is not None:
+            scenario_ids = scenario_ids[:limit]
+        scenario_ids = list(scenario_ids)
+        if dry_run:
+            self.stdout.write(f"Разговоров к архивации: {len(conversation_ids)}, "
+                              f"сценариев с шагами без разговора: {len(scenario_ids)}")
+            return
+
+        archived = 0
+        for conversation_id in conversation_ids:
+            archived += archive_conversation(conversation_id, codec)
+        for scenario_id in scenario_ids:
+            archived += archive_legacy_steps(scenario_id, codec)
+        self.stdout.write(
+            f"Заархивировано шагов: {archived} из разговоров: {len(conversation_ids)}, "
+            f"сценариев с шагами без разговора: {len(scenario_ids)} ({codec})"
+        )
+
+        if vacuum and archived:
+            if connection.vendor != 'postgresql':
+                self.stdout.write("VACUUM пропущен: поддерживается только Postgres")
+                return
+            with connection.cursor() as cursor:
+                cursor.execute(f"VACUUM (ANALYZE) {connection.ops.quote_name(Step._meta.db_table)}")
@@ -0,0 +1,77 @@
+import fnmatch
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from api.benchmarks import BENCHMARKS, BenchmarkEnv
+
+
+class Command(BaseCommand):
+    help = "Бенчмарки горячего пути чата на одноразовой тестовой БД с проверкой числа запросов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('patterns', nargs='*', help="Маски имён бенчмарков, например engine.* или api.chat")
+        parser.add_argument('--rounds', type=int, help="Переопределить число повторов для всех бенчмарков")
+        parser.add_argument('--history-steps', type=int, default=20000)
+        parser.add_argument('--save-baseline', help="Сохранить результаты в JSON")
+        parser.add_argument('--compare', help="Сравнить с сохранённым JSON")
+        parser.add_argument('--max-regression', type=float, default=0.25,
+                            help="Допустимое замедление медианы относительно базовой линии (доля)")
+
+    def handle(self, *args, patterns, rounds=None, history_steps=20000, save_baseline=None, compare=None,
+               max_regression=0.25, **options):
+        selected = [
+            bench for bench in BENCHMARKS
+            if not patterns or any(fnmatch.fnmatch(bench.name, pattern) for pattern in patterns)
+        ]
+        if not selected:
+            raise CommandError("Ни один бенчмарк не подходит под маски")
+
+        baseline = {}
+        if compare:
+            with open(compare, encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)
+
+        results = self._run(selected, rounds, history_steps)
+
+        failures = []
+        for name, result in results.items():
+            line = (
+                f"{name:<28} {result['median_ms']:>10.3f} мс  p95 {result['p95_ms']:>10.3f} мс  "
+                f"{result['ops_per_sec']:>10.0f} оп/с  запросов {result['queries']}"
+            )
+            if result['max_queries'] is not None and result['queries'] > result['max_queries']:
+                failures.append(f"{name}: {result['queries']} запросов при лимите {result['max_queries']}")
+            previous = baseline.get(name)
+            if previous:
+                change = result['median_ms'] / previous['median_ms'] - 1 if previous['median_ms'] else 0.0
+                line += f"  {change:+.1%} к базе"
+                if change > max_regression:
+                    failures.append(f"{name}: медиана медленнее базы на {change:.1%}")
+                if result['queries'] > previous['queries']:
+                    failures.append(f"{name}: запросов {result['queries']}, в базе {previous['queries']}")
+            self.stdout.write(line)
+
+        if save_baseline:
+            with open(save_baseline, 'w', encoding='utf-8') as baseline_file:
+                json.dump(results, baseline_file, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты сохранены в {save_baseline}")
+
+        if failures:
+            for failure in failures:
+                self.stdout.write(self.style.ERROR(failure))
+            raise CommandError(f"Регрессий: {len(failures)}")
+        self.stdout.write(self.style.SUCCESS("Бенчмарки пройдены"))
+
+    def _run(self, selected, rounds, history_steps):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(CHAT_RATE_LIMITS={}, CHAT_STEP_WRITE_BEHIND=False, DEBUG=False):
+                env = BenchmarkEnv(history_steps=history_steps)
+                return {bench.name: bench.run(env, rounds) for bench in selected}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.job_queue import ChatJobWorkerPool
+
+
+class Command(BaseCommand):
+    help = "Запускает пул воркеров, выполняющих задачи чата из очереди в БД"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.CHAT_JOB_WORKERS)
+        parser.add_argument('--poll-interval', type=float, default=settings.CHAT_JOB_POLL_INTERVAL)
+
+    def handle(self, *args, workers, poll_interval, **options):
+        self.stdout.write(f"Запуск {workers} воркеров очереди чата")
+        ChatJobWorkerPool(workers, poll_interval).run()
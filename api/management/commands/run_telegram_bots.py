@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.chatbot_service import aclose_http_client
+from api.models import Bot
+from api.telegram_gateway import get_dispatcher, poll_bot, set_webhooks
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Запускает long polling Telegram для всех ботов с telegram_token в bot_config"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bot', type=int, action='append', dest='bot_ids',
+                            help="Ограничиться указанными id ботов")
+        parser.add_argument('--set-webhook', dest='webhook_base_url',
+                            help="Вместо polling зарегистрировать вебхуки на этом базовом URL и выйти")
+
+    def handle(self, *args, bot_ids=None, webhook_base_url=None, **options):
+        bots = Bot.objects.filter(bot_config__has_key='telegram_token')
+        if bot_ids:
+            bots = bots.filter(pk__in=bot_ids)
+        bots = list(bots)
+        if not bots:
+            raise CommandError("Нет ботов с telegram_token в bot_config")
+
+        if webhook_base_url:
+            asyncio.run(set_webhooks(bots, webhook_base_url))
+            self.stdout.write(self.style.SUCCESS(f"Вебхуки зарегистрированы для {len(bots)} ботов"))
+            return
+
+        self.stdout.write(f"Запуск long polling для {len(bots)} ботов")
+        asyncio.run(self._poll(bots))
+
+    async def _poll(self, bots):
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        dispatcher = get_dispatcher()
+        try:
+            results = await asyncio.gather(
+                *(poll_bot(bot, dispatcher, stop_event) for bot in bots), return_exceptions=True,
+            )
+        finally:
+            await aclose_http_client()
+        for bot, result in zip(bots, results):
+            if isinstance(result, Exception):
+                logger.error("Polling %s завершился с ошибкой: %r", bot, result)
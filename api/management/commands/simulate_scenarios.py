@@ -0,0 +1,87 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Scenario
+from api.simulation import load_scripts, simulate
+
+
+class Command(BaseCommand):
+    help = "Прогоняет записанные разговоры (JSONL) через ScenarioEngine без HTTP и считает покрытие и скорость"
+
+    def add_arguments(self, parser):
+        parser.add_argument('scripts', help="Файл JSONL с разговорами")
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--scenario', type=int, dest='scenario_id', help="id сценария в БД")
+        source.add_argument('--scenario-file', help="JSON-файл со scenario_data")
+        parser.add_argument('--draft', action='store_true',
+                            help="С --scenario: прогнать рабочую копию вместо опубликованной версии")
+        parser.add_argument('--recording', help="JSONL с записанными ответами LLM вместо PseudoBot")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--repeat', type=int, default=1, help="Сколько раз повторить набор разговоров")
+        parser.add_argument('--latency-ms', type=int, default=0, help="Искусственная задержка PseudoBot")
+        parser.add_argument('--json', action='store_true', dest='as_json', help="Вывести отчёт в JSON")
+
+    def handle(self, *args, scripts, scenario_id=None, scenario_file=None, draft=False, recording=None,
+               workers=1, repeat=1, latency_ms=0, as_json=False, **options):
+        bot_config = {}
+        scenario_index = None
+        if draft and scenario_id is None:
+            raise CommandError("--draft используется только вместе с --scenario")
+        if scenario_id is not None:
+            scenario = Scenario.objects.select_related('bot', 'published_version').filter(pk=scenario_id).first()
+            if scenario is None:
+                raise CommandError(f"Сценарий {scenario_id} не найден")
+            # По умолчанию — то, что видят пользователи чата: опубликованная версия
+            if draft:
+                scenario_data = scenario.scenario_data
+                scenario_index = scenario.scenario_index
+            elif scenario.published_version is None:
+                raise CommandError(f"Сценарий {scenario_id} не опубликован, для рабочей копии укажите --draft")
+            else:
+                scenario_data = scenario.published_version.scenario_data
+                if scenario.published_version.content_hash == scenario.draft_hash:
+                    scenario_index = scenario.scenario_index
+            bot_config = dict(scenario.bot.bot_config or {})
+        else:
+            with open(scenario_file, encoding='utf-8') as data_file:
+                scenario_data = json.load(data_file)
+        if latency_ms:
+            bot_config['latency_ms'] = latency_ms
+
+        conversations = load_scripts(scripts) * repeat
+        if not conversations:
+            raise CommandError("Файл разговоров пуст")
+
+        report = simulate(scenario_data, conversations, workers, bot_config, recording, scenario_index)
+        if as_json:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        self._print_report(report)
+        if report['mismatches']:
+            raise CommandError(f"Расхождений с ожидаемыми состояниями: {len(report['mismatches'])}")
+
+    def _print_report(self, report):
+        latency = report['latency_ms']
+        self.stdout.write(
+            f"Разговоров: {report['scripts']}, ходов: {report['turns']}, ошибок: {report['errors']}, "
+            f"завершено: {report['finished']}"
+        )
+        self.stdout.write(f"Время: {report['elapsed']:.2f} с, {report['turns_per_sec']:.0f} ходов/с")
+        self.stdout.write(
+            f"Задержка хода, мс: p50={latency['p50']:.3f} p90={latency['p90']:.3f} "
+            f"p99={latency['p99']:.3f} max={latency['max']:.3f}"
+        )
+        self.stdout.write("Попадания в состояния:")
+        for name, hits in sorted(report['state_hits'].items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {name}: {hits}")
+        if report['never_hit']:
+            self.stdout.write(self.style.WARNING(f"Не посещены: {', '.join(report['never_hit'])}"))
+        if report['unreachable']:
+            self.stdout.write(self.style.WARNING(f"Недостижимы из начального состояния: {', '.join(report['unreachable'])}"))
+        for mismatch in report['mismatches'][:20]:
+            self.stdout.write(self.style.ERROR(
+                f"  разговор {mismatch['script']}, ход {mismatch['turn']}: "
+                f"ожидалось {mismatch['expected']}, получено {mismatch['actual']}"
+            ))
@@ -0,0 +1,281 @@
+import contextvars
+import glob
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_registry: Dict[str, 'Metric'] = {}
+
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        _registry[name] = self
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'type': self.type,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'values': [
+                [list(key), list(value) if isinstance(value, list) else value]
+                for key, value in self._values.items()
+            ],
+        }
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with _lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Счётчики по корзинам (последняя — +Inf), затем сумма
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = super().snapshot()
+        snapshot['buckets'] = list(self.buckets)
+        return snapshot
+
+
+HTTP_REQUESTS = Counter('http_requests_total', "HTTP-запросы", ('view', 'method', 'status'))
+HTTP_DURATION = Histogram('http_request_duration_seconds', "Время обработки HTTP-запроса", ('view',))
+DB_QUERIES = Counter('db_queries_total', "SQL-запросы в выборочно трассированных HTTP-запросах", ('view',))
+DB_DURATION = Counter('db_query_seconds_total', "Время SQL-запросов в выборочно трассированных HTTP-запросах", ('view',))
+CHAT_PHASE_DURATION = Histogram('chat_phase_duration_seconds', "Время фаз хода диалога", ('phase',))
+LLM_DURATION = Histogram('llm_request_duration_seconds', "Время запроса к LLM", ('backend', 'outcome'))
+LLM_TOKENS = Counter('llm_tokens_total', "Токены LLM", ('backend', 'direction'))
+CHAT_RESPONSES = Counter('chat_responses_total', "Ответы бота по источнику: LLM или шаблон состояния", ('source',))
+LLM_CACHE_REQUESTS = Counter('llm_cache_requests_total', "Обращения к кэшу ответов LLM", ('result',))
+
+
+class RequestTrace:
+    __slots__ = ('request_id', 'sampled', 'phases', 'db_queries', 'db_time', 'llm_calls', 'llm_time',
+                 'tokens_in', 'tokens_out', 'cache')
+
+    def __init__(self, request_id: str, sampled: bool):
+        self.request_id = request_id
+        self.sampled = sampled
+        self.phases: Dict[str, float] = {}
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.llm_calls = 0
+        self.llm_time = 0.0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.cache: Dict[str, int] = {}
+
+    def as_dict(self) -> Dict[str, Any]:
+        fields = {
+            'phases_ms': {name: round(duration * 1000, 3) for name, duration in self.phases.items()},
+            'llm_calls': self.llm_calls,
+            'llm_ms': round(self.llm_time * 1000, 3),
+            'tokens_in': self.tokens_in,
+            'tokens_out': self.tokens_out,
+            'llm_cache': self.cache,
+        }
+        if self.sampled:
+            fields['db_queries'] = self.db_queries
+            fields['db_ms'] = round(self.db_time * 1000, 3)
+        return fields
+
+
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar('current_trace', default=None)
+
+
+def get_request_id() -> Optional[str]:
+    trace = current_trace.get()
+    return trace.request_id if trace else None
+
+
+def should_sample() -> bool:
+    rate = settings.METRICS_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def observe_phase(name: str, duration: float):
+    CHAT_PHASE_DURATION.observe(duration, phase=name)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.phases[name] = trace.phases.get(name, 0.0) + duration
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(name, time.perf_counter() - started)
+
+
+def record_llm_call(backend: str, duration: float, outcome: str = 'ok',
+                    tokens_in: Optional[int] = None, tokens_out: Optional[int] = None):
+    LLM_DURATION.observe(duration, backend=backend, outcome=outcome)
+    if tokens_in:
+        LLM_TOKENS.inc(tokens_in, backend=backend, direction='in')
+    if tokens_out:
+        LLM_TOKENS.inc(tokens_out, backend=backend, direction='out')
+    trace = current_trace.get()
+    if trace is not None:
+        trace.llm_calls += 1
+        trace.llm_time += duration
+        trace.tokens_in += tokens_in or 0
+        trace.tokens_out += tokens_out or 0
+
+
+def record_cache_result(result: str):
+    LLM_CACHE_REQUESTS.inc(result=result)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.cache[result] = trace.cache.get(result, 0) + 1
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    trace = current_trace.get()
+    if trace is None or not trace.sampled:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.db_queries += 1
+        trace.db_time += time.perf_counter() - started
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_wrapper)
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {name: metric.snapshot() for name, metric in _registry.items()}
+
+
+_last_flush = 0.0
+
+
+def flush(force: bool = False):
+    """Сбрасывает метрики процесса в METRICS_DIR, чтобы /metrics видел все воркеры gunicorn."""
+    global _last_flush
+    directory = settings.METRICS_DIR
+    now = time.monotonic()
+    if not directory or (not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL):
+        return
+    _last_flush = now
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as snapshot_file:
+            json.dump(snapshot(), snapshot_file)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        logger.warning("Не удалось сохранить метрики процесса: %s", e)
+
+
+def collect() -> Dict[str, Any]:
+    if not settings.METRICS_DIR:
+        return snapshot()
+    flush(force=True)
+    merged: Dict[str, Any] = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, 'metrics-*.json')):
+        try:
+            with open(path, encoding='utf-8') as snapshot_file:
+                process_snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            continue
+        for name, metric in process_snapshot.items():
+            target = merged.setdefault(name, {**metric, 'values': {}})
+            for key, value in metric['values']:
+                key = tuple(key)
+                if key not in target['values']:
+                    target['values'][key] = value
+                elif metric['type'] == 'histogram':
+                    target['values'][key] = [a + b for a, b in zip(target['values'][key], value)]
+                else:
+                    target['values'][key] += value
+    for metric in merged.values():
+        metric['values'] = [[list(key), value] for key, value in metric['values'].items()]
+    return merged
+
+
+def _format_labels(names: List[str], values: List[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def render(metrics: Dict[str, Any]) -> Iterator[str]:
+    for name, metric in sorted(metrics.items()):
+        yield f"# HELP {name} {metric['help']}\n"
+        yield f"# TYPE {name} {metric['type']}\n"
+        labelnames = metric['labelnames']
+        for labels, value in metric['values']:
+            if metric['type'] != 'histogram':
+                yield f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}\n"
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + [math.inf], value[:-1]):
+                cumulative += count
+                le = ('le', _format_value(bound))
+                yield f"{name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}\n"
+            yield f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(value[-1])}\n"
+            yield f"{name}_count{_format_labels(labelnames, labels)} {cumulative}\n"
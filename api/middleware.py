@@ -0,0 +1,84 @@
+import logging
+import re
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+request_logger = logging.getLogger('api.requests')
+
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+class RequestMetricsMiddleware:
+    """Присваивает запросу request id, считает время и статусы, а для выборки
+    запросов собирает число и время SQL-запросов, фазы хода и вызовы LLM."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace, token, started = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_trace.reset(token)
+        return self._finish(request, response, trace, started)
+
+    async def __acall__(self, request):
+        trace, token, started = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_trace.reset(token)
+        return self._finish(request, response, trace, started)
+
+    def _start(self, request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not _REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        trace = metrics.RequestTrace(request_id, metrics.should_sample())
+        return trace, metrics.current_trace.set(trace), time.perf_counter()
+
+    def _finish(self, request, response, trace, started):
+        duration = time.perf_counter() - started
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match else 'unmatched'
+
+        metrics.HTTP_REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        metrics.HTTP_DURATION.observe(duration, view=view)
+        if trace.sampled:
+            metrics.DB_QUERIES.inc(trace.db_queries, view=view)
+            metrics.DB_DURATION.inc(trace.db_time, view=view)
+
+        if trace.sampled or duration * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            request_logger.info(
+                "%s %s %s %.1f мс", request.method, request.path, response.status_code, duration * 1000,
+                extra={
+                    'request_id': trace.request_id,
+                    'fields': {
+                        'method': request.method,
+                        'path': request.path,
+                        'view': view,
+                        'status': response.status_code,
+                        'duration_ms': round(duration * 1000, 3),
+                        'sampled': trace.sampled,
+                        **trace.as_dict(),
+                    },
+                },
+            )
+
+        response['X-Request-ID'] = trace.request_id
+        metrics.flush()
+        return response
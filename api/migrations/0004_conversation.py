@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_scenario_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('end_user_id', models.CharField(max_length=100)),
+                ('current_state', models.CharField(blank=True, max_length=100)),
+                ('turn_count', models.PositiveIntegerField(default=0)),
+                ('context', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.bot')),
+                ('scenario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.scenario')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('scenario', 'end_user_id'), name='unique_conversation_per_end_user')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_conversation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='bot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='api.bot'),
+        ),
+        migrations.AlterField(
+            model_name='conversation',
+            name='scenario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='api.scenario'),
+        ),
+        migrations.AlterField(
+            model_name='scenario',
+            name='bot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scenarios', to='api.bot'),
+        ),
+        migrations.AlterField(
+            model_name='step',
+            name='scenario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='steps', to='api.scenario'),
+        ),
+    ]
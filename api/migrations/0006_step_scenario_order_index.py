@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_related_names'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='step',
+            index=models.Index(fields=['scenario', 'order'], name='step_scenario_order_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:32
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def init_step_order_counters(apps, schema_editor):
+    Scenario = apps.get_model('api', 'Scenario')
+    Step = apps.get_model('api', 'Step')
+
+    duplicated = (
+        Step.objects.values('scenario_id', 'order')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('scenario_id', flat=True)
+        .distinct()
+    )
+    for scenario_id in set(duplicated):
+        steps = list(Step.objects.filter(scenario_id=scenario_id).order_by('order', 'id'))
+        for position, step in enumerate(steps, start=1):
+            step.order = position
+        Step.objects.bulk_update(steps, ['order'], batch_size=1000)
+
+    for row in Step.objects.values('scenario_id').annotate(max_order=Max('order')):
+        Scenario.objects.filter(pk=row['scenario_id']).update(last_step_order=row['max_order'] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_step_scenario_order_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scenario',
+            name='last_step_order',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(init_step_order_counters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='step',
+            constraint=models.UniqueConstraint(fields=('scenario', 'order'), name='unique_step_order_per_scenario'),
+        ),
+        migrations.RemoveIndex(
+            model_name='step',
+            name='step_scenario_order_idx',
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:36
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('end_user_id', models.CharField(max_length=100)),
+                ('message', models.TextField()),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='queued', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('bot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_jobs', to='api.bot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_at'], name='chatjob_status_run_at_idx'), models.Index(fields=['bot', 'end_user_id', 'status'], name='chatjob_conversation_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:55
+
+from collections import deque
+
+from django.db import migrations, models
+
+END_STATE = 'end'
+
+
+def _targets(config):
+    # Замороженная копия разбора переходов из api.scenario_analyzer на момент миграции
+    targets = []
+    transitions = config.get('transitions') or {}
+    if isinstance(transitions, dict):
+        targets.extend(target for target in transitions.values() if isinstance(target, str))
+    elif isinstance(transitions, list):
+        targets.extend(rule['next'] for rule in transitions
+                       if isinstance(rule, dict) and isinstance(rule.get('next'), str))
+    intents = config.get('intents') or {}
+    if isinstance(intents, dict):
+        targets.extend(intents)
+    for key in ('default_next_state', 'fallback_state'):
+        target = config.get(key, END_STATE if key == 'default_next_state' else None)
+        if isinstance(target, str):
+            targets.append(target)
+    return sorted(set(targets))
+
+
+def _distances_to_end(adjacency):
+    reverse = {}
+    for name, targets in adjacency.items():
+        for target in targets:
+            reverse.setdefault(target, []).append(name)
+    distances = {name: None for name in adjacency}
+    if END_STATE in distances:
+        distances[END_STATE] = 0
+    queue = deque([(END_STATE, 0)])
+    visited = {END_STATE}
+    while queue:
+        name, distance = queue.popleft()
+        for source in reverse.get(name, []):
+            if source not in visited:
+                visited.add(source)
+                distances[source] = distance + 1
+                queue.append((source, distance + 1))
+    return distances
+
+
+def build_index(scenario_data):
+    # Без предупреждений о перекрытых ключевых словах: полный индекс пересчитается при сохранении
+    states = (scenario_data or {}).get('states') if isinstance(scenario_data, dict) else None
+    if not isinstance(states, dict) or not states:
+        return {}
+    adjacency = {name: _targets(config) for name, config in states.items() if isinstance(config, dict)}
+    initial_state = scenario_data.get('initial_state')
+
+    reachable = set()
+    queue = deque([initial_state] if initial_state in adjacency else [])
+    while queue:
+        name = queue.popleft()
+        if name in reachable or name not in adjacency:
+            continue
+        reachable.add(name)
+        queue.extend(adjacency[name])
+
+    distances = _distances_to_end(adjacency)
+    warnings = [f"Состояние {name} недостижимо из начального" for name in adjacency if name not in reachable]
+    if initial_state in distances and distances[initial_state] is None:
+        warnings.append(f"Из начального состояния нельзя дойти до {END_STATE}")
+    return {
+        'adjacency': adjacency,
+        'distance_to_end': distances,
+        'terminal_states': [name for name, targets in adjacency.items() if END_STATE in targets],
+        'unreachable_states': sorted(set(adjacency) - reachable),
+        'warnings': warnings,
+    }
+
+
+def build_indexes(apps, schema_editor):
+    Scenario = apps.get_model('api', 'Scenario')
+    for scenario in Scenario.objects.only('id', 'scenario_data').iterator():
+        scenario.scenario_index = build_index(scenario.scenario_data)
+        scenario.save(update_fields=['scenario_index'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_chatjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scenario',
+            name='scenario_index',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(build_indexes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_scenario_index'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='step',
+            name='unique_step_order_per_scenario',
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_step_order',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='step',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='steps', to='api.conversation'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['bot', 'end_user_id'], name='conversation_bot_end_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='step',
+            index=models.Index(fields=['scenario', 'id'], name='step_scenario_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='step',
+            constraint=models.UniqueConstraint(condition=models.Q(('conversation__isnull', True)), fields=('scenario', 'order'), name='unique_step_order_per_scenario'),
+        ),
+        migrations.AddConstraint(
+            model_name='step',
+            constraint=models.UniqueConstraint(condition=models.Q(('conversation__isnull', False)), fields=('conversation', 'order'), name='unique_step_order_per_conversation'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:21
+
+import hashlib
+import json
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def scenario_content_hash(scenario_data) -> str:
+    # Копия api.models.scenario_content_hash на момент миграции: хеши должны совпадать с новыми версиями
+    canonical = json.dumps(scenario_data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def publish_existing(apps, schema_editor):
+    Scenario = apps.get_model('api', 'Scenario')
+    ScenarioVersion = apps.get_model('api', 'ScenarioVersion')
+    Conversation = apps.get_model('api', 'Conversation')
+    for scenario in Scenario.objects.only('id', 'scenario_data').iterator():
+        if not scenario.scenario_data:
+            continue
+        version, _ = ScenarioVersion.objects.get_or_create(
+            scenario_id=scenario.pk,
+            content_hash=scenario_content_hash(scenario.scenario_data),
+            defaults={'scenario_data': scenario.scenario_data},
+        )
+        Scenario.objects.filter(pk=scenario.pk).update(published_version=version)
+        Conversation.objects.filter(scenario_id=scenario.pk).update(scenario_version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_conversation_steps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScenarioVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('scenario_data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('scenario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='api.scenario')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='scenario_version',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='conversations', to='api.scenarioversion'),
+        ),
+        migrations.AddField(
+            model_name='scenario',
+            name='published_version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.scenarioversion'),
+        ),
+        migrations.AddConstraint(
+            model_name='scenarioversion',
+            constraint=models.UniqueConstraint(fields=('scenario', 'content_hash'), name='unique_scenario_version_hash'),
+        ),
+        migrations.RunPython(publish_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_scenario_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='archived_steps',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scenario',
+            name='archived_steps',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StepArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_order', models.IntegerField()),
+                ('last_order', models.IntegerField()),
+                ('first_id', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('step_count', models.PositiveIntegerField()),
+                ('codec', models.CharField(max_length=10)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='step_archives', to='api.conversation')),
+                ('scenario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='step_archives', to='api.scenario')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['conversation', 'first_order'], name='step_archive_conv_order_idx'), models.Index(fields=['scenario', 'last_id'], name='step_archive_scenario_id_idx')],
+            },
+        ),
+    ]
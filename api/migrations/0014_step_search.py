@@ -0,0 +1,71 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:10
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+BACKFILL_BATCH_SIZE = 50000
+
+SEARCH_VECTOR_SQL = "to_tsvector('russian', coalesce({content}, '')) || to_tsvector('english', coalesce({content}, ''))"
+
+CREATE_TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION api_step_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR_SQL.format(content='NEW.content')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER api_step_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF content ON api_step
+    FOR EACH ROW EXECUTE FUNCTION api_step_search_vector_update();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS api_step_search_vector_trigger ON api_step;
+DROP FUNCTION IF EXISTS api_step_search_vector_update();
+"""
+
+
+def create_search_index(apps, schema_editor):
+    # tsvector, триггер и GIN есть только в Postgres; в SQLite поиск работает без индекса
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(CREATE_TRIGGER_SQL)
+        cursor.execute("SELECT coalesce(max(id), 0) FROM api_step")
+        max_id = cursor.fetchone()[0]
+        # Пачками по id, чтобы не держать одну длинную транзакцию на всю таблицу (миграция не атомарна)
+        for start in range(0, max_id, BACKFILL_BATCH_SIZE):
+            cursor.execute(
+                f"UPDATE api_step SET search_vector = {SEARCH_VECTOR_SQL.format(content='content')} "
+                "WHERE id > %s AND id <= %s",
+                [start, start + BACKFILL_BATCH_SIZE],
+            )
+        cursor.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS step_search_vector_idx ON api_step USING gin (search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS step_search_vector_idx")
+        cursor.execute(DROP_TRIGGER_SQL)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('api', '0013_step_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='step',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:29
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def scenario_content_hash(scenario_data) -> str:
+    # Копия api.models.scenario_content_hash на момент миграции
+    canonical = json.dumps(scenario_data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def fill_draft_hashes(apps, schema_editor):
+    Scenario = apps.get_model('api', 'Scenario')
+    batch = []
+    for scenario in Scenario.objects.only('id', 'scenario_data').iterator(chunk_size=500):
+        scenario.draft_hash = scenario_content_hash(scenario.scenario_data)
+        batch.append(scenario)
+        if len(batch) >= 500:
+            Scenario.objects.bulk_update(batch, ['draft_hash'])
+            batch = []
+    Scenario.objects.bulk_update(batch, ['draft_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_step_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scenario',
+            name='draft_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_draft_hashes, migrations.RunPython.noop),
+    ]
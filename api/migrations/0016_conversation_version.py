@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_scenario_draft_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
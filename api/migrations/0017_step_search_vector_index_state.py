@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:40
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_conversation_version'),
+    ]
+
+    operations = [
+        # Индекс уже создан в 0014 через CREATE INDEX CONCURRENTLY, меняется только состояние моделей
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='step',
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        fields=['search_vector'], name='step_search_vector_idx',
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 14:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_step_search_vector_index_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='steparchive',
+            name='conversation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='step_archives', to='api.conversation'),
+        ),
+    ]
@@ -1,5 +1,19 @@
-from django.db import models
+import hashlib
+import json
+from typing import Optional
+
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
+
+from .scenario_analyzer import build_scenario_index
+
+
+def scenario_content_hash(scenario_data) -> str:
+    canonical = json.dumps(scenario_data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
 
 class Bot(models.Model):
     name = models.CharField(max_length=50)
@@ -18,29 +32,217 @@ class Scenario(models.Model):
     description = models.CharField(max_length=250, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    bot = models.ForeignKey(Bot, on_delete=models.CASCADE)
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name='scenarios')
     is_active = models.BooleanField(default=False)
+    last_step_order = models.IntegerField(default=0)
 
     scenario_data = models.JSONField(default=dict, blank=True)
+    scenario_index = models.JSONField(default=dict, blank=True, editable=False)
+    # Хеш сохранённого черновика: по нему save() понимает, менялся ли scenario_data
+    draft_hash = models.CharField(max_length=64, blank=True, editable=False)
+    archived_steps = models.PositiveIntegerField(default=0, editable=False)
+    # Версия, по которой идут новые диалоги. scenario_data — черновик: правки попадают в чат
+    # только через publish(), а первая непустая версия публикуется при сохранении автоматически
+    published_version = models.ForeignKey(
+        'ScenarioVersion', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+',
+    )
 
     def __str__(self):
         return f"Scenario {self.name} of Bot {self.bot.name}"
 
+    def _changed_data_hash(self, update_fields) -> Optional[str]:
+        """Новый хеш scenario_data, если черновик изменился с последнего сохранения, иначе None."""
+        if update_fields is not None and 'scenario_data' not in update_fields:
+            return None
+        if 'scenario_data' in self.get_deferred_fields():
+            return None
+        data_hash = scenario_content_hash(self.scenario_data)
+        return data_hash if data_hash != self.draft_hash else None
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        data_hash = self._changed_data_hash(update_fields)
+        if data_hash is not None:
+            self.draft_hash = data_hash
+            self.scenario_index = build_scenario_index(self.scenario_data)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'scenario_index', 'draft_hash'}
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if data_hash is not None and self.published_version_id is None and self.scenario_data:
+                self.publish()
+
+    def publish(self, version: 'ScenarioVersion' = None) -> 'ScenarioVersion':
+        """Переключает опубликованную версию одним UPDATE; без version публикует черновик scenario_data."""
+        if version is None:
+            version = ScenarioVersion.for_data(self, self.scenario_data) if self.scenario_data else None
+        if version is not None and version.scenario_id != self.pk:
+            raise ValueError("Версия принадлежит другому сценарию")
+        if self.published_version_id != (version.pk if version else None):
+            Scenario.objects.filter(pk=self.pk).update(published_version=version)
+            self.published_version = version
+        return version
+
+class ScenarioVersion(models.Model):
+    """Неизменяемый снимок scenario_data, адресуемый хешем содержимого."""
+
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name='versions')
+    content_hash = models.CharField(max_length=64)
+    scenario_data = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scenario', 'content_hash'], name='unique_scenario_version_hash'),
+        ]
+
+    @classmethod
+    def for_data(cls, scenario, scenario_data) -> 'ScenarioVersion':
+        version, _ = cls.objects.get_or_create(
+            scenario=scenario,
+            content_hash=scenario_content_hash(scenario_data),
+            defaults={'scenario_data': scenario_data},
+        )
+        return version
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Версии сценария неизменяемы")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Version {self.content_hash[:12]} of Scenario {self.scenario_id}"
+
 class Step(models.Model):
     order = models.IntegerField()
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
-    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE)
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name='steps')
+    # Шаги диалогов нумеруются внутри разговора; шаги без разговора — история до разделения по пользователям
+    conversation = models.ForeignKey(
+        'Conversation', on_delete=models.CASCADE, related_name='steps', null=True, blank=True,
+    )
 
     step_type = models.CharField(max_length=20, choices=[
         ('user_input', 'Ввод пользователя'),
         ('bot_response', 'Ответ бота'),
     ], default='bot_response')
-
-    
+    # Заполняется триггером Postgres при вставке и изменении content (миграция 0014)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ['order']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scenario', 'order'], name='unique_step_order_per_scenario',
+                condition=models.Q(conversation__isnull=True),
+            ),
+            models.UniqueConstraint(
+                fields=['conversation', 'order'], name='unique_step_order_per_conversation',
+                condition=models.Q(conversation__isnull=False),
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['scenario', 'id'], name='step_scenario_id_idx'),
+            # Сам индекс создаётся в миграции 0014 (CONCURRENTLY и только в Postgres)
+            GinIndex(fields=['search_vector'], name='step_search_vector_idx'),
+        ]
 
     def __str__(self):
         return f"Step {self.order} of Scenario {self.scenario.name}"
+
+class Conversation(models.Model):
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name='conversations')
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name='conversations')
+    # Диалог идёт по версии, с которой начался, даже если сценарий тем временем переопубликовали
+    scenario_version = models.ForeignKey(
+        ScenarioVersion, on_delete=models.RESTRICT, null=True, blank=True, related_name='conversations',
+    )
+    end_user_id = models.CharField(max_length=100)
+    current_state = models.CharField(max_length=100, blank=True)
+    turn_count = models.PositiveIntegerField(default=0)
+    last_step_order = models.IntegerField(default=0)
+    archived_steps = models.PositiveIntegerField(default=0)
+    context = models.JSONField(default=list, blank=True)
+    summary = models.TextField(blank=True)
+    # Растёт при каждом сохранении сессии: ход, загрузивший старую версию, не перезапишет чужой
+    version = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scenario', 'end_user_id'], name='unique_conversation_per_end_user'),
+        ]
+        indexes = [
+            models.Index(fields=['bot', 'end_user_id'], name='conversation_bot_end_user_idx'),
+        ]
+
+    def record_turn(self, user_message, bot_response, next_state):
+        self.context = self.context + [
+            {'step_type': 'user_input', 'content': user_message},
+            {'step_type': 'bot_response', 'content': bot_response},
+        ]
+        self.current_state = next_state or ''
+        self.turn_count += 1
+
+    def __str__(self):
+        return f"Conversation {self.end_user_id} in Scenario {self.scenario.name}"
+
+class StepArchive(models.Model):
+    """Сжатый блок шагов разговора, перенесённых из горячей таблицы Step.
+
+    Диапазоны order и id хранятся, чтобы история читала только нужные блоки.
+    """
+
+    scenario = models.ForeignKey(Scenario, on_delete=models.CASCADE, related_name='step_archives')
+    # Пусто у блоков шагов без разговора: они архивируются по сценарию и читаются по id
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name='step_archives', null=True, blank=True,
+    )
+    first_order = models.IntegerField()
+    last_order = models.IntegerField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    step_count = models.PositiveIntegerField()
+    codec = models.CharField(max_length=10)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'first_order'], name='step_archive_conv_order_idx'),
+            models.Index(fields=['scenario', 'last_id'], name='step_archive_scenario_id_idx'),
+        ]
+
+    def __str__(self):
+        if self.conversation_id is None:
+            return f"Archive {self.first_id}-{self.last_id} of Scenario {self.scenario_id}"
+        return f"Archive {self.first_order}-{self.last_order} of Conversation {self.conversation_id}"
+
+class ChatJob(models.Model):
+    bot = models.ForeignKey(Bot, on_delete=models.CASCADE, related_name='chat_jobs')
+    end_user_id = models.CharField(max_length=100)
+    message = models.TextField()
+    status = models.CharField(max_length=20, choices=[
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    ], default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='chatjob_status_run_at_idx'),
+            models.Index(fields=['bot', 'end_user_id', 'status'], name='chatjob_conversation_idx'),
+        ]
+
+    def __str__(self):
+        return f"ChatJob {self.pk} ({self.status}) of Bot {self.bot.name}"
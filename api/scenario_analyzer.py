@@ -0,0 +1,220 @@
+import re
+from collections import deque
+from typing import Any, Dict, List, Optional, Set
+
+from .scenario_compiler import TRANSITION_MATCH_TYPES, normalize_transition_rules
+from .stemmer import normalize_text, stem, tokenize
+
+END_STATE = 'end'
+
+
+class ScenarioAnalysis:
+    """Результат статического анализа графа сценария.
+
+    errors делают сценарий непригодным к сохранению, warnings лишь
+    подсвечивают подозрительные места (недостижимые состояния, перекрытые
+    ключевые слова, циклы без выхода в end).
+    """
+
+    def __init__(self):
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+        self.adjacency: Dict[str, List[str]] = {}
+        self.reachable: Set[str] = set()
+        self.distance_to_end: Dict[str, Optional[int]] = {}
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+    @property
+    def terminal_states(self) -> List[str]:
+        return [name for name, targets in self.adjacency.items() if END_STATE in targets]
+
+    def index(self) -> Dict[str, Any]:
+        return {
+            'adjacency': self.adjacency,
+            'distance_to_end': self.distance_to_end,
+            'terminal_states': self.terminal_states,
+            'unreachable_states': sorted(set(self.adjacency) - self.reachable),
+            'warnings': self.warnings,
+        }
+
+
+def _rule_targets(name: str, position: int, rule: Any, analysis: ScenarioAnalysis) -> Optional[str]:
+    prefix = f"Состояние {name}: правило перехода №{position + 1}"
+    if not isinstance(rule, dict):
+        analysis.errors.append(f"{prefix} должно быть объектом")
+        return None
+    match = rule.get('match', 'word')
+    if match not in TRANSITION_MATCH_TYPES:
+        analysis.errors.append(f"{prefix}: неизвестный тип match '{match}'")
+    elif match == 'regex':
+        try:
+            re.compile(rule.get('pattern'))
+        except (re.error, TypeError) as e:
+            analysis.errors.append(f"{prefix}: некорректное регулярное выражение ({e})")
+    else:
+        keywords = rule.get('keywords')
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        if not isinstance(keywords, list) or not keywords or not all(isinstance(keyword, str) for keyword in keywords):
+            analysis.errors.append(f"{prefix}: keywords должно быть непустым списком строк")
+    priority = rule.get('priority', 0)
+    if not isinstance(priority, (int, float)) or isinstance(priority, bool):
+        analysis.errors.append(f"{prefix}: priority должно быть числом")
+    target = rule.get('next')
+    if not isinstance(target, str):
+        analysis.errors.append(f"{prefix}: next должно быть именем состояния")
+        return None
+    return target
+
+
+def _state_targets(name: str, config: Dict[str, Any], analysis: ScenarioAnalysis) -> List[str]:
+    targets = []
+    transitions = config.get('transitions') or {}
+    if isinstance(transitions, list):
+        for position, rule in enumerate(transitions):
+            target = _rule_targets(name, position, rule, analysis)
+            if target is not None:
+                targets.append(target)
+    elif isinstance(transitions, dict):
+        for keyword, target in transitions.items():
+            if not isinstance(target, str):
+                analysis.errors.append(f"Состояние {name}: переход по '{keyword}' должен указывать на имя состояния")
+                continue
+            targets.append(target)
+    else:
+        analysis.errors.append(f"Состояние {name}: transitions должно быть объектом или списком правил")
+
+    intents = config.get('intents') or {}
+    if not isinstance(intents, dict):
+        analysis.errors.append(f"Состояние {name}: intents должно быть объектом")
+        intents = {}
+    for target, phrases in intents.items():
+        if not isinstance(phrases, list) or not phrases or not all(isinstance(phrase, str) for phrase in phrases):
+            analysis.errors.append(f"Состояние {name}: примеры интента {target} должны быть непустым списком строк")
+            continue
+        targets.append(target)
+    threshold = config.get('intent_threshold', 0)
+    if not isinstance(threshold, (int, float)) or isinstance(threshold, bool) or not 0 <= threshold <= 1:
+        analysis.errors.append(f"Состояние {name}: intent_threshold должно быть числом от 0 до 1")
+
+    for key in ('default_next_state', 'fallback_state'):
+        target = config.get(key, END_STATE if key == 'default_next_state' else None)
+        if target is None:
+            continue
+        if not isinstance(target, str):
+            analysis.errors.append(f"Состояние {name}: {key} должно быть именем состояния")
+            continue
+        targets.append(target)
+    return targets
+
+
+def _check_keywords(name: str, config: Dict[str, Any], analysis: ScenarioAnalysis):
+    # Побеждает самое приоритетное из совпавших правил, поэтому более позднее
+    # ключевое слово, содержащее в себе раннюю подстроку или повторяющее
+    # раннее слово (основу), никогда не сработает
+    substrings: List[str] = []
+    seen_tokens: Dict[Any, str] = {}
+    for rule in normalize_transition_rules(config.get('transitions')):
+        match = rule['match']
+        if match == 'regex':
+            continue
+        for keyword in rule['keywords']:
+            normalized = normalize_text(keyword)
+            shadowed_by = None
+            if match in ('substring', 'word'):
+                shadowed_by = next((earlier for earlier in substrings if earlier in normalized), None)
+            if shadowed_by is None and match != 'substring':
+                tokens = tokenize(keyword)
+                if match == 'stem':
+                    tokens = [stem(token) for token in tokens]
+                key = (match, tuple(tokens))
+                shadowed_by = seen_tokens.get(key)
+                seen_tokens.setdefault(key, keyword)
+            if shadowed_by is not None:
+                analysis.warnings.append(
+                    f"Состояние {name}: ключевое слово '{keyword}' никогда не сработает, "
+                    f"его перекрывает '{shadowed_by}'"
+                )
+            if match == 'substring':
+                substrings.append(normalized)
+
+
+def _distances_to_end(adjacency: Dict[str, List[str]]) -> Dict[str, Optional[int]]:
+    reverse: Dict[str, List[str]] = {}
+    for name, targets in adjacency.items():
+        for target in targets:
+            reverse.setdefault(target, []).append(name)
+
+    distances: Dict[str, Optional[int]] = {name: None for name in adjacency}
+    if END_STATE in distances:
+        distances[END_STATE] = 0
+    queue = deque([(END_STATE, 0)])
+    visited = {END_STATE}
+    while queue:
+        name, distance = queue.popleft()
+        for source in reverse.get(name, []):
+            if source not in visited:
+                visited.add(source)
+                distances[source] = distance + 1
+                queue.append((source, distance + 1))
+    return distances
+
+
+def analyze_scenario(scenario_data: Dict[str, Any]) -> ScenarioAnalysis:
+    analysis = ScenarioAnalysis()
+    if not isinstance(scenario_data, dict):
+        analysis.errors.append("Сценарий должен быть объектом")
+        return analysis
+
+    states = scenario_data.get('states')
+    initial_state = scenario_data.get('initial_state')
+    if not isinstance(states, dict) or not states:
+        analysis.errors.append("Поле states должно быть непустым объектом")
+        return analysis
+    if not isinstance(initial_state, str) or initial_state not in states:
+        analysis.errors.append(f"Начальное состояние {initial_state} не найдено")
+
+    for name, config in states.items():
+        if not isinstance(config, dict):
+            analysis.errors.append(f"Состояние {name} должно быть объектом")
+            continue
+        if not isinstance(config.get('prompt', ''), str):
+            analysis.errors.append(f"Состояние {name}: prompt должен быть строкой")
+        response = config.get('response')
+        if response is not None and not (
+            isinstance(response, str)
+            or (isinstance(response, list) and response and all(isinstance(item, str) for item in response))
+        ):
+            analysis.errors.append(f"Состояние {name}: response должен быть строкой или непустым списком строк")
+        targets = _state_targets(name, config, analysis)
+        for target in targets:
+            if target != END_STATE and target not in states:
+                analysis.errors.append(f"Состояние {name}: переход в несуществующее состояние {target}")
+        analysis.adjacency[name] = sorted(set(targets))
+        _check_keywords(name, config, analysis)
+
+    queue = deque([initial_state] if initial_state in analysis.adjacency else [])
+    while queue:
+        name = queue.popleft()
+        if name in analysis.reachable or name not in analysis.adjacency:
+            continue
+        analysis.reachable.add(name)
+        queue.extend(analysis.adjacency[name])
+
+    analysis.distance_to_end = _distances_to_end(analysis.adjacency)
+
+    for name in analysis.adjacency:
+        if name not in analysis.reachable:
+            analysis.warnings.append(f"Состояние {name} недостижимо из начального")
+    if initial_state in analysis.distance_to_end and analysis.distance_to_end[initial_state] is None:
+        analysis.warnings.append(f"Из начального состояния нельзя дойти до {END_STATE}")
+    return analysis
+
+
+def build_scenario_index(scenario_data: Dict[str, Any]) -> Dict[str, Any]:
+    if not scenario_data:
+        return {}
+    return analyze_scenario(scenario_data).index()
@@ -0,0 +1,380 @@
+import random
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional, Tuple
+
+from django.conf import settings
+
+from .intent_classifier import DEFAULT_THRESHOLD, IntentClassifier
+from .stemmer import normalize_text, stem, tokenize
+
+TRANSITION_MATCH_TYPES = ('substring', 'word', 'stem', 'regex')
+TEMPLATE_VARIABLE_RE = re.compile(r'\{(\w+)\}')
+
+
+class KeywordMatcher:
+    """Aho-Corasick автомат по ключевым словам переходов одного состояния.
+
+    Приоритет ключевого слова равен его позиции в списке: при нескольких
+    совпадениях побеждает то, что раньше объявлено в сценарии.
+    """
+
+    def __init__(self, keywords: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._best: List[int] = [-1]
+        self._always = -1
+
+        for index, keyword in enumerate(keywords):
+            if not keyword:
+                if self._always == -1:
+                    self._always = index
+                continue
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(-1)
+                node = next_node
+            if self._best[node] == -1:
+                self._best[node] = index
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                inherited = self._best[self._fail[child]]
+                if inherited != -1 and (self._best[child] == -1 or inherited < self._best[child]):
+                    self._best[child] = inherited
+
+    def first_match(self, text: str) -> int:
+        best = self._always
+        if best == 0:
+            return 0
+        goto, fail, outputs = self._goto, self._fail, self._best
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            found = outputs[node]
+            if found != -1 and (best == -1 or found < best):
+                best = found
+                if best == 0:
+                    break
+        return best
+
+
+def normalize_transition_rules(transitions: Any) -> List[Dict[str, Any]]:
+    """Приводит переходы состояния к списку правил в порядке приоритета.
+
+    Старый формат {"ключевое слово": "состояние"} превращается в правила
+    substring с той же семантикой. Новый формат — список правил
+    {"match": "word|stem|regex|substring", "keywords": [...] или "pattern": "...",
+    "next": "состояние", "priority": 0}: сначала побеждает больший priority,
+    при равном — раньше объявленное правило. Некорректные правила
+    пропускаются, их находит анализатор сценария.
+    """
+    rules = []
+    if isinstance(transitions, dict):
+        for keyword, next_state in transitions.items():
+            if isinstance(next_state, str):
+                rules.append({'match': 'substring', 'keywords': [str(keyword)], 'pattern': None,
+                              'next': next_state, 'priority': 0})
+    elif isinstance(transitions, list):
+        for rule in transitions:
+            if not isinstance(rule, dict) or not isinstance(rule.get('next'), str):
+                continue
+            match = rule.get('match', 'word')
+            if match not in TRANSITION_MATCH_TYPES:
+                continue
+            keywords = rule.get('keywords') or []
+            if isinstance(keywords, str):
+                keywords = [keywords]
+            priority = rule.get('priority', 0)
+            rules.append({
+                'match': match,
+                'keywords': [str(keyword) for keyword in keywords],
+                'pattern': rule.get('pattern'),
+                'next': rule['next'],
+                'priority': priority if isinstance(priority, (int, float)) and not isinstance(priority, bool) else 0,
+            })
+        rules.sort(key=lambda rule: -rule['priority'])
+    return rules
+
+
+class TurnInput:
+    """Реплика пользователя, разобранная лениво и не более одного раза за ход."""
+
+    __slots__ = ('text', 'lower', 'normalized', '_tokens', '_stems')
+
+    def __init__(self, text: str):
+        self.text = text
+        self.lower = text.lower()
+        self.normalized = self.lower.replace('ё', 'е')
+        self._tokens: Optional[List[str]] = None
+        self._stems: Optional[List[str]] = None
+
+    @property
+    def tokens(self) -> List[str]:
+        if self._tokens is None:
+            self._tokens = tokenize(self.normalized)
+        return self._tokens
+
+    @property
+    def stems(self) -> List[str]:
+        if self._stems is None:
+            self._stems = [stem(token) for token in self.tokens]
+        return self._stems
+
+
+def _best_token_rank(tokens: List[str], words: Dict[str, int], phrases: Dict[Tuple[str, ...], int],
+                     phrase_lengths: List[int], best: int) -> int:
+    for token in tokens:
+        rank = words.get(token)
+        if rank is not None and rank < best:
+            best = rank
+    for length in phrase_lengths:
+        for start in range(len(tokens) - length + 1):
+            rank = phrases.get(tuple(tokens[start:start + length]))
+            if rank is not None and rank < best:
+                best = rank
+    return best
+
+
+class TransitionMatcher:
+    """Правила переходов одного состояния, скомпилированные в индексы.
+
+    Подстроки ищутся одним проходом Aho-Corasick, слова и основы — поиском
+    токенов реплики в словарях, регулярные выражения компилируются заранее
+    и проверяются, только если могут перебить уже найденное правило.
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        self.targets = [rule['next'] for rule in rules]
+        substrings: List[str] = []
+        self._substring_ranks: List[int] = []
+        self._words: Dict[str, int] = {}
+        self._word_phrases: Dict[Tuple[str, ...], int] = {}
+        self._stems: Dict[str, int] = {}
+        self._stem_phrases: Dict[Tuple[str, ...], int] = {}
+        self._regexes: List[Tuple[int, Any]] = []
+
+        for rank, rule in enumerate(rules):
+            match = rule['match']
+            if match == 'regex':
+                try:
+                    self._regexes.append((rank, re.compile(rule['pattern'], re.IGNORECASE)))
+                except (re.error, TypeError):
+                    continue
+            elif match == 'substring':
+                for keyword in rule['keywords']:
+                    substrings.append(normalize_text(keyword))
+                    self._substring_ranks.append(rank)
+            else:
+                words, phrases = (self._words, self._word_phrases) if match == 'word' else (self._stems, self._stem_phrases)
+                for keyword in rule['keywords']:
+                    tokens = tokenize(keyword)
+                    if match == 'stem':
+                        tokens = [stem(token) for token in tokens]
+                    if len(tokens) == 1:
+                        words.setdefault(tokens[0], rank)
+                    elif tokens:
+                        phrases.setdefault(tuple(tokens), rank)
+
+        self._substrings = KeywordMatcher(substrings) if substrings else None
+        self._word_lengths = sorted({len(phrase) for phrase in self._word_phrases})
+        self._stem_lengths = sorted({len(phrase) for phrase in self._stem_phrases})
+
+    def match(self, turn_input: TurnInput) -> int:
+        best = len(self.targets)
+        if self._substrings is not None:
+            index = self._substrings.first_match(turn_input.normalized)
+            if index != -1:
+                best = self._substring_ranks[index]
+        if best and (self._words or self._word_phrases):
+            best = _best_token_rank(turn_input.tokens, self._words, self._word_phrases, self._word_lengths, best)
+        if best and (self._stems or self._stem_phrases):
+            best = _best_token_rank(turn_input.stems, self._stems, self._stem_phrases, self._stem_lengths, best)
+        for rank, pattern in self._regexes:
+            if rank >= best:
+                break
+            if pattern.search(turn_input.lower):
+                best = rank
+                break
+        return best if best < len(self.targets) else -1
+
+
+def render_template(template: str, variables: Dict[str, str]) -> str:
+    # Только подстановка {имя}: без format(), чтобы шаблон не мог обращаться к атрибутам
+    return TEMPLATE_VARIABLE_RE.sub(lambda match: variables.get(match.group(1), match.group(0)), template)
+
+
+class CompiledState:
+    __slots__ = ('id', 'name', 'config', 'prompt', 'transitions', 'intents', 'responses',
+                 'default_next_state', 'fallback_state', 'cache')
+
+    def __init__(self, state_id: int, name: str, config: Dict[str, Any]):
+        self.id = state_id
+        self.name = name
+        self.config = config
+        self.prompt = config.get('prompt', '')
+        self.default_next_state = config.get('default_next_state', 'end')
+        self.fallback_state = config.get('fallback_state')
+        self.cache = config.get('cache', False)
+        self.transitions = TransitionMatcher(normalize_transition_rules(config.get('transitions')))
+
+        self.intents: Optional[IntentClassifier] = None
+        intents = config.get('intents')
+        if isinstance(intents, dict) and intents:
+            threshold = config.get('intent_threshold', DEFAULT_THRESHOLD)
+            self.intents = IntentClassifier(
+                {target: phrases for target, phrases in intents.items() if isinstance(phrases, list)},
+                threshold if isinstance(threshold, (int, float)) else DEFAULT_THRESHOLD,
+            )
+
+        # Состояние с response отвечает шаблоном и не обращается к LLM
+        self.responses: Optional[List[str]] = None
+        response = config.get('response')
+        if isinstance(response, str):
+            self.responses = [response]
+        elif isinstance(response, list) and response:
+            self.responses = [str(item) for item in response]
+
+    @property
+    def is_static(self) -> bool:
+        return self.responses is not None
+
+    def next_state(self, user_input: str) -> str:
+        turn_input = TurnInput(user_input)
+        index = self.transitions.match(turn_input)
+        if index != -1:
+            return self.transitions.targets[index]
+        if self.intents is not None:
+            intent = self.intents.classify(turn_input.stems)
+            if intent is not None:
+                return intent[0]
+        return self.default_next_state
+
+    def render_response(self, user_input: str, next_state: str) -> str:
+        template = self.responses[0] if len(self.responses) == 1 else random.choice(self.responses)
+        return render_template(template, {'user_input': user_input, 'state': self.name, 'next_state': next_state})
+
+
+class CompiledScenario:
+    """Сценарий, разобранный один раз: состояния проиндексированы целыми id,
+    правила переходов собраны в индексы."""
+
+    def __init__(self, scenario_data: Dict[str, Any]):
+        self.scenario_data = scenario_data
+        self.initial_state = scenario_data.get('initial_state', 'start')
+        self.state_ids: Dict[str, int] = {}
+        self.states: List[CompiledState] = []
+        self.errors: List[str] = []
+
+        states = scenario_data.get('states') or {}
+        if not isinstance(states, dict):
+            self.errors.append("Поле states должно быть объектом")
+            states = {}
+
+        for name, config in states.items():
+            if not isinstance(config, dict):
+                self.errors.append(f"Состояние {name} должно быть объектом")
+                continue
+            state_id = len(self.states)
+            self.state_ids[name] = state_id
+            self.states.append(CompiledState(state_id, name, config))
+
+        if self.initial_state not in self.state_ids:
+            self.errors.append(f"Начальное состояние {self.initial_state} не найдено")
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+    def get_state(self, name: str) -> Optional[CompiledState]:
+        state_id = self.state_ids.get(name)
+        if state_id is None:
+            return None
+        return self.states[state_id]
+
+
+def compile_scenario(scenario_data: Dict[str, Any]) -> CompiledScenario:
+    return CompiledScenario(scenario_data or {})
+
+
+class CompiledScenarioCache:
+    """LRU кэш скомпилированных сценариев на уровне процесса."""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._items: 'OrderedDict[Tuple[Any, ...], CompiledScenario]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Any, ...], scenario_data: Dict[str, Any]) -> CompiledScenario:
+        compiled = self.lookup(key)
+        if compiled is None:
+            compiled = compile_scenario(scenario_data)
+            self.put(key, compiled)
+        return compiled
+
+    def lookup(self, key: Tuple[Any, ...]) -> Optional[CompiledScenario]:
+        with self._lock:
+            compiled = self._items.get(key)
+            if compiled is not None:
+                self._items.move_to_end(key)
+            return compiled
+
+    def put(self, key: Tuple[Any, ...], compiled: CompiledScenario):
+        with self._lock:
+            self._items[key] = compiled
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+compiled_scenarios = CompiledScenarioCache(getattr(settings, 'SCENARIO_CACHE_SIZE', 256))
+
+
+def _compiled_version(version_id: int, row) -> CompiledScenario:
+    content_hash, scenario_data = row
+    # Одинаковое содержимое (например, сценарий по умолчанию у разных ботов) компилируется один раз
+    compiled = compiled_scenarios.get(('hash', content_hash), scenario_data)
+    compiled_scenarios.put(('version', version_id), compiled)
+    return compiled
+
+
+def get_compiled_version(version_id: int) -> CompiledScenario:
+    """Версии неизменяемы, поэтому кэш по ним не инвалидируется, а только вытесняется LRU."""
+    compiled = compiled_scenarios.lookup(('version', version_id))
+    if compiled is None:
+        from .models import ScenarioVersion
+        row = ScenarioVersion.objects.values_list('content_hash', 'scenario_data').get(pk=version_id)
+        compiled = _compiled_version(version_id, row)
+    return compiled
+
+
+async def aget_compiled_version(version_id: int) -> CompiledScenario:
+    compiled = compiled_scenarios.lookup(('version', version_id))
+    if compiled is None:
+        from .models import ScenarioVersion
+        row = await ScenarioVersion.objects.values_list('content_hash', 'scenario_data').aget(pk=version_id)
+        compiled = _compiled_version(version_id, row)
+    return compiled
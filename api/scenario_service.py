@@ -1,13 +1,42 @@
+import logging
 from typing import Dict, Any, Optional
-from .chatbot_service import chat_bot
+from .chatbot_service import LLMOverloadedError, LLMStreamInterrupted, get_chat_backend
+from .llm_cache import response_cache
+from .metrics import CHAT_RESPONSES
+from .scenario_analyzer import analyze_scenario
+from .scenario_compiler import (
+    CompiledScenario, CompiledState, aget_compiled_version, compile_scenario, get_compiled_version,
+)
+
+logger = logging.getLogger(__name__)
 
 class ScenarioEngine:
-    def __init__(self, scenario_data: Dict[str, Any]):
+    def __init__(self, scenario_data: Dict[str, Any], compiled: Optional[CompiledScenario] = None,
+                 current_state: Optional[str] = None, chat_bot=None):
         self.scenario_data = scenario_data
-        self.current_state = scenario_data.get('initial_state', 'start')
+        self.chat_bot = chat_bot or get_chat_backend()
+        self.compiled = compiled or compile_scenario(scenario_data)
+        if current_state and self.compiled.get_state(current_state):
+            self.current_state = current_state
+        else:
+            self.current_state = self.compiled.initial_state
+
+    @classmethod
+    def for_version(cls, version_id: int, current_state: Optional[str] = None, chat_bot=None) -> 'ScenarioEngine':
+        compiled = get_compiled_version(version_id)
+        return cls(compiled.scenario_data, compiled, current_state, chat_bot)
+
+    @classmethod
+    async def afor_version(cls, version_id: int, current_state: Optional[str] = None, chat_bot=None) -> 'ScenarioEngine':
+        compiled = await aget_compiled_version(version_id)
+        return cls(compiled.scenario_data, compiled, current_state, chat_bot)
+
+    def get_current_state(self) -> Optional[CompiledState]:
+        return self.compiled.get_state(self.current_state)
     
     def get_current_state_config(self) -> Optional[Dict[str, Any]]:
-        return self.scenario_data.get('states', {}).get(self.current_state)
+        state = self.get_current_state()
+        return state.config if state else None
     
     def _create_success_response(self, response: str, next_state: str) -> Dict[str, Any]:
         return {
@@ -32,51 +61,115 @@ class ScenarioEngine:
             return f"{prompt_template}\n\nКонтекст диалога:\n{context}\n\nТекущий ввод: {user_input}"
         return f"{prompt_template}\n\nВвод пользователя: {user_input}"
     
-    def _determine_next_state(self, user_input: str, current_state: Dict[str, Any]) -> str:
-        user_input_lower = user_input.lower()
-        transitions = current_state.get('transitions', {})
-        
-        for keyword, next_state in transitions.items():
-            if keyword.lower() in user_input_lower:
-                return next_state
-        
-        return current_state.get('default_next_state', 'end')
+    def _determine_next_state(self, user_input: str, current_state: CompiledState) -> str:
+        return current_state.next_state(user_input)
     
+    def _static_response(self, state: CompiledState, user_input: str, next_state: str) -> str:
+        CHAT_RESPONSES.inc(source='static')
+        return state.render_response(user_input, next_state)
+
+    def _generate_response(self, state: CompiledState, prompt: str) -> str:
+        CHAT_RESPONSES.inc(source='llm')
+        ttl = response_cache.resolve_ttl(state.cache)
+        if ttl is None:
+            return self.chat_bot.generate_response(prompt)
+        return response_cache.generate(self.chat_bot, prompt, ttl)
+
+    async def _agenerate_response(self, state: CompiledState, prompt: str) -> str:
+        CHAT_RESPONSES.inc(source='llm')
+        ttl = response_cache.resolve_ttl(state.cache)
+        if ttl is None:
+            return await self.chat_bot.agenerate_response(prompt)
+        return await response_cache.agenerate(self.chat_bot, prompt, ttl)
+
+    def _astream_response(self, state: CompiledState, prompt: str):
+        CHAT_RESPONSES.inc(source='llm')
+        ttl = response_cache.resolve_ttl(state.cache)
+        if ttl is None:
+            return self.chat_bot.astream_response(prompt)
+        return response_cache.astream(self.chat_bot, prompt, ttl)
+
     def process_user_input(self, user_input: str, conversation_context: str = "") -> Dict[str, Any]:
-        current_state_config = self.get_current_state_config()
-        if not current_state_config:
+        current_state = self.get_current_state()
+        if not current_state:
             return self._create_error_response("Состояние сценария не найдено")
 
         try:
-            prompt_template = current_state_config.get('prompt', '')
-            full_prompt = self._build_prompt(prompt_template, user_input, conversation_context)
-            
-            bot_response = chat_bot.generate_response(full_prompt)
-            next_state = self._determine_next_state(user_input, current_state_config)
+            next_state = self._determine_next_state(user_input, current_state)
+            if current_state.is_static:
+                bot_response = self._static_response(current_state, user_input, next_state)
+            else:
+                full_prompt = self._build_prompt(current_state.prompt, user_input, conversation_context)
+                bot_response = self._generate_response(current_state, full_prompt)
             self.current_state = next_state
             
             return self._create_success_response(bot_response, next_state)
             
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            logger.exception("Ошибка обработки сценария: %s", e)
+            return self._create_error_response(str(e))
+
+    async def aprocess_user_input(self, user_input: str, conversation_context: str = "") -> Dict[str, Any]:
+        current_state = self.get_current_state()
+        if not current_state:
+            return self._create_error_response("Состояние сценария не найдено")
+
+        try:
+            next_state = self._determine_next_state(user_input, current_state)
+            if current_state.is_static:
+                bot_response = self._static_response(current_state, user_input, next_state)
+            else:
+                full_prompt = self._build_prompt(current_state.prompt, user_input, conversation_context)
+                bot_response = await self._agenerate_response(current_state, full_prompt)
+            self.current_state = next_state
+
+            return self._create_success_response(bot_response, next_state)
+
+        except LLMOverloadedError:
+            raise
         except Exception as e:
-            print(f"Ошибка обработки сценария: {e}")
+            logger.exception("Ошибка обработки сценария: %s", e)
             return self._create_error_response(str(e))
+
+    async def astream_user_input(self, user_input: str, conversation_context: str = ""):
+        current_state = self.get_current_state()
+        if not current_state:
+            yield 'done', self._create_error_response("Состояние сценария не найдено")
+            return
+
+        try:
+            next_state = self._determine_next_state(user_input, current_state)
+            if current_state.is_static:
+                bot_response = self._static_response(current_state, user_input, next_state)
+                yield 'token', bot_response
+            else:
+                full_prompt = self._build_prompt(current_state.prompt, user_input, conversation_context)
+                chunks = []
+                try:
+                    async for chunk in self._astream_response(current_state, full_prompt):
+                        chunks.append(chunk)
+                        yield 'token', chunk
+                except LLMStreamInterrupted:
+                    # Начало ответа клиент уже получил, сохраняем его как есть
+                    pass
+                bot_response = "".join(chunks).strip()
+            self.current_state = next_state
+
+            yield 'done', self._create_success_response(bot_response, next_state)
+
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            logger.exception("Ошибка обработки сценария: %s", e)
+            yield 'done', self._create_error_response(str(e))
     
 
 class ScenarioManager:
     @staticmethod
     def validate_scenario_format(scenario_data: Dict[str, Any]) -> bool:
-        required_keys = {'initial_state', 'states'}
-        if not all(key in scenario_data for key in required_keys):
-            return False
-        
-        states = scenario_data['states']
-        if not states or scenario_data['initial_state'] not in states:
-            return False
-        
-        for state_name, state_config in states.items():
-            if not isinstance(state_config, dict):
-                return False
-        return True
+        return analyze_scenario(scenario_data).is_valid
     
     @staticmethod
     def get_default_scenario() -> Dict[str, Any]:
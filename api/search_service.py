@@ -0,0 +1,115 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Exists, F, FloatField, Q, QuerySet
+from django.db.models.functions import Cast
+
+SEARCH_CONFIGS = ('russian', 'english')
+
+
+def build_search_query(text: str) -> SearchQuery:
+    """Запрос в синтаксисе поисковиков ("фраза", -слово, or) сразу по обеим конфигурациям вектора."""
+    query = None
+    for config in SEARCH_CONFIGS:
+        part = SearchQuery(text, config=config, search_type='websearch')
+        query = part if query is None else query | part
+    return query
+
+
+def full_text_supported() -> bool:
+    return connection.vendor == 'postgresql'
+
+
+def filter_by_text(queryset: QuerySet, text: str) -> QuerySet:
+    # Вне Postgres (SQLite при разработке) — обычный поиск подстроки без индекса
+    if full_text_supported():
+        return queryset.filter(search_vector=build_search_query(text))
+    return queryset.filter(content__icontains=text)
+
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[float], int]:
+    try:
+        rank, step_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (None if rank is None else float(rank)), int(step_id)
+    except (ValueError, TypeError):
+        raise ValueError("Неверный курсор поиска")
+
+
+def overlapping_archives(archives: QuerySet, bot: Optional[int] = None, scenario: Optional[int] = None,
+                         conversation: Optional[int] = None, date_from=None) -> QuerySet:
+    # Блок создаётся после всех своих шагов, поэтому архив старше date_from не может попасть в выдачу
+    if bot is not None:
+        archives = archives.filter(scenario__bot_id=bot)
+    if scenario is not None:
+        archives = archives.filter(scenario_id=scenario)
+    if conversation is not None:
+        archives = archives.filter(conversation_id=conversation)
+    if date_from is not None:
+        archives = archives.filter(created_at__gte=date_from)
+    return archives
+
+
+def search_steps(queryset: QuerySet, text: str, bot: Optional[int] = None, scenario: Optional[int] = None,
+                 conversation: Optional[int] = None, step_type: Optional[str] = None, date_from=None,
+                 date_to=None, ordering: str = 'rank', cursor: Optional[str] = None,
+                 limit: int = 20, archives: Optional[QuerySet] = None) -> Dict[str, Any]:
+    """Полнотекстовый поиск шагов с фильтрами и keyset-пагинацией.
+
+    ordering='rank' — по релевантности (ts_rank, затем id), 'recent' — сначала новые.
+    Курсор хранит (rank, id) последней выдачи, поэтому страницы не сдвигаются
+    при вставке новых шагов и не используют OFFSET. Архивные шаги не ищутся:
+    если под фильтры попадают блоки из archives, выдача помечается partial.
+    """
+    queryset = filter_by_text(queryset.defer('search_vector'), text)
+    if bot is not None:
+        queryset = queryset.filter(scenario__bot_id=bot)
+    if scenario is not None:
+        queryset = queryset.filter(scenario_id=scenario)
+    if conversation is not None:
+        queryset = queryset.filter(conversation_id=conversation)
+    if step_type:
+        queryset = queryset.filter(step_type=step_type)
+    if date_from is not None:
+        queryset = queryset.filter(created_at__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(created_at__lt=date_to)
+
+    if archives is not None:
+        # Признак считается в том же запросе, что и страница: отдельный запрос нужен только для пустой выдачи
+        archives = overlapping_archives(archives, bot, scenario, conversation, date_from)
+        queryset = queryset.annotate(archive_overlap=Exists(archives))
+
+    ranked = ordering == 'rank' and full_text_supported()
+    if ranked:
+        # ts_rank возвращает real; double precision без потерь проходит через курсор и сравнение
+        rank_expression = Cast(SearchRank(F('search_vector'), build_search_query(text)), FloatField())
+        queryset = queryset.annotate(rank=rank_expression)
+        queryset = queryset.order_by('-rank', '-id')
+    else:
+        queryset = queryset.order_by('-id')
+
+    if cursor:
+        rank, step_id = decode_cursor(cursor)
+        if ranked and rank is not None:
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=step_id))
+        else:
+            queryset = queryset.filter(id__lt=step_id)
+
+    steps = list(queryset[:limit + 1])
+    has_more = len(steps) > limit
+    steps = steps[:limit]
+    next_cursor = None
+    if has_more and steps:
+        last = steps[-1]
+        next_cursor = encode_cursor([getattr(last, 'rank', None), last.pk])
+    partial = False
+    if archives is not None:
+        partial = steps[0].archive_overlap if steps else archives.exists()
+    return {'steps': steps, 'next': next_cursor, 'partial': partial}
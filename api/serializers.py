@@ -1,35 +1,155 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from .models import Bot, Scenario, Step
+from .models import Bot, Scenario, ScenarioVersion, Step, Conversation, ChatJob
 
-from .scenario_service import ScenarioManager
+from .scenario_analyzer import analyze_scenario
+from .chatbot_service import CHAT_BACKENDS
+from .throttling import parse_rate
 
 class StepSerializer(serializers.ModelSerializer):
     class Meta:
         model = Step
-        fields = '__all__'
+        exclude = ['search_vector']
+
+class StepSearchResultSerializer(StepSerializer):
+    rank = serializers.FloatField(read_only=True, default=None)
+
+class ScenarioListSerializer(serializers.ModelSerializer):
+    steps_count = serializers.IntegerField(read_only=True)
+    class Meta:
+        model = Scenario
+        fields = ['id', 'name', 'description', 'bot', 'is_active', 'created_at', 'updated_at', 'steps_count']
 
 class ScenarioSerializer(serializers.ModelSerializer):
-    steps = StepSerializer(many=True, read_only=True)
+    steps_count = serializers.IntegerField(read_only=True)
+    recent_steps = StepSerializer(many=True, read_only=True)
     class Meta:
         model = Scenario
         fields = '__all__'
+        # Служебные поля ведёт сервер: счётчик шагов, индекс графа, архив и публикация
+        read_only_fields = ['last_step_order', 'scenario_index', 'draft_hash', 'archived_steps', 'published_version']
 
     def validate_scenario_data(self, value):
-        if value and not ScenarioManager.validate_scenario_format(value):
-            raise serializers.ValidationError("Невалидный формат сценария")
+        if value:
+            analysis = analyze_scenario(value)
+            if not analysis.is_valid:
+                raise serializers.ValidationError(analysis.errors)
         return value
 
+class ScenarioVersionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScenarioVersion
+        fields = ['id', 'scenario', 'content_hash', 'created_at']
+
+class ScenarioPublishSerializer(serializers.Serializer):
+    version = serializers.IntegerField(
+        required=False,
+        help_text="Версия для публикации; без неё публикуется черновик scenario_data"
+    )
+
+class BotListSerializer(serializers.ModelSerializer):
+    scenarios_count = serializers.IntegerField(read_only=True)
+    class Meta:
+        model = Bot
+        fields = ['id', 'name', 'description', 'user', 'created_at', 'updated_at', 'scenarios_count']
+
 class BotSerializer(serializers.ModelSerializer):
-    scenarios = ScenarioSerializer(many=True, read_only=True)
+    scenarios = ScenarioListSerializer(many=True, read_only=True)
     class Meta:
         model = Bot
         fields = '__all__'
 
+    def validate_bot_config(self, value):
+        backend = value.get('backend')
+        if backend is not None and backend not in CHAT_BACKENDS:
+            raise serializers.ValidationError(f"Неизвестный бэкенд LLM: {backend}")
+        for key in ('temperature', 'max_tokens', 'latency_ms', 'context_token_budget', 'summary_token_budget', 'context_turns'):
+            if key in value and (isinstance(value[key], bool) or not isinstance(value[key], (int, float))):
+                raise serializers.ValidationError(f"Поле {key} должно быть числом")
+        max_jobs = value.get('max_concurrent_jobs')
+        if max_jobs is not None and (isinstance(max_jobs, bool) or not isinstance(max_jobs, int) or max_jobs < 1):
+            raise serializers.ValidationError("Поле max_concurrent_jobs должно быть положительным целым числом")
+        rate_limit = value.get('rate_limit', {})
+        if not isinstance(rate_limit, dict):
+            raise serializers.ValidationError("Поле rate_limit должно быть объектом")
+        for scope, rate in rate_limit.items():
+            if scope not in ('bot', 'end_user'):
+                raise serializers.ValidationError(f"Неизвестная область лимита: {scope}")
+            try:
+                parse_rate(rate)
+            except (ValueError, KeyError):
+                raise serializers.ValidationError(f"Неверный формат лимита {scope}: {rate}")
+        return value
+
 class ChatSerializer(serializers.Serializer):
     message = serializers.CharField(
         required=True, 
         min_length=1,
         max_length=1000,
         help_text="Сообщение для бота"
-    )
\ No newline at end of file
+    )
+    end_user = serializers.CharField(
+        required=False,
+        max_length=100,
+        help_text="Идентификатор собеседника во внешнем канале"
+    )
+    stream = serializers.BooleanField(
+        required=False,
+        default=False,
+        help_text="Отдавать ответ потоком Server-Sent Events"
+    )
+    enqueue = serializers.BooleanField(
+        required=False,
+        default=False,
+        help_text="Поставить сообщение в очередь и сразу вернуть id задачи"
+    )
+
+    def validate(self, attrs):
+        if attrs['stream'] and attrs['enqueue']:
+            raise serializers.ValidationError("Нельзя одновременно использовать stream и enqueue")
+        return attrs
+
+class ChatBatchItemSerializer(serializers.Serializer):
+    bot = serializers.IntegerField(min_value=1)
+    end_user = serializers.CharField(required=False, max_length=100)
+    message = serializers.CharField(min_length=1, max_length=1000)
+
+class ChatBatchSerializer(serializers.Serializer):
+    items = ChatBatchItemSerializer(many=True, allow_empty=False, max_length=settings.CHAT_BATCH_MAX_ITEMS)
+
+class ChatJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatJob
+        fields = ['id', 'bot', 'end_user_id', 'message', 'status', 'attempts', 'run_at', 'result', 'error',
+                  'created_at', 'updated_at']
+        read_only_fields = fields
+
+class ConversationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Conversation
+        fields = ['id', 'bot', 'scenario', 'end_user_id', 'current_state', 'turn_count', 'summary',
+                  'created_at', 'updated_at']
+        read_only_fields = fields
+
+class StepSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(min_length=1, max_length=200, help_text="Поисковый запрос")
+    bot = serializers.IntegerField(required=False)
+    scenario = serializers.IntegerField(required=False)
+    conversation = serializers.IntegerField(required=False)
+    step_type = serializers.ChoiceField(choices=['user_input', 'bot_response'], required=False)
+    date_from = serializers.DateTimeField(required=False)
+    date_to = serializers.DateTimeField(required=False)
+    ordering = serializers.ChoiceField(choices=['rank', 'recent'], required=False, default='rank')
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+class StepHistoryQuerySerializer(serializers.Serializer):
+    before = serializers.IntegerField(required=False)
+    after = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(required=False, default=50, min_value=1, max_value=500)
+
+    def validate(self, attrs):
+        if 'before' in attrs and 'after' in attrs:
+            raise serializers.ValidationError("Укажите только один из курсоров: before или after")
+        return attrs
@@ -0,0 +1,175 @@
+import threading
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Conversation
+
+SessionKey = Tuple[int, str]
+
+
+class SessionConflict(Exception):
+    """Разговор сохранён другим запросом после того, как этот ход его загрузил."""
+
+
+class SessionStore:
+    def load(self, bot, scenario, end_user_id: str) -> Conversation:
+        raise NotImplementedError
+
+    def save(self, conversation: Conversation):
+        raise NotImplementedError
+
+    def load_many(self, requests: List[Tuple[Any, Any, str]]) -> Dict[SessionKey, Conversation]:
+        """Загружает разговоры для троек (bot, scenario, end_user_id), ключ — (scenario.pk, end_user_id)."""
+        return {
+            (scenario.pk, end_user_id): self.load(bot, scenario, end_user_id)
+            for bot, scenario, end_user_id in requests
+        }
+
+    def save_many(self, conversations: List[Conversation]):
+        for conversation in conversations:
+            self.save(conversation)
+
+    async def aload(self, bot, scenario, end_user_id: str) -> Conversation:
+        return self.load(bot, scenario, end_user_id)
+
+    async def asave(self, conversation: Conversation):
+        self.save(conversation)
+
+
+class DatabaseSessionStore(SessionStore):
+    def load(self, bot, scenario, end_user_id: str) -> Conversation:
+        conversation, _ = Conversation.objects.get_or_create(
+            scenario=scenario,
+            end_user_id=end_user_id,
+            defaults={'bot': bot},
+        )
+        return conversation
+
+    def save(self, conversation: Conversation):
+        conversation.updated_at = timezone.now()
+        updated = self._versioned(conversation).update(version=F('version') + 1, **self._session_fields(conversation))
+        self._check_saved(conversation, updated)
+
+    async def aload(self, bot, scenario, end_user_id: str) -> Conversation:
+        conversation, _ = await Conversation.objects.aget_or_create(
+            scenario=scenario,
+            end_user_id=end_user_id,
+            defaults={'bot': bot},
+        )
+        return conversation
+
+    async def asave(self, conversation: Conversation):
+        conversation.updated_at = timezone.now()
+        updated = await self._versioned(conversation).aupdate(
+            version=F('version') + 1, **self._session_fields(conversation)
+        )
+        self._check_saved(conversation, updated)
+
+    def load_many(self, requests: List[Tuple[Any, Any, str]]) -> Dict[SessionKey, Conversation]:
+        wanted = {(scenario.pk, end_user_id): (bot, scenario) for bot, scenario, end_user_id in requests}
+        if not wanted:
+            return {}
+        conversations = self._fetch(list(wanted))
+        missing = [
+            Conversation(bot=bot, scenario=scenario, end_user_id=end_user_id)
+            for (scenario_id, end_user_id), (bot, scenario) in wanted.items()
+            if (scenario_id, end_user_id) not in conversations
+        ]
+        if missing:
+            # ignore_conflicts не возвращает pk, поэтому новые разговоры перечитываются
+            Conversation.objects.bulk_create(missing, ignore_conflicts=True)
+            conversations.update(self._fetch([(item.scenario_id, item.end_user_id) for item in missing]))
+        return conversations
+
+    def save_many(self, conversations: List[Conversation]):
+        if not conversations:
+            return
+        # executemany вместо bulk_update: CASE WHEN по каждому полю дорого собирать и выполнять
+        now = timezone.now()
+        fields = [Conversation._meta.get_field(name) for name in self._session_fields(conversations[0])]
+        version = connection.ops.quote_name('version')
+        assignments = ", ".join(
+            [f"{connection.ops.quote_name(field.column)} = %s" for field in fields] + [f"{version} = {version} + 1"]
+        )
+        params = []
+        for conversation in conversations:
+            conversation.updated_at = now
+            params.append(
+                [field.get_db_prep_save(getattr(conversation, field.attname), connection) for field in fields]
+                + [conversation.pk, conversation.version]
+            )
+        # Пачка сохраняется целиком или никак: по общему rowcount не понять, какой из разговоров устарел
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {connection.ops.quote_name(Conversation._meta.db_table)} SET {assignments} "
+                f"WHERE id = %s AND {version} = %s",
+                params,
+            )
+            if cursor.rowcount != len(conversations):
+                raise SessionConflict("Часть разговоров пачки изменена параллельными запросами")
+        for conversation in conversations:
+            conversation.version += 1
+
+    def _versioned(self, conversation: Conversation):
+        return Conversation.objects.filter(pk=conversation.pk, version=conversation.version)
+
+    def _check_saved(self, conversation: Conversation, updated: int):
+        if not updated:
+            raise SessionConflict(f"Разговор {conversation.pk} изменён параллельным запросом")
+        conversation.version += 1
+
+    def _fetch(self, keys: List[SessionKey]) -> Dict[SessionKey, Conversation]:
+        query = Q()
+        for scenario_id, end_user_id in keys:
+            query |= Q(scenario_id=scenario_id, end_user_id=end_user_id)
+        return {
+            (conversation.scenario_id, conversation.end_user_id): conversation
+            for conversation in Conversation.objects.filter(query)
+        }
+
+    def _session_fields(self, conversation: Conversation):
+        return {
+            'current_state': conversation.current_state,
+            'scenario_version_id': conversation.scenario_version_id,
+            'turn_count': conversation.turn_count,
+            'context': conversation.context,
+            'summary': conversation.summary,
+            'updated_at': conversation.updated_at,
+        }
+
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self):
+        self._sessions: Dict[Tuple[int, str], Conversation] = {}
+        self._lock = threading.Lock()
+
+    def load(self, bot, scenario, end_user_id: str) -> Conversation:
+        key = (scenario.pk, end_user_id)
+        with self._lock:
+            conversation = self._sessions.get(key)
+            if conversation is None:
+                conversation = Conversation(bot=bot, scenario=scenario, end_user_id=end_user_id)
+                self._sessions[key] = conversation
+        return conversation
+
+    def save(self, conversation: Conversation):
+        conversation.updated_at = timezone.now()
+
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                store_path = getattr(settings, 'CHAT_SESSION_STORE', 'api.session_store.DatabaseSessionStore')
+                _session_store = import_string(store_path)()
+    return _session_store
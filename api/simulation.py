@@ -0,0 +1,188 @@
+import json
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+from .chatbot_service import PseudoBot
+from .llm_cache import normalize_prompt
+from .scenario_analyzer import build_scenario_index
+
+
+class RecordedBot:
+    """Отвечает записанными ответами (JSONL с полями prompt и response) без обращения к LLM."""
+
+    def __init__(self, recording: Dict[str, str], default_response: str = "Записанный ответ не найден"):
+        self.recording = recording
+        self.default_response = default_response
+        self.misses = 0
+
+    @classmethod
+    def from_file(cls, path: str) -> 'RecordedBot':
+        recording = {}
+        with open(path, encoding='utf-8') as recording_file:
+            for line in recording_file:
+                if line.strip():
+                    item = json.loads(line)
+                    recording[normalize_prompt(item['prompt'])] = item['response']
+        return cls(recording)
+
+    def generate_response(self, prompt: str, context=None):
+        response = self.recording.get(normalize_prompt(prompt))
+        if response is None:
+            self.misses += 1
+            return self.default_response
+        return response
+
+    async def agenerate_response(self, prompt: str, context=None):
+        return self.generate_response(prompt, context)
+
+    async def astream_response(self, prompt: str, context=None):
+        yield self.generate_response(prompt, context)
+
+    def cache_signature(self):
+        return {'backend': 'recorded'}
+
+
+def load_scripts(path: str) -> List[Dict[str, Any]]:
+    """Читает сценарии разговоров: по одному JSON на строку.
+
+    Строка — либо список сообщений, либо объект с полями messages,
+    необязательным id и необязательным expect (ожидаемые состояния после каждого хода).
+    """
+    scripts = []
+    with open(path, encoding='utf-8') as scripts_file:
+        for line_number, line in enumerate(scripts_file, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, list):
+                item = {'messages': item}
+            item.setdefault('id', str(line_number))
+            scripts.append(item)
+    return scripts
+
+
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(scenario_data: Dict[str, Any], bot_config: Dict[str, Any], recording_path: Optional[str]):
+    import django
+
+    django.setup()
+    from .llm_cache import response_cache
+    from .scenario_compiler import compile_scenario
+
+    # Симуляция не должна писать в общий кэш ответов LLM
+    response_cache.shared_alias = None
+    _worker['compiled'] = compile_scenario(scenario_data)
+    _worker['bot_config'] = bot_config
+    if recording_path:
+        _worker['chat_bot'] = RecordedBot.from_file(recording_path)
+    else:
+        _worker['chat_bot'] = PseudoBot(**{key: bot_config[key] for key in ('latency_ms',) if key in bot_config})
+
+
+def _run_script(script: Dict[str, Any]) -> Dict[str, Any]:
+    from .chat_service import update_session
+    from .context_builder import ContextBuilder
+    from .models import Bot, Conversation
+    from .scenario_service import ScenarioEngine
+
+    compiled = _worker['compiled']
+    bot = Bot(bot_config=_worker['bot_config'])
+    conversation = Conversation(context=[], summary='', current_state='')
+    context_builder = ContextBuilder.for_bot(bot)
+    expected = script.get('expect') or []
+
+    hits: Counter = Counter()
+    latencies = []
+    errors = 0
+    finished = 0
+    mismatches = []
+    for turn, message in enumerate(script['messages']):
+        started = time.perf_counter()
+        engine = ScenarioEngine(compiled.scenario_data, compiled, conversation.current_state, _worker['chat_bot'])
+        state_name = engine.current_state
+        bot_response_data = engine.process_user_input(message, context_builder.build(conversation))
+        update_session(bot, conversation, message, bot_response_data)
+        latencies.append(time.perf_counter() - started)
+
+        hits[state_name] += 1
+        if bot_response_data['is_finished']:
+            finished += 1
+        if bot_response_data.get('error'):
+            errors += 1
+        next_state = bot_response_data.get('next_state')
+        if turn < len(expected) and expected[turn] != next_state:
+            mismatches.append({'script': script['id'], 'turn': turn, 'expected': expected[turn], 'actual': next_state})
+
+    return {'hits': hits, 'latencies': latencies, 'errors': errors, 'finished': finished, 'mismatches': mismatches}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def simulate(scenario_data: Dict[str, Any], scripts: Iterable[Dict[str, Any]], workers: int = 1,
+             bot_config: Optional[Dict[str, Any]] = None, recording_path: Optional[str] = None,
+             scenario_index: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """scenario_index — сохранённый Scenario.scenario_index; без него граф анализируется заново."""
+    from .scenario_compiler import compile_scenario
+
+    if not scenario_index:
+        scenario_index = build_scenario_index(scenario_data)
+
+    compiled = compile_scenario(scenario_data)
+    init_args = (scenario_data, bot_config or {}, recording_path)
+    scripts = list(scripts)
+
+    started = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as executor:
+            results = list(executor.map(_run_script, scripts, chunksize=max(len(scripts) // (workers * 4), 1)))
+    else:
+        from .llm_cache import response_cache
+
+        # В одном процессе настройки воркера действуют только на время прогона
+        shared_alias = response_cache.shared_alias
+        try:
+            _init_worker(*init_args)
+            results = [_run_script(script) for script in scripts]
+        finally:
+            response_cache.shared_alias = shared_alias
+            _worker.clear()
+    elapsed = time.perf_counter() - started
+
+    hits: Counter = Counter()
+    latencies: List[float] = []
+    errors = 0
+    finished = 0
+    mismatches = []
+    for result in results:
+        hits.update(result['hits'])
+        latencies.extend(result['latencies'])
+        errors += result['errors']
+        finished += result['finished']
+        mismatches.extend(result['mismatches'])
+    latencies.sort()
+
+    return {
+        'scripts': len(scripts),
+        'turns': len(latencies),
+        'errors': errors,
+        'elapsed': elapsed,
+        'turns_per_sec': len(latencies) / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            name: percentile(latencies, fraction) * 1000
+            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))
+        },
+        'state_hits': {state.name: hits[state.name] for state in compiled.states},
+        'finished': finished,
+        'never_hit': [state.name for state in compiled.states if not hits[state.name]],
+        'unreachable': scenario_index.get('unreachable_states', []),
+        'mismatches': mismatches,
+    }
@@ -0,0 +1,61 @@
+import re
+from functools import lru_cache
+from typing import List
+
+# Стеммер Портера для русского языка (вариант Snowball) — без внешних зависимостей
+_RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_DERIVATIONAL_REGION = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_DERIVATIONAL = re.compile(r'ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize_text(text: str) -> str:
+    return text.lower().replace('ё', 'е')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize_text(text))
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    match = _RV.match(word)
+    if match is None:
+        return word
+    prefix, rv = match.groups()
+
+    stripped = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        stripped = _ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    if _DERIVATIONAL_REGION.match(rv):
+        rv = _DERIVATIONAL.sub('', rv, 1)
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    return prefix + rv
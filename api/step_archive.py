@@ -0,0 +1,190 @@
+import gzip
+import heapq
+import json
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, QuerySet
+
+from .models import Conversation, Scenario, Step, StepArchive
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен, gzip доступен всегда
+    zstandard = None
+
+ARCHIVE_CHUNK_STEPS = 200
+DELETE_BATCH_SIZE = 1000
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=10).compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+CODECS = {
+    'gzip': (lambda data: gzip.compress(data, compresslevel=6), gzip.decompress),
+    'zstd': (_zstd_compress, _zstd_decompress),
+}
+
+
+def check_codec(codec: str):
+    if codec not in CODECS:
+        raise ValueError(f"Неизвестный кодек архива: {codec}")
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError("Для кодека zstd нужен пакет zstandard")
+
+
+def _encode(rows, codec: str) -> bytes:
+    payload = [[pk, order, step_type, content, created_at.isoformat()]
+               for pk, order, step_type, content, created_at in rows]
+    return CODECS[codec][0](json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_archive(archive: StepArchive) -> List[Step]:
+    """Восстанавливает шаги блока как несохранённые Step с исходными id и order."""
+    payload = json.loads(CODECS[archive.codec][1](bytes(archive.data)))
+    return [
+        Step(
+            id=pk, order=order, step_type=step_type, content=content,
+            created_at=datetime.fromisoformat(created_at),
+            scenario_id=archive.scenario_id, conversation_id=archive.conversation_id,
+        )
+        for pk, order, step_type, content, created_at in payload
+    ]
+
+
+def archivable_conversations(cutoff) -> QuerySet:
+    """Разговоры без активности с cutoff, у которых ещё есть шаги в горячей таблице."""
+    return (
+        Conversation.objects
+        .filter(updated_at__lt=cutoff)
+        .filter(Exists(Step.objects.filter(conversation=OuterRef('pk'))))
+        .order_by('id')
+    )
+
+
+def archivable_legacy_scenarios(cutoff) -> QuerySet:
+    """Сценарии, у которых есть шаги без разговора и ни одного такого шага новее cutoff."""
+    legacy_steps = Step.objects.filter(scenario=OuterRef('pk'), conversation__isnull=True)
+    return (
+        Scenario.objects
+        .filter(Exists(legacy_steps))
+        .filter(~Exists(legacy_steps.filter(created_at__gte=cutoff)))
+        .order_by('id')
+    )
+
+
+def _archive_rows(scenario_id: int, conversation_id: Optional[int], rows, codec: str) -> int:
+    archives = []
+    for start in range(0, len(rows), ARCHIVE_CHUNK_STEPS):
+        chunk = rows[start:start + ARCHIVE_CHUNK_STEPS]
+        ids = [row[0] for row in chunk]
+        orders = [row[1] for row in chunk]
+        archives.append(StepArchive(
+            scenario_id=scenario_id,
+            conversation_id=conversation_id,
+            first_order=min(orders),
+            last_order=max(orders),
+            first_id=min(ids),
+            last_id=max(ids),
+            step_count=len(chunk),
+            codec=codec,
+            data=_encode(chunk, codec),
+        ))
+    StepArchive.objects.bulk_create(archives)
+
+    # Удаляются только прочитанные id: шаг, записанный write-behind позже, останется в горячей таблице
+    ids = [row[0] for row in rows]
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        Step.objects.filter(id__in=ids[start:start + DELETE_BATCH_SIZE]).delete()
+    Scenario.objects.filter(pk=scenario_id).update(archived_steps=F('archived_steps') + len(rows))
+    return len(rows)
+
+
+def _step_rows(steps: QuerySet, key: str) -> List[tuple]:
+    return list(steps.order_by(key).values_list('id', 'order', 'step_type', 'content', 'created_at'))
+
+
+@transaction.atomic
+def archive_conversation(conversation_id: int, codec: str) -> int:
+    """Переносит все шаги разговора в сжатые блоки StepArchive и удаляет их из Step."""
+    # Блокировка разговора ставит в очередь новые ходы (allocate_step_orders обновляет ту же строку)
+    conversation = Conversation.objects.select_for_update().only('id', 'scenario_id').filter(pk=conversation_id).first()
+    if conversation is None:
+        return 0
+    rows = _step_rows(Step.objects.filter(conversation_id=conversation_id), 'order')
+    if not rows:
+        return 0
+    archived = _archive_rows(conversation.scenario_id, conversation_id, rows, codec)
+    Conversation.objects.filter(pk=conversation_id).update(archived_steps=F('archived_steps') + archived)
+    return archived
+
+
+@transaction.atomic
+def archive_legacy_steps(scenario_id: int, codec: str) -> int:
+    """Архивирует шаги сценария без разговора блоками по id, как их читает история сценария."""
+    # Шаги без разговора нумеруются счётчиком сценария: блокировка строки ставит их запись в очередь
+    if Scenario.objects.select_for_update().only('id').filter(pk=scenario_id).first() is None:
+        return 0
+    rows = _step_rows(Step.objects.filter(scenario_id=scenario_id, conversation__isnull=True), 'id')
+    if not rows:
+        return 0
+    return _archive_rows(scenario_id, None, rows, codec)
+
+
+def _archive_bounds(key: str):
+    return ('first_order', 'last_order') if key == 'order' else ('first_id', 'last_id')
+
+
+def read_archived(archives: QuerySet, key: str, lower: Optional[int], upper: Optional[int],
+                  descending: bool, limit: int) -> List[Step]:
+    """До limit архивных шагов с lower < key < upper, ближайших к началу обхода.
+
+    Блоки разных разговоров сценария пересекаются по id, поэтому обход
+    останавливается, только когда следующий блок уже не может попасть в страницу.
+    """
+    first, last = _archive_bounds(key)
+    if upper is not None:
+        archives = archives.filter(**{f'{first}__lt': upper})
+    if lower is not None:
+        archives = archives.filter(**{f'{last}__gt': lower})
+    archives = archives.order_by(f'-{last}' if descending else first)
+
+    collected: List[Step] = []
+    for archive in archives.iterator(chunk_size=20):
+        if len(collected) >= limit:
+            collected.sort(key=lambda step: getattr(step, key), reverse=descending)
+            del collected[limit:]
+            edge = getattr(collected[-1], key)
+            boundary = getattr(archive, last if descending else first)
+            if (boundary < edge) if descending else (boundary > edge):
+                break
+        collected.extend(
+            step for step in decode_archive(archive)
+            if (lower is None or getattr(step, key) > lower) and (upper is None or getattr(step, key) < upper)
+        )
+    collected.sort(key=lambda step: getattr(step, key), reverse=descending)
+    return collected[:limit]
+
+
+def iter_archived(archives: QuerySet, key: str) -> Iterator[Step]:
+    """Архивные шаги по возрастанию key.
+
+    Блоки разных разговоров (и шагов без разговора) пересекаются по id, поэтому
+    шаг отдаётся, только когда ни один следующий блок не может начаться раньше него.
+    """
+    first, _ = _archive_bounds(key)
+    pending: List[Tuple[int, int, Step]] = []
+    for archive in archives.order_by(first, 'id').iterator(chunk_size=20):
+        boundary = getattr(archive, first)
+        while pending and pending[0][0] < boundary:
+            yield heapq.heappop(pending)[2]
+        for step in decode_archive(archive):
+            heapq.heappush(pending, (getattr(step, key), step.pk, step))
+    while pending:
+        yield heapq.heappop(pending)[2]
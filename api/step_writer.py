@@ -0,0 +1,174 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+
+from .models import Conversation, Scenario, Step
+
+logger = logging.getLogger(__name__)
+
+StepPayload = Tuple[str, str]
+# (scenario_id, conversation_id): шаги без разговора нумеруются счётчиком сценария
+StepOwner = Tuple[int, Optional[int]]
+
+
+def allocate_step_orders(scenario_id: int, count: int, conversation_id: Optional[int] = None) -> int:
+    """Резервирует count номеров в счётчике разговора (или сценария) и возвращает первый.
+
+    Счётчик разговора блокирует только строку одного пользователя, поэтому
+    параллельные диалоги одного бота не конкурируют за строку сценария.
+    """
+    model, pk = (Conversation, conversation_id) if conversation_id is not None else (Scenario, scenario_id)
+    if connection.vendor in ('postgresql', 'sqlite'):
+        table = connection.ops.quote_name(model._meta.db_table)
+        column = connection.ops.quote_name('last_step_order')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET {column} = {column} + %s WHERE id = %s RETURNING {column}",
+                [count, pk],
+            )
+            last_order = cursor.fetchone()[0]
+    else:
+        model.objects.filter(pk=pk).update(last_step_order=F('last_step_order') + count)
+        last_order = model.objects.filter(pk=pk).values_list('last_step_order', flat=True).get()
+    return last_order - count + 1
+
+
+def _build_steps(owner: StepOwner, first_order: int, payloads: List[StepPayload]) -> List[Step]:
+    scenario_id, conversation_id = owner
+    return [
+        Step(scenario_id=scenario_id, conversation_id=conversation_id, order=first_order + offset,
+             content=content, step_type=step_type)
+        for offset, (content, step_type) in enumerate(payloads)
+    ]
+
+
+def append_steps(scenario_id: int, payloads: List[StepPayload], conversation_id: Optional[int] = None):
+    with transaction.atomic():
+        first_order = allocate_step_orders(scenario_id, len(payloads), conversation_id)
+        Step.objects.bulk_create(_build_steps((scenario_id, conversation_id), first_order, payloads))
+
+
+def append_steps_batch(batch: Dict[StepOwner, List[StepPayload]]):
+    steps = []
+    with transaction.atomic():
+        # Один порядок захвата строк-счётчиков во всех воркерах исключает взаимные блокировки
+        for owner in sorted(batch, key=lambda owner: (owner[1] is None, owner[1] or 0, owner[0])):
+            first_order = allocate_step_orders(owner[0], len(batch[owner]), owner[1])
+            steps.extend(_build_steps(owner, first_order, batch[owner]))
+        Step.objects.bulk_create(steps)
+
+
+class WriteBehindStepWriter:
+    """Фоновая запись шагов диалога пачками, вне пути ответа пользователю.
+
+    Если пачка не записалась, шаги пишутся по разговорам; неудавшиеся
+    разговоры повторяются в начале следующей пачки, до max_attempts раз.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 0.5, max_attempts: int = 5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._queue: 'queue.Queue[Tuple[StepOwner, List[StepPayload]]]' = queue.Queue()
+        # Повторы идут раньше новых шагов тех же разговоров, иначе нарушится порядок
+        self._retry: Dict[StepOwner, Tuple[List[StepPayload], int]] = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, scenario_id: int, payloads: List[StepPayload], conversation_id: Optional[int] = None):
+        self._ensure_started()
+        self._queue.put(((scenario_id, conversation_id), payloads))
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='step-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _drain(self, first_item=None) -> Tuple[Dict[StepOwner, List[StepPayload]], Dict[StepOwner, int]]:
+        batch: Dict[StepOwner, List[StepPayload]] = defaultdict(list)
+        with self._lock:
+            retry, self._retry = self._retry, {}
+        attempts = {owner: attempt for owner, (_, attempt) in retry.items()}
+        for owner, (payloads, _) in retry.items():
+            batch[owner].extend(payloads)
+        items = 0
+        if first_item is not None:
+            batch[first_item[0]].extend(first_item[1])
+            items += 1
+        while items < self.batch_size:
+            try:
+                owner, payloads = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch[owner].extend(payloads)
+            items += 1
+        return batch, attempts
+
+    def _write(self, batch: Dict[StepOwner, List[StepPayload]], attempts: Dict[StepOwner, int]) -> bool:
+        if not batch:
+            return True
+        try:
+            append_steps_batch(batch)
+            return True
+        except Exception as e:
+            logger.warning("Пачка шагов не записана, пишем по разговорам: %s", e)
+        finally:
+            close_old_connections()
+
+        written = True
+        for owner, payloads in batch.items():
+            try:
+                append_steps(owner[0], payloads, owner[1])
+            except Exception as e:
+                written = False
+                self._requeue(owner, payloads, attempts.get(owner, 0) + 1, e)
+            finally:
+                close_old_connections()
+        return written
+
+    def _requeue(self, owner: StepOwner, payloads: List[StepPayload], attempt: int, error: Exception):
+        if attempt >= self.max_attempts:
+            logger.error("Шаги разговора %s потеряны после %d попыток записи (%d шт.): %s",
+                         owner, attempt, len(payloads), error)
+            return
+        logger.warning("Повторим запись шагов разговора %s (попытка %d): %s", owner, attempt, error)
+        with self._lock:
+            self._retry[owner] = (payloads, attempt)
+
+    def _has_pending(self) -> bool:
+        return bool(self._retry) or not self._queue.empty()
+
+    def _run(self):
+        while True:
+            first_item = None
+            if not self._retry:
+                try:
+                    first_item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+            if not self._write(*self._drain(first_item)):
+                # Пауза перед повтором, чтобы не крутиться вхолостую при недоступной БД
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        while self._has_pending():
+            if not self._write(*self._drain()):
+                time.sleep(self.flush_interval)
+
+
+step_writer = WriteBehindStepWriter(
+    batch_size=getattr(settings, 'CHAT_STEP_WRITE_BEHIND_BATCH', 500),
+    flush_interval=getattr(settings, 'CHAT_STEP_WRITE_BEHIND_INTERVAL', 0.5),
+)
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .chat_service import arun_chat_turn
+from .chatbot_service import LLMOverloadedError
+from .throttling import check_chat_rate
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MAX_INPUT_LENGTH = 1000
+TELEGRAM_MAX_REPLY_LENGTH = 4096
+TELEGRAM_THROTTLED_REPLY = "Слишком много сообщений, попробуйте немного позже."
+
+
+class ChatDispatcher:
+    """Ограниченный пул обработки апдейтов с сохранением порядка внутри чата.
+
+    Глобальный семафор ограничивает число одновременно выполняемых ходов,
+    а FIFO-блокировка на каждый чат гарантирует, что сообщения одного
+    собеседника обрабатываются строго по очереди.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int):
+        self._workers = asyncio.Semaphore(max_workers)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._chat_locks: Dict[Hashable, Tuple[asyncio.Lock, int]] = {}
+        # Задачи по группам (обычно по боту): переподключение одного бота ждёт только свои апдейты
+        self._tasks: Dict[Hashable, Set[asyncio.Task]] = {}
+
+    async def run(self, chat_key: Hashable, handler: Callable[[], Awaitable[Any]]):
+        lock, users = self._chat_locks.get(chat_key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._chat_locks[chat_key] = (lock, users + 1)
+        try:
+            async with lock:
+                async with self._workers:
+                    return await handler()
+        finally:
+            lock, users = self._chat_locks[chat_key]
+            if users == 1:
+                del self._chat_locks[chat_key]
+            else:
+                self._chat_locks[chat_key] = (lock, users - 1)
+
+    async def submit(self, chat_key: Hashable, handler: Callable[[], Awaitable[Any]], group: Hashable = None):
+        await self._pending.acquire()
+        task = asyncio.create_task(self._run_submitted(chat_key, handler))
+        tasks = self._tasks.setdefault(group, set())
+        tasks.add(task)
+        task.add_done_callback(lambda done: self._forget(group, done))
+
+    def _forget(self, group: Hashable, task: asyncio.Task):
+        tasks = self._tasks.get(group)
+        if tasks is None:
+            return
+        tasks.discard(task)
+        if not tasks:
+            del self._tasks[group]
+
+    async def _run_submitted(self, chat_key: Hashable, handler: Callable[[], Awaitable[Any]]):
+        try:
+            await self.run(chat_key, handler)
+        except Exception as e:
+            logger.exception("Ошибка обработки апдейта Telegram: %s", e)
+        finally:
+            self._pending.release()
+
+    async def drain(self, group: Hashable = None):
+        """Ждёт задачи группы; без group — все задачи диспетчера."""
+        if group is None:
+            tasks = [task for group_tasks in self._tasks.values() for task in group_tasks]
+        else:
+            tasks = list(self._tasks.get(group, ()))
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Примитивы asyncio привязаны к циклу: у каждого цикла свой диспетчер, и он уходит вместе с циклом
+_dispatchers: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ChatDispatcher]' = weakref.WeakKeyDictionary()
+
+
+def get_dispatcher() -> ChatDispatcher:
+    loop = asyncio.get_running_loop()
+    dispatcher = _dispatchers.get(loop)
+    if dispatcher is None:
+        dispatcher = ChatDispatcher(settings.TELEGRAM_MAX_WORKERS, settings.TELEGRAM_MAX_PENDING)
+        _dispatchers[loop] = dispatcher
+    return dispatcher
+
+
+def telegram_end_user_id(chat_id) -> str:
+    return f"telegram:{chat_id}"
+
+
+def extract_message(update: Dict[str, Any]) -> Optional[Tuple[int, str]]:
+    message = update.get('message') or {}
+    text = message.get('text')
+    chat_id = (message.get('chat') or {}).get('id')
+    if not text or chat_id is None:
+        return None
+    return chat_id, text[:TELEGRAM_MAX_INPUT_LENGTH]
+
+
+async def answer_message(bot, chat_id, text: str) -> str:
+    end_user_id = telegram_end_user_id(chat_id)
+    if await sync_to_async(check_chat_rate, thread_sensitive=False)(bot, end_user_id) is not None:
+        return TELEGRAM_THROTTLED_REPLY
+    try:
+        bot_response_data = await arun_chat_turn(bot, end_user_id, text)
+    except LLMOverloadedError:
+        return TELEGRAM_THROTTLED_REPLY
+    return bot_response_data['response'][:TELEGRAM_MAX_REPLY_LENGTH]
+
+
+def create_telegram_client(token: str):
+    from telegram import Bot as TelegramBot
+    from telegram.request import HTTPXRequest
+
+    return TelegramBot(
+        token=token,
+        base_url=f"{settings.TELEGRAM_API_BASE_URL}/bot",
+        request=HTTPXRequest(connection_pool_size=settings.TELEGRAM_CONNECTION_POOL),
+        get_updates_request=HTTPXRequest(
+            connection_pool_size=1,
+            read_timeout=settings.TELEGRAM_POLL_TIMEOUT + 10,
+        ),
+    )
+
+
+class PollState:
+    """Переживает переподключения: offset не даёт повторно получить обработанные апдейты."""
+
+    __slots__ = ('offset', 'received')
+
+    def __init__(self):
+        self.offset: Optional[int] = None
+        self.received = False
+
+
+async def _wait_stop(stop_event: asyncio.Event, seconds: float):
+    try:
+        await asyncio.wait_for(stop_event.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def poll_bot(bot, dispatcher: ChatDispatcher, stop_event: asyncio.Event):
+    """Long polling одного бота до stop_event.
+
+    Любая ошибка (включая отозванный токен при delete_webhook) пересоздаёт клиента
+    с экспоненциальной паузой и не затрагивает остальных ботов процесса.
+    """
+    from telegram.error import InvalidToken
+
+    token = bot.bot_config['telegram_token']
+    state = PollState()
+    backoff = 1
+    while not stop_event.is_set():
+        try:
+            async with create_telegram_client(token) as telegram_client:
+                await telegram_client.delete_webhook()
+                try:
+                    await _poll_updates(bot, telegram_client, dispatcher, stop_event, state)
+                finally:
+                    # Ответы отправляются этим клиентом, поэтому он закрывается только после них
+                    await dispatcher.drain(bot.pk)
+        except InvalidToken as e:
+            logger.error("Недействительный токен Telegram у %s: %s", bot, e)
+            backoff = 60
+        except Exception as e:
+            logger.warning("Ошибка long polling Telegram для %s: %s", bot, e)
+            if state.received:
+                backoff = 1
+        else:
+            continue
+        state.received = False
+        await _wait_stop(stop_event, backoff)
+        backoff = min(backoff * 2, 60)
+
+
+async def _poll_updates(bot, telegram_client, dispatcher: ChatDispatcher, stop_event: asyncio.Event,
+                        state: PollState):
+    while not stop_event.is_set():
+        # Процесс живёт долго: соединения с БД перепроверяются, как между HTTP-запросами
+        await sync_to_async(close_old_connections)()
+        updates = await telegram_client.get_updates(
+            offset=state.offset,
+            timeout=settings.TELEGRAM_POLL_TIMEOUT,
+            allowed_updates=['message'],
+        )
+        state.received = True
+        for update in updates:
+            state.offset = update.update_id + 1
+            message = extract_message(update.to_dict())
+            if message is None:
+                continue
+            chat_id, text = message
+
+            async def handle(chat_id=chat_id, text=text):
+                reply = await answer_message(bot, chat_id, text)
+                await telegram_client.send_message(chat_id=chat_id, text=reply)
+
+            await dispatcher.submit(('telegram', bot.pk, chat_id), handle, group=bot.pk)
+
+
+async def set_webhooks(bots, base_url: str):
+    for bot in bots:
+        async with create_telegram_client(bot.bot_config['telegram_token']) as telegram_client:
+            await telegram_client.set_webhook(
+                url=f"{base_url.rstrip('/')}/api/telegram/{bot.pk}/webhook/",
+                secret_token=bot.bot_config.get('telegram_webhook_secret'),
+                allowed_updates=['message'],
+            )
@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api import authentication
+from api.authentication import issue_bot_token, token_cache, user_cache
+from api.models import Bot
+
+
+@override_settings(CHAT_RATE_LIMITS={})
+class BotTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        user_cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.bot = Bot.objects.create(name="Бот", user=self.user, bot_config={'backend': 'pseudo'})
+        self.other_bot = Bot.objects.create(name="Другой", user=self.user, bot_config={'backend': 'pseudo'})
+        self.client = APIClient()
+
+    def chat(self, bot, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bot {token}")
+        return self.client.post(f'/api/bots/{bot.pk}/chat/', {'message': "привет"}, format='json')
+
+    def test_token_is_issued_for_owned_bot_only(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post(f'/api/bots/{self.bot.pk}/token/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['token_type'], 'Bot')
+
+        stranger = APIClient()
+        stranger.force_authenticate(User.objects.create_user('stranger'))
+        self.assertEqual(stranger.post(f'/api/bots/{self.bot.pk}/token/').status_code, 404)
+
+    def test_token_opens_chat_of_its_bot_only(self):
+        token = issue_bot_token(self.bot)['token']
+        self.assertEqual(self.chat(self.bot, token).status_code, 200)
+        self.assertEqual(self.chat(self.other_bot, token).status_code, 403)
+        # Вне действий чата токен бота вообще не принимается
+        self.assertEqual(self.client.get('/api/bots/').status_code, 401)
+
+    def test_expired_and_tampered_tokens_are_rejected(self):
+        token = issue_bot_token(self.bot, max_age=60)['token']
+        with mock.patch.object(authentication.time, 'time', return_value=authentication.time.time() + 120):
+            self.assertEqual(self.chat(self.bot, token).status_code, 401)
+        self.assertEqual(self.chat(self.bot, token[:-2] + 'xx').status_code, 401)
+
+    def test_deactivated_owner_loses_access_immediately(self):
+        token = issue_bot_token(self.bot)['token']
+        self.assertEqual(self.chat(self.bot, token).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.chat(self.bot, token).status_code, 401)
+
+    def test_sync_and_async_chat_apply_the_same_checks(self):
+        token = issue_bot_token(self.bot)['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bot {token}")
+        for path in ('chat', 'achat'):
+            with self.subTest(path=path):
+                def post(bot, data):
+                    return self.client.post(f'/api/bots/{bot.pk}/{path}/', data, format='json')
+
+                self.assertEqual(post(self.bot, {'message': "привет"}).status_code, 200)
+                denied = post(self.other_bot, {'message': "привет"})
+                self.assertEqual(denied.status_code, 403)
+                self.assertIn('detail', denied.json())
+                invalid = post(self.bot, {'message': ""})
+                self.assertEqual(invalid.status_code, 400)
+                self.assertIn('message', invalid.json())
+                with override_settings(CHAT_RATE_LIMITS={'end_user': '1/min'}):
+                    post(self.bot, {'message': "раз", 'end_user': path})
+                    throttled = post(self.bot, {'message': "два", 'end_user': path})
+                self.assertEqual(throttled.status_code, 429)
+                self.assertIn('Retry-After', throttled)
+
+    def test_chat_validates_signature_without_queries_for_user(self):
+        token = issue_bot_token(self.bot)['token']
+        self.chat(self.bot, token)
+        with self.assertNumQueries(0):
+            user, access = authentication.BotTokenAuthentication().authenticate_credentials(token)
+        self.assertEqual((user.pk, access.bot_id), (self.user.pk, self.bot.pk))
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = User.objects.create_user('owner')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_revoked_token_is_dropped_from_cache(self):
+        self.assertEqual(self.client.get('/api/bots/').status_code, 200)
+        with self.assertNumQueries(0):
+            authentication.CachedTokenAuthentication().authenticate_credentials(self.token.key)
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/bots/').status_code, 401)
@@ -0,0 +1,45 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from api import batch_chat
+from api.batch_chat import run_chat_batch
+from api.chatbot_service import LLM_ERROR_RESPONSE
+from api.models import Bot, Conversation, Scenario, Step
+
+
+@override_settings(CHAT_STEP_WRITE_BEHIND=False, CHAT_RATE_LIMITS={})
+class ChatBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+        self.bot = Bot.objects.create(name="Бот", user=self.user, bot_config={'backend': 'pseudo'})
+        Scenario.objects.create(name="Сценарий", bot=self.bot, is_active=True)
+
+    def run_batch(self, *end_users):
+        return run_chat_batch(self.user, [{'bot': self.bot.pk, 'end_user': end_user, 'message': "привет"}
+                                          for end_user in end_users])
+
+    def test_engine_error_is_reported_and_not_saved(self):
+        process_message = batch_chat.process_message
+
+        def fail_for_b(bot, scenario, conversation, user_message, context):
+            if conversation.end_user_id == 'b':
+                return {'response': LLM_ERROR_RESPONSE, 'error': "таймаут", 'current_state': None, 'is_finished': False}
+            return process_message(bot, scenario, conversation, user_message, context)
+
+        with mock.patch.object(batch_chat, 'process_message', side_effect=fail_for_b):
+            results = self.run_batch('a', 'b')
+        self.assertEqual([result['status'] for result in results], ['ok', 'error'])
+        self.assertEqual(results[1]['error'], "таймаут")
+        self.assertEqual(set(Step.objects.values_list('conversation__end_user_id', flat=True)), {'a'})
+        self.assertEqual(Conversation.objects.get(end_user_id='b').turn_count, 0)
+
+    def test_persist_failure_keeps_per_turn_results(self):
+        with mock.patch.object(batch_chat, 'append_steps_batch', side_effect=RuntimeError("нет соединения")):
+            results = self.run_batch('a', 'b')
+        self.assertEqual([result['status'] for result in results], ['persist_failed', 'persist_failed'])
+        self.assertTrue(all(result['response'] and result['error'] == "нет соединения" for result in results))
+        # Сессии откатываются вместе с шагами
+        self.assertEqual(list(Conversation.objects.values_list('turn_count', flat=True)), [0, 0])
+        self.assertFalse(Step.objects.exists())
@@ -0,0 +1,50 @@
+import asyncio
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from api import chat_service
+from api.chat_service import astream_chat_turn
+from api.metrics import CHAT_PHASE_DURATION
+from api.models import Bot, Scenario, Step
+
+
+def engine_seconds() -> float:
+    counts = CHAT_PHASE_DURATION._values.get(('engine',))
+    return counts[-1] if counts else 0.0
+
+
+@override_settings(CHAT_STEP_WRITE_BEHIND=False)
+class ChatStreamTests(TestCase):
+    def setUp(self):
+        self.bot = Bot.objects.create(name="Бот", user=User.objects.create_user('owner'), bot_config={'backend': 'pseudo'})
+        Scenario.objects.create(name="Сценарий", bot=self.bot, is_active=True)
+
+    async def collect(self, events, delay: float = 0.0):
+        chunks = []
+        with mock.patch.object(chat_service, '_astream_without_scenario', return_value=events):
+            async for chunk in astream_chat_turn(self.bot, 'a', "привет"):
+                chunks.append(chunk)
+                await asyncio.sleep(delay)
+        return chunks
+
+    async def test_engine_phase_excludes_time_spent_by_the_client(self):
+        async def events():
+            for text in ("раз", "два", "три"):
+                yield 'token', text
+            yield 'done', {'response': "раз два три", 'current_state': None, 'is_finished': False}
+
+        before = engine_seconds()
+        chunks = await self.collect(events(), delay=0.05)
+        self.assertTrue(chunks[-1].startswith("event: done"))
+        self.assertLess(engine_seconds() - before, 0.05)
+
+    async def test_stream_without_result_ends_with_error_event(self):
+        async def events():
+            yield 'token', "обрыв"
+
+        chunks = await self.collect(events())
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[-1].startswith("event: error"))
+        self.assertFalse(await Step.objects.aexists())
@@ -0,0 +1,43 @@
+import asyncio
+import gc
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api import chatbot_service
+from api.chatbot_service import DeepSeekBot, aclose_http_client, get_http_client
+
+
+class LoopBoundClientTests(SimpleTestCase):
+    def test_each_event_loop_gets_its_own_async_client(self):
+        async def clients():
+            return get_http_client(is_async=True), get_http_client(is_async=True)
+
+        first, same = asyncio.run(clients())
+        second, _ = asyncio.run(clients())
+        self.assertIs(first, same)
+        self.assertIsNot(first, second)
+        self.assertIs(get_http_client(), get_http_client())
+
+    @mock.patch.dict('os.environ', {'DEEPSEEK_API_KEY': 'test'})
+    def test_openai_client_follows_the_loop(self):
+        bot = DeepSeekBot()
+
+        async def client():
+            return bot.async_client, bot.async_client._client
+
+        first, first_http = asyncio.run(client())
+        second, second_http = asyncio.run(client())
+        self.assertIsNot(first, second)
+        self.assertIsNot(first_http, second_http)
+
+    def test_clients_of_finished_loops_are_released(self):
+        async def open_and_close():
+            client = get_http_client(is_async=True)
+            await aclose_http_client()
+            return client
+
+        self.assertTrue(asyncio.run(open_and_close()).is_closed)
+        asyncio.run(asyncio.sleep(0))
+        gc.collect()
+        self.assertEqual(len(chatbot_service._async_http_clients), 0)
@@ -0,0 +1,107 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from api import job_queue
+from api.chat_service import ChatTurnError
+from api.chatbot_service import LLMOverloadedError
+from api.job_queue import claim_job, enqueue_chat_job, extend_lease, run_job
+from api.models import Bot, ChatJob
+from api.serializers import BotSerializer
+
+
+@override_settings(CHAT_JOB_MAX_ATTEMPTS=2, CHAT_JOB_RETRY_BASE_DELAY=10, CHAT_JOB_RETRY_MAX_DELAY=60,
+                   CHAT_JOB_BOT_CONCURRENCY=4, CHAT_JOB_CLAIM_BATCH=10, CHAT_JOB_LEASE_SECONDS=30)
+class ChatJobQueueTests(TestCase):
+    def setUp(self):
+        self.bot = Bot.objects.create(name="Бот", user=User.objects.create_user('owner'))
+
+    def run_claimed(self, side_effect):
+        job = claim_job()
+        self.assertIsNotNone(job)
+        with mock.patch.object(job_queue, 'run_chat_turn', side_effect=side_effect):
+            run_job(job)
+        job.refresh_from_db()
+        return job
+
+    def make_due(self, job):
+        job.run_at = timezone.now() - timedelta(seconds=1)
+        job.save(update_fields=['run_at'])
+
+    def test_failed_job_is_retried_with_backoff_then_succeeds(self):
+        enqueue_chat_job(self.bot, 'a', "привет")
+        job = self.run_claimed(ChatTurnError("LLM недоступен"))
+        self.assertEqual((job.status, job.attempts, job.error), ('queued', 1, "LLM недоступен"))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=7))
+        self.assertIsNone(claim_job())
+
+        self.make_due(job)
+        job = self.run_claimed(lambda *args, **kwargs: {'response': "Привет!!"})
+        self.assertEqual((job.status, job.attempts, job.error), ('done', 2, ''))
+        self.assertEqual(job.result, {'response': "Привет!!"})
+
+    def test_job_fails_after_max_attempts(self):
+        job = enqueue_chat_job(self.bot, 'a', "привет")
+        self.run_claimed(LLMOverloadedError('pseudo', 1))
+        self.make_due(job)
+        job = self.run_claimed(ChatTurnError("ошибка"))
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIsNone(claim_job())
+
+    def test_later_message_waits_for_earlier_retry(self):
+        first = enqueue_chat_job(self.bot, 'a', "раз")
+        second = enqueue_chat_job(self.bot, 'a', "два")
+        other = enqueue_chat_job(self.bot, 'b', "другой")
+        self.run_claimed(ChatTurnError("ошибка"))
+        self.assertEqual(claim_job(), other)
+        self.assertIsNone(claim_job())
+
+        self.make_due(first)
+        self.assertEqual(claim_job(), first)
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'queued')
+
+    def test_expired_lease_is_reclaimed(self):
+        job = enqueue_chat_job(self.bot, 'a', "привет")
+        self.assertEqual(claim_job(), job)
+        job.refresh_from_db()
+        job.locked_until = timezone.now() - timedelta(seconds=1)
+        job.save(update_fields=['locked_until'])
+        reclaimed = claim_job()
+        self.assertEqual(reclaimed, job)
+        self.assertEqual(reclaimed.attempts, 2)
+
+    def test_error_after_persistence_is_not_retried(self):
+        enqueue_chat_job(self.bot, 'a', "привет")
+        job = self.run_claimed(RuntimeError("сессия не сохранилась"))
+        self.assertEqual((job.status, job.attempts, job.error), ('failed', 1, "сессия не сохранилась"))
+        self.assertIsNone(claim_job())
+
+    def test_stale_worker_cannot_overwrite_reclaimed_job(self):
+        enqueue_chat_job(self.bot, 'a', "привет")
+        stale = claim_job()
+        self.assertTrue(extend_lease(stale))
+        ChatJob.objects.filter(pk=stale.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        owner = claim_job()
+        self.assertEqual(owner.attempts, 2)
+
+        self.assertFalse(extend_lease(stale))
+        with mock.patch.object(job_queue, 'run_chat_turn', return_value={'response': "поздно"}):
+            run_job(stale)
+        owner.refresh_from_db()
+        self.assertEqual((owner.status, owner.result), ('running', None))
+
+        with mock.patch.object(job_queue, 'run_chat_turn', return_value={'response': "Привет!!"}):
+            run_job(owner)
+        owner.refresh_from_db()
+        self.assertEqual((owner.status, owner.result), ('done', {'response': "Привет!!"}))
+
+    def test_max_concurrent_jobs_must_be_positive_int(self):
+        for value in (0, -1, 1.5, True, "2"):
+            with self.assertRaises(ValidationError):
+                BotSerializer().validate_bot_config({'max_concurrent_jobs': value})
+        self.assertEqual(BotSerializer().validate_bot_config({'max_concurrent_jobs': 2}), {'max_concurrent_jobs': 2})
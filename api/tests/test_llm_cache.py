@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.apps import apps
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from api.chatbot_service import DeepSeekBot, LLMStreamInterrupted
+from api.llm_cache import ResponseCache, make_cache_key
+
+
+def delta_chunk(text):
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+async def broken_stream():
+    yield delta_chunk("Начало ")
+    raise ConnectionError("обрыв")
+
+
+class StubDeepSeekBot(DeepSeekBot):
+    def __init__(self, stream_factory):
+        super().__init__()
+        self.create = mock.AsyncMock(side_effect=lambda **kwargs: stream_factory())
+
+    @property
+    def async_client(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=self.create)))
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'llm': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'llm-tests'},
+})
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        caches['llm'].clear()
+        self.cache = ResponseCache(maxsize=8, default_ttl=3600, shared_alias='llm')
+        self.prompt = "Расскажи о доставке"
+
+    async def test_interrupted_stream_is_not_cached(self):
+        bot = StubDeepSeekBot(broken_stream)
+        received = []
+        with self.assertRaises(LLMStreamInterrupted):
+            async for chunk in self.cache.astream(bot, self.prompt, 60):
+                received.append(chunk)
+        self.assertEqual(received, ["Начало "])
+
+        key = make_cache_key(bot.cache_signature(), self.prompt)
+        self.assertIsNone(self.cache.local.get(key))
+        self.assertIsNone(await caches['llm'].aget(key))
+
+    async def test_completed_stream_is_cached(self):
+        async def full_stream():
+            yield delta_chunk("Доставка ")
+            yield delta_chunk("бесплатная")
+
+        bot = StubDeepSeekBot(full_stream)
+        self.assertEqual(await collect(self.cache.astream(bot, self.prompt, 60)), ["Доставка ", "бесплатная"])
+        self.assertEqual(await collect(self.cache.astream(bot, self.prompt, 60)), ["Доставка бесплатная"])
+        self.assertEqual(bot.create.await_count, 1)
+
+    def test_shared_hit_keeps_caller_ttl_locally(self):
+        caches['llm'].set('llm:key', "ответ", 60)
+        with mock.patch('api.llm_cache.time.monotonic', return_value=1000.0):
+            self.assertEqual(self.cache.get('llm:key', 60), "ответ")
+        with mock.patch('api.llm_cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(self.cache.local.get('llm:key'))
+
+
+class SharedCacheStartupTests(SimpleTestCase):
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'llm': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/1'},
+    })
+    def test_redis_cache_without_client_fails_at_startup(self):
+        with mock.patch('importlib.util.find_spec', return_value=None):
+            with self.assertRaisesMessage(ImproperlyConfigured, "CACHES['llm']"):
+                apps.get_app_config('api').ready()
@@ -0,0 +1,77 @@
+import importlib
+import json
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from api import simulation
+from api.llm_cache import response_cache
+from api.models import Bot, Scenario
+from api.scenario_analyzer import build_scenario_index
+
+SCENARIO = {
+    'initial_state': 'welcome',
+    'states': {
+        'welcome': {'prompt': "Привет", 'transitions': {'цены': 'prices'}, 'default_next_state': 'welcome'},
+        'prices': {'response': "Дорого", 'default_next_state': 'end'},
+        'orphan': {'response': "Никто не придёт", 'default_next_state': 'orphan'},
+    },
+}
+
+
+class MigrationIndexTests(SimpleTestCase):
+    def test_frozen_builder_matches_analyzer(self):
+        migration = importlib.import_module('api.migrations.0010_scenario_index')
+        self.assertEqual(migration.build_index(SCENARIO), build_scenario_index(SCENARIO))
+        self.assertEqual(migration.build_index({}), {})
+
+
+class StoredIndexTests(TestCase):
+    def setUp(self):
+        bot = Bot.objects.create(name="Бот", user=User.objects.create_user('owner'))
+        self.scenario = Scenario.objects.create(name="Сценарий", bot=bot, scenario_data=SCENARIO)
+
+    def test_index_is_rebuilt_only_when_data_changes(self):
+        self.assertEqual(self.scenario.scenario_index['unreachable_states'], ['orphan'])
+        with mock.patch('api.models.build_scenario_index') as rebuild:
+            self.scenario.name = "Другое имя"
+            self.scenario.save()
+            Scenario.objects.get(pk=self.scenario.pk).save()
+        rebuild.assert_not_called()
+
+    def test_simulation_reads_stored_index(self):
+        with mock.patch.object(simulation, 'build_scenario_index') as rebuild, \
+                mock.patch.object(simulation, '_init_worker'), \
+                mock.patch.object(simulation, '_run_script') as run_script:
+            run_script.return_value = {'hits': {}, 'latencies': [], 'errors': 0, 'finished': 0, 'mismatches': []}
+            report = simulation.simulate(SCENARIO, [{'messages': ["цены"]}],
+                                         scenario_index=self.scenario.scenario_index)
+        rebuild.assert_not_called()
+        self.assertEqual(report['unreachable'], ['orphan'])
+
+    def test_in_process_simulation_restores_shared_cache(self):
+        with mock.patch.object(response_cache, 'shared_alias', 'llm'):
+            simulation.simulate(SCENARIO, [{'messages': ["цены"]}])
+            self.assertEqual(response_cache.shared_alias, 'llm')
+        self.assertEqual(simulation._worker, {})
+
+    def test_command_simulates_published_version_unless_draft(self):
+        draft = {**SCENARIO, 'states': {**SCENARIO['states'], 'draft_only': {'response': "Черновик"}}}
+        self.scenario.scenario_data = draft
+        self.scenario.save()
+
+        def state_names(*args):
+            with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8') as scripts:
+                scripts.write(json.dumps(["цены"], ensure_ascii=False) + "\n")
+                scripts.flush()
+                out = StringIO()
+                call_command('simulate_scenarios', scripts.name, '--scenario', str(self.scenario.pk),
+                             '--workers', '1', '--json', *args, stdout=out)
+            return set(json.loads(out.getvalue())['state_hits'])
+
+        self.assertEqual(state_names(), set(SCENARIO['states']))
+        self.assertEqual(state_names('--draft'), set(draft['states']))
@@ -0,0 +1,107 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from api.models import Bot, Conversation, Scenario, ScenarioVersion
+from api.scenario_compiler import compiled_scenarios
+
+
+def static_scenario(reply):
+    return {'initial_state': 'start', 'states': {'start': {'response': reply, 'default_next_state': 'start'}}}
+
+
+@override_settings(CHAT_RATE_LIMITS={})
+class ScenarioVersionTests(TestCase):
+    def setUp(self):
+        compiled_scenarios.clear()
+        self.user = User.objects.create_user('owner')
+        self.bot = Bot.objects.create(name="Бот", user=self.user, bot_config={'backend': 'pseudo'})
+        self.scenario = Scenario.objects.create(
+            name="Сценарий", bot=self.bot, is_active=True, scenario_data=static_scenario("v1"),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def chat(self, end_user):
+        response = self.client.post(
+            f'/api/bots/{self.bot.pk}/chat/', {'message': "привет", 'end_user': end_user}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['response']
+
+    def edit_draft(self, reply):
+        response = self.client.patch(
+            f'/api/scenarios/{self.scenario.pk}/', {'scenario_data': static_scenario(reply)}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def publish(self, version_id=None):
+        data = {} if version_id is None else {'version': version_id}
+        response = self.client.post(f'/api/scenarios/{self.scenario.pk}/publish/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['published_version']
+
+    def test_first_version_is_published_on_create(self):
+        self.assertIsNotNone(self.scenario.published_version_id)
+        self.assertEqual(self.chat('a'), "v1")
+
+    def test_draft_edit_is_not_live_until_published(self):
+        first = self.scenario.published_version_id
+        self.edit_draft("v2")
+        self.scenario.refresh_from_db()
+        self.assertEqual(self.scenario.published_version_id, first)
+        self.assertEqual(self.chat('a'), "v1")
+
+        self.publish()
+        self.assertEqual(self.chat('b'), "v2")
+
+    def test_rollback_survives_unrelated_edits(self):
+        first = self.scenario.published_version_id
+        self.edit_draft("v2")
+        self.publish()
+        self.assertEqual(self.publish(first), first)
+
+        self.client.patch(f'/api/scenarios/{self.scenario.pk}/', {'name': "Новое имя"}, format='json')
+        self.client.post(f'/api/scenarios/{self.scenario.pk}/set_default/')
+        self.scenario.refresh_from_db()
+        self.assertEqual(self.scenario.published_version_id, first)
+
+    def test_started_conversation_stays_on_its_version(self):
+        self.chat('a')
+        self.edit_draft("v2")
+        self.publish()
+        self.assertEqual(self.chat('a'), "v1")
+        self.assertEqual(self.chat('b'), "v2")
+        pinned = dict(Conversation.objects.values_list('end_user_id', 'scenario_version__scenario_data'))
+        self.assertEqual(pinned['a'], static_scenario("v1"))
+
+    def test_identical_content_reuses_version(self):
+        first = self.scenario.published_version_id
+        self.edit_draft("v2")
+        self.publish()
+        self.edit_draft("v1")
+        self.assertEqual(self.publish(), first)
+        self.assertEqual(ScenarioVersion.objects.filter(scenario=self.scenario).count(), 2)
+
+    def test_versions_are_immutable(self):
+        version = self.scenario.published_version
+        with self.assertRaises(ValueError):
+            version.save()
+
+    def test_publish_rejects_foreign_version(self):
+        other = Scenario.objects.create(name="Другой", bot=self.bot, scenario_data=static_scenario("x"))
+        response = self.client.post(
+            f'/api/scenarios/{self.scenario.pk}/publish/', {'version': other.published_version_id}, format='json',
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_loading_scenarios_does_not_hash_the_graph(self):
+        with mock.patch('api.models.scenario_content_hash') as content_hash:
+            list(Scenario.objects.all())
+            self.assertEqual(self.client.get('/api/scenarios/').status_code, 200)
+            scenario = Scenario.objects.get(pk=self.scenario.pk)
+            scenario.name = "Переименован"
+            scenario.save(update_fields=['name'])
+        content_hash.assert_not_called()
@@ -0,0 +1,57 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from api import chat_service
+from api.chat_service import run_chat_turn
+from api.models import Bot, Conversation, Scenario, Step
+from api.session_store import DatabaseSessionStore, SessionConflict
+
+
+@override_settings(CHAT_STEP_WRITE_BEHIND=False, CHAT_SESSION_SAVE_ATTEMPTS=3)
+class SessionConflictTests(TestCase):
+    def setUp(self):
+        self.bot = Bot.objects.create(name="Бот", user=User.objects.create_user('owner'), bot_config={'backend': 'pseudo'})
+        self.scenario = Scenario.objects.create(name="Сценарий", bot=self.bot, is_active=True)
+        self.store = DatabaseSessionStore()
+
+    def test_stale_save_is_rejected(self):
+        first = self.store.load(self.bot, self.scenario, 'a')
+        second = self.store.load(self.bot, self.scenario, 'a')
+        first.record_turn("раз", "ответ", '')
+        self.store.save(first)
+        second.record_turn("два", "ответ", '')
+        with self.assertRaises(SessionConflict):
+            self.store.save(second)
+        with self.assertRaises(SessionConflict):
+            self.store.save_many([second])
+
+        conversation = Conversation.objects.get(pk=first.pk)
+        self.assertEqual((conversation.turn_count, conversation.version), (1, 1))
+
+    def test_interleaved_turns_keep_both_messages(self):
+        process_message = chat_service.process_message
+        calls = []
+
+        def interleave(bot, scenario, conversation, user_message, context):
+            calls.append(user_message)
+            if len(calls) == 1:
+                # Второй ход успевает целиком пройти, пока первый ждёт ответа LLM
+                run_chat_turn(self.bot, 'a', "второе")
+            return process_message(bot, scenario, conversation, user_message, context)
+
+        with mock.patch.object(chat_service, 'process_message', side_effect=interleave):
+            run_chat_turn(self.bot, 'a', "первое")
+
+        self.assertEqual(calls, ["первое", "второе", "первое"])
+        conversation = Conversation.objects.get(scenario=self.scenario, end_user_id='a')
+        self.assertEqual(conversation.turn_count, 2)
+        self.assertEqual(
+            [item['content'] for item in conversation.context if item['step_type'] == 'user_input'],
+            ["второе", "первое"],
+        )
+        self.assertEqual(
+            list(Step.objects.filter(step_type='user_input').order_by('order').values_list('content', flat=True)),
+            ["второе", "первое"],
+        )
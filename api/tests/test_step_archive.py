@@ -0,0 +1,122 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from api.history_service import get_history_page, iter_transcript
+from api.models import Bot, Conversation, Scenario, Step, StepArchive
+from api.step_archive import archive_conversation, archive_legacy_steps, decode_archive
+from api.step_writer import append_steps
+
+
+class StepArchiveTests(TestCase):
+    def setUp(self):
+        bot = Bot.objects.create(name="Бот", user=User.objects.create_user('owner'))
+        self.scenario = Scenario.objects.create(name="Сценарий", bot=bot)
+        self.conversation = Conversation.objects.create(bot=bot, scenario=self.scenario, end_user_id='a')
+        append_steps(self.scenario.pk, [(f"шаг №{order} ✓", 'user_input') for order in range(1, 251)],
+                     self.conversation.pk)
+        self.original = {
+            step.order: (step.pk, step.content, step.created_at)
+            for step in Step.objects.filter(conversation=self.conversation)
+        }
+
+    def archive(self):
+        archived = archive_conversation(self.conversation.pk, 'gzip')
+        self.conversation.refresh_from_db()
+        self.scenario.refresh_from_db()
+        return archived
+
+    def test_round_trip_keeps_ids_orders_and_content(self):
+        self.assertEqual(self.archive(), 250)
+        self.assertFalse(Step.objects.filter(conversation=self.conversation).exists())
+        self.assertEqual((self.conversation.archived_steps, self.scenario.archived_steps), (250, 250))
+
+        archives = list(StepArchive.objects.filter(conversation=self.conversation).order_by('first_order'))
+        self.assertEqual([(archive.first_order, archive.last_order) for archive in archives], [(1, 200), (201, 250)])
+        restored = {step.order: (step.pk, step.content, step.created_at)
+                    for archive in archives for step in decode_archive(archive)}
+        self.assertEqual(restored, self.original)
+
+    def test_history_pages_merge_archive_and_hot_steps(self):
+        self.archive()
+        append_steps(self.scenario.pk, [("новый", 'bot_response')], self.conversation.pk)
+
+        orders, before = [], None
+        while True:
+            page = get_history_page(self.conversation, before=before, limit=60)
+            orders = [step.order for step in page['steps']] + orders
+            before = page['before']
+            if before is None:
+                break
+        self.assertEqual(orders, list(range(1, 252)))
+
+        page = get_history_page(self.conversation, after=195, limit=10)
+        self.assertEqual([step.order for step in page['steps']], list(range(196, 206)))
+        self.assertEqual(page['after'], 205)
+
+    def test_transcript_exports_archive_first(self):
+        self.archive()
+        append_steps(self.scenario.pk, [("новый", 'bot_response')], self.conversation.pk)
+        rows = [json.loads(line) for line in iter_transcript(self.conversation)]
+        self.assertEqual([row['order'] for row in rows], list(range(1, 252)))
+        self.assertEqual(rows[0]['content'], "шаг №1 ✓")
+        self.assertEqual(rows[-1]['content'], "новый")
+
+    def test_command_archives_only_inactive_conversations(self):
+        fresh = Conversation.objects.create(bot=self.scenario.bot, scenario=self.scenario, end_user_id='b')
+        append_steps(self.scenario.pk, [("свежий", 'user_input')], fresh.pk)
+        Conversation.objects.filter(pk=self.conversation.pk).update(updated_at=timezone.now() - timedelta(days=40))
+
+        out = StringIO()
+        call_command('archive_steps', older_than_days=30, codec='gzip', stdout=out)
+        self.assertIn("250", out.getvalue())
+        self.assertEqual(list(Step.objects.values_list('conversation_id', flat=True)), [fresh.pk])
+
+
+class LegacyStepArchiveTests(TestCase):
+    def setUp(self):
+        bot = Bot.objects.create(name="Бот", user=User.objects.create_user('owner'))
+        self.scenario = Scenario.objects.create(name="Сценарий", bot=bot)
+        self.conversation = Conversation.objects.create(bot=bot, scenario=self.scenario, end_user_id='a')
+        # Шаги без разговора вперемешку по id с горячими шагами разговора
+        for number in range(3):
+            append_steps(self.scenario.pk, [(f"старый {number}", 'user_input')])
+            append_steps(self.scenario.pk, [(f"новый {number}", 'bot_response')], self.conversation.pk)
+        self.ids = list(Step.objects.order_by('id').values_list('id', flat=True))
+
+    def test_legacy_steps_are_archived_by_scenario(self):
+        self.assertEqual(archive_legacy_steps(self.scenario.pk, 'gzip'), 3)
+        self.assertFalse(Step.objects.filter(conversation__isnull=True).exists())
+        archive = StepArchive.objects.get()
+        self.assertIsNone(archive.conversation_id)
+        self.assertEqual([step.content for step in decode_archive(archive)], ["старый 0", "старый 1", "старый 2"])
+        self.scenario.refresh_from_db()
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.scenario.archived_steps, self.conversation.archived_steps), (3, 0))
+
+    def test_scenario_history_and_transcript_merge_by_id(self):
+        archive_legacy_steps(self.scenario.pk, 'gzip')
+        self.scenario.refresh_from_db()
+
+        page = get_history_page(self.scenario, limit=4)
+        self.assertEqual([step.pk for step in page['steps']], self.ids[2:])
+        page = get_history_page(self.scenario, before=page['before'], limit=4)
+        self.assertEqual([step.pk for step in page['steps']], self.ids[:2])
+
+        rows = [json.loads(line) for line in iter_transcript(self.scenario)]
+        self.assertEqual([row['content'] for row in rows],
+                         ["старый 0", "новый 0", "старый 1", "новый 1", "старый 2", "новый 2"])
+        self.assertNotIn('id', rows[0])
+
+    def test_command_archives_old_legacy_steps(self):
+        Step.objects.update(created_at=timezone.now() - timedelta(days=40))
+        out = StringIO()
+        call_command('archive_steps', older_than_days=30, codec='gzip', stdout=out)
+        self.assertFalse(Step.objects.filter(conversation__isnull=True).exists())
+        # Разговор активен, его шаги остаются в горячей таблице
+        self.assertEqual(Step.objects.filter(conversation=self.conversation).count(), 3)
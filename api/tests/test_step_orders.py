@@ -0,0 +1,83 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api import step_writer as step_writer_module
+from api.models import Bot, Conversation, Scenario, Step
+from api.step_writer import WriteBehindStepWriter, append_steps, append_steps_batch
+
+
+class StepOrderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+        self.bot = Bot.objects.create(name="Бот", user=self.user)
+        self.scenario = Scenario.objects.create(name="Сценарий", bot=self.bot)
+        self.first = Conversation.objects.create(bot=self.bot, scenario=self.scenario, end_user_id='a')
+        self.second = Conversation.objects.create(bot=self.bot, scenario=self.scenario, end_user_id='b')
+
+    def orders(self, conversation):
+        return list(Step.objects.filter(conversation=conversation).order_by('id').values_list('order', 'content'))
+
+    def test_each_conversation_has_its_own_counter(self):
+        append_steps(self.scenario.pk, [("раз", 'user_input'), ("два", 'bot_response')], self.first.pk)
+        append_steps_batch({
+            (self.scenario.pk, self.second.pk): [("x", 'user_input')],
+            (self.scenario.pk, self.first.pk): [("три", 'user_input')],
+        })
+        self.assertEqual(self.orders(self.first), [(1, "раз"), (2, "два"), (3, "три")])
+        self.assertEqual(self.orders(self.second), [(1, "x")])
+        self.scenario.refresh_from_db()
+        self.assertEqual(self.scenario.last_step_order, 0)
+
+    def test_failed_batch_falls_back_to_per_conversation_writes(self):
+        writer = WriteBehindStepWriter(flush_interval=0)
+        writer._queue.put(((self.scenario.pk, self.first.pk), [("раз", 'user_input')]))
+        writer._queue.put(((self.scenario.pk, self.second.pk), [("x", 'user_input')]))
+        with mock.patch.object(step_writer_module, 'append_steps_batch', side_effect=RuntimeError("deadlock")):
+            writer.flush()
+        self.assertEqual(self.orders(self.first), [(1, "раз")])
+        self.assertEqual(self.orders(self.second), [(1, "x")])
+
+    def test_failed_conversation_is_retried_before_newer_steps(self):
+        writer = WriteBehindStepWriter(flush_interval=0)
+        writer._queue.put(((self.scenario.pk, self.first.pk), [("раз", 'user_input')]))
+        failures = [RuntimeError("нет соединения")]
+
+        def flaky_append(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return append_steps(*args, **kwargs)
+
+        with mock.patch.object(step_writer_module, 'append_steps_batch', side_effect=RuntimeError("нет соединения")), \
+                mock.patch.object(step_writer_module, 'append_steps', side_effect=flaky_append):
+            self.assertFalse(writer._write(*writer._drain()))
+        writer._queue.put(((self.scenario.pk, self.first.pk), [("два", 'user_input')]))
+        writer.flush()
+        self.assertEqual(self.orders(self.first), [(1, "раз"), (2, "два")])
+
+    def test_gives_up_after_max_attempts(self):
+        writer = WriteBehindStepWriter(flush_interval=0, max_attempts=2)
+        writer._queue.put(((self.scenario.pk, self.first.pk), [("раз", 'user_input')]))
+        with mock.patch.object(step_writer_module, 'append_steps_batch', side_effect=RuntimeError("ошибка")), \
+                mock.patch.object(step_writer_module, 'append_steps', side_effect=RuntimeError("ошибка")):
+            writer.flush()
+        self.assertFalse(writer._has_pending())
+        self.assertEqual(self.orders(self.first), [])
+
+    def test_counter_is_not_writable_through_api(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        append_steps(self.scenario.pk, [("раз", 'user_input')])
+        response = client.patch(
+            f'/api/scenarios/{self.scenario.pk}/',
+            {'last_step_order': 0, 'archived_steps': 7, 'scenario_index': {'states': {}}}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.scenario.refresh_from_db()
+        self.assertEqual(self.scenario.last_step_order, 1)
+        self.assertEqual(self.scenario.archived_steps, 0)
+
+        append_steps(self.scenario.pk, [("два", 'user_input')])
+        self.assertEqual(list(Step.objects.filter(conversation=None).values_list('order', flat=True)), [1, 2])
@@ -0,0 +1,81 @@
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from api.models import Bot, Conversation, Scenario
+from api.search_service import decode_cursor, encode_cursor
+from api.step_archive import archive_conversation
+from api.step_writer import append_steps
+
+
+class SearchCursorTests(SimpleTestCase):
+    def test_cursor_round_trip_keeps_rank_precision(self):
+        rank = 0.0607927106320858
+        self.assertEqual(decode_cursor(encode_cursor([rank, 42])), (rank, 42))
+        self.assertEqual(decode_cursor(encode_cursor([None, 7])), (None, 7))
+
+    def test_malformed_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor("не курсор")
+
+
+class StepSearchApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('owner')
+        self.scenario = Scenario.objects.create(name="Сценарий", bot=Bot.objects.create(name="Бот", user=self.user))
+        append_steps(self.scenario.pk, [(f"вопрос про доставку {number}", 'user_input') for number in range(7)]
+                     + [("ничего общего", 'bot_response')])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get('/api/steps/search/', {'q': "доставку", **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def collect(self, **params):
+        contents, cursor = [], None
+        while True:
+            page = self.search(limit=3, **({'cursor': cursor} if cursor else {}), **params)
+            contents.extend(step['content'] for step in page['results'])
+            cursor = page['next']
+            if cursor is None:
+                return contents
+            if len(contents) == 3:
+                # Новый шаг между страницами не сдвигает уже выданные
+                append_steps(self.scenario.pk, [("новая доставку", 'user_input')])
+
+    def test_recent_pages_are_complete_and_stable(self):
+        contents = self.collect(ordering='recent')
+        self.assertEqual(contents, [f"вопрос про доставку {number}" for number in range(6, -1, -1)])
+
+    @skipUnless(connection.vendor == 'postgresql', "ранжирование ts_rank есть только в Postgres")
+    def test_ranked_pages_do_not_repeat(self):
+        contents = self.collect(ordering='rank')
+        self.assertEqual(len(contents), len(set(contents)))
+        self.assertLessEqual({f"вопрос про доставку {number}" for number in range(7)}, set(contents))
+
+    def test_filters_and_owner_isolation(self):
+        self.assertEqual(self.search(step_type='bot_response')['results'], [])
+        stranger = APIClient()
+        stranger.force_authenticate(User.objects.create_user('stranger'))
+        self.assertEqual(stranger.get('/api/steps/search/', {'q': "доставку"}).json()['results'], [])
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get('/api/steps/search/', {'q': "доставку", 'cursor': "мусор"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_archived_range_marks_results_partial(self):
+        self.assertFalse(self.search()['partial'])
+        conversation = Conversation.objects.create(bot=self.scenario.bot, scenario=self.scenario, end_user_id='a')
+        append_steps(self.scenario.pk, [("старая доставку", 'user_input')], conversation.pk)
+        archive_conversation(conversation.pk, 'gzip')
+
+        page = self.search()
+        self.assertTrue(page['partial'])
+        self.assertNotIn("старая доставку", [step['content'] for step in page['results']])
+        self.assertFalse(self.search(conversation=conversation.pk + 1)['partial'])
+        self.assertFalse(self.search(date_from="2999-01-01T00:00:00Z")['partial'])
@@ -0,0 +1,122 @@
+import asyncio
+import gc
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from telegram.error import InvalidToken, NetworkError
+
+from api import telegram_gateway
+from api.telegram_gateway import ChatDispatcher, get_dispatcher, poll_bot
+
+
+class FakeUpdate:
+    def __init__(self, update_id, chat_id, text):
+        self.update_id = update_id
+        self._data = {'message': {'text': text, 'chat': {'id': chat_id}}}
+
+    def to_dict(self):
+        return self._data
+
+
+class FakeTelegramClient:
+    def __init__(self, batches, stop_event, fail_on_delete=None):
+        self.batches = list(batches)
+        self.stop_event = stop_event
+        self.fail_on_delete = fail_on_delete
+        self.sent = []
+        self.offsets = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def delete_webhook(self):
+        if self.fail_on_delete:
+            raise self.fail_on_delete
+
+    async def get_updates(self, offset=None, **kwargs):
+        self.offsets.append(offset)
+        if not self.batches:
+            self.stop_event.set()
+            return []
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+async def fake_answer(bot, chat_id, text):
+    return f"ответ: {text}"
+
+
+@override_settings(TELEGRAM_POLL_TIMEOUT=0)
+@mock.patch.object(telegram_gateway, 'close_old_connections', lambda: None)
+@mock.patch.object(telegram_gateway, 'answer_message', fake_answer)
+class PollBotTests(SimpleTestCase):
+    async def test_invalid_token_does_not_stop_other_bots(self):
+        stop_event = asyncio.Event()
+        good = FakeTelegramClient([[FakeUpdate(1, 10, "привет")]], stop_event)
+        clients = {
+            'bad': FakeTelegramClient([], stop_event, fail_on_delete=InvalidToken("revoked")),
+            'good': good,
+        }
+        bots = [SimpleNamespace(pk=1, bot_config={'telegram_token': 'bad'}),
+                SimpleNamespace(pk=2, bot_config={'telegram_token': 'good'})]
+        dispatcher = ChatDispatcher(4, 16)
+        with mock.patch.object(telegram_gateway, 'create_telegram_client', lambda token: clients[token]):
+            results = await asyncio.wait_for(
+                asyncio.gather(*(poll_bot(bot, dispatcher, stop_event) for bot in bots), return_exceptions=True),
+                timeout=5,
+            )
+        self.assertEqual(results, [None, None])
+        self.assertEqual(good.sent, [(10, "ответ: привет")])
+
+    async def test_reconnect_keeps_offset(self):
+        stop_event = asyncio.Event()
+        client = FakeTelegramClient(
+            [[FakeUpdate(5, 10, "раз")], NetworkError("обрыв"), [FakeUpdate(6, 10, "два")]], stop_event,
+        )
+        dispatcher = ChatDispatcher(4, 16)
+        with mock.patch.object(telegram_gateway, 'create_telegram_client', lambda token: client), \
+                mock.patch.object(telegram_gateway, '_wait_stop', mock.AsyncMock()):
+            await asyncio.wait_for(poll_bot(SimpleNamespace(pk=1, bot_config={'telegram_token': 't'}),
+                                            dispatcher, stop_event), timeout=5)
+        self.assertEqual(client.offsets, [None, 6, 6, 7])
+        self.assertEqual([text for _, text in client.sent], ["ответ: раз", "ответ: два"])
+
+
+class ChatDispatcherTests(SimpleTestCase):
+    async def test_drain_waits_only_for_its_group(self):
+        dispatcher = ChatDispatcher(4, 16)
+        release = asyncio.Event()
+        done = []
+
+        async def slow():
+            await release.wait()
+
+        async def fast():
+            done.append('fast')
+
+        await dispatcher.submit(('telegram', 1, 10), slow, group=1)
+        await dispatcher.submit(('telegram', 2, 10), fast, group=2)
+        await asyncio.wait_for(dispatcher.drain(2), timeout=1)
+        self.assertEqual(done, ['fast'])
+        release.set()
+        await asyncio.wait_for(dispatcher.drain(), timeout=1)
+
+    def test_each_loop_gets_its_own_dispatcher(self):
+        async def current():
+            return get_dispatcher()
+
+        first = asyncio.run(current())
+        second = asyncio.run(current())
+        self.assertIsNot(first, second)
+        del first, second
+        gc.collect()
+        self.assertEqual(len(telegram_gateway._dispatchers), 0)
@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from api.chatbot_service import ConcurrencyGovernor, LLMOverloadedError
+from api.throttling import LocalBucketStore, get_chat_buckets, make_bucket, parse_rate
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('20/min'), (20, 60))
+        self.assertIsNone(parse_rate(''))
+        with self.assertRaises(ValueError):
+            parse_rate('0/s')
+
+    def test_burst_then_refill(self):
+        store = LocalBucketStore()
+        bucket = [make_bucket('user:1', '3/min')]
+        self.assertEqual([store.consume(bucket, 100.0) for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(store.consume(bucket, 100.0), 20.0)
+        self.assertAlmostEqual(store.consume(bucket, 110.0), 10.0)
+        self.assertEqual(store.consume(bucket, 120.0), 0.0)
+
+    def test_rejected_request_consumes_no_bucket(self):
+        store = LocalBucketStore()
+        bot_bucket = make_bucket('bot:1', '10/min')
+        user_bucket = make_bucket('user:1:a', '1/min')
+        self.assertEqual(store.consume([bot_bucket, user_bucket], 0.0), 0.0)
+        self.assertGreater(store.consume([bot_bucket, user_bucket], 0.0), 0)
+        # Отказ по корзине собеседника не списал токен у бота
+        self.assertEqual(store._tats['bot:1'], 6.0)
+
+    @override_settings(CHAT_RATE_LIMITS={'bot': '10/min', 'owner': '100/min', 'end_user': '5/min'})
+    def test_bot_config_cannot_raise_owner_limit(self):
+        bot = SimpleNamespace(pk=1, user_id=2, bot_config={'rate_limit': {'owner': '100000/min', 'end_user': '1/s'}})
+        intervals = {key: interval for key, interval, _ in get_chat_buckets(bot, 'a')}
+        self.assertEqual(intervals, {'bot:1': 6.0, 'owner:2': 0.6, 'user:1:a': 1.0})
+
+    @override_settings(RATE_LIMIT_REDIS_URL='redis://localhost:6379/0')
+    def test_redis_store_without_client_fails_at_startup(self):
+        with mock.patch('importlib.util.find_spec', return_value=None):
+            with self.assertRaisesMessage(ImproperlyConfigured, "RATE_LIMIT_REDIS_URL"):
+                apps.get_app_config('api').ready()
+
+
+class ConcurrencyGovernorTests(SimpleTestCase):
+    async def test_async_waiters_queue_without_polling(self):
+        governor = ConcurrencyGovernor('test', 1, timeout=1)
+        order = []
+
+        async def call(name):
+            async with governor.aacquire():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(call('a'), call('b'), call('c'))
+        self.assertEqual(order, ['a', 'b', 'c'])
+
+    async def test_async_timeout_raises_overloaded(self):
+        governor = ConcurrencyGovernor('test', 1, timeout=0.01)
+        async with governor.aacquire():
+            with self.assertRaises(LLMOverloadedError):
+                async with governor.aacquire():
+                    pass
+        async with governor.aacquire():
+            pass
+
+    def test_sync_timeout_raises_overloaded(self):
+        governor = ConcurrencyGovernor('test', 1, timeout=0.01)
+        with governor.acquire():
+            with self.assertRaises(LLMOverloadedError):
+                with governor.acquire():
+                    pass
+
+    def test_sync_and_async_share_one_limit(self):
+        governor = ConcurrencyGovernor('test', 2, timeout=5)
+        peak = []
+        lock = threading.Lock()
+
+        def observe():
+            with lock:
+                peak.append(governor.active)
+
+        def sync_call():
+            with governor.acquire():
+                observe()
+                time.sleep(0.01)
+
+        async def async_call():
+            async with governor.aacquire():
+                observe()
+                await asyncio.sleep(0.01)
+
+        async def async_load():
+            await asyncio.gather(*(async_call() for _ in range(10)))
+
+        threads = [threading.Thread(target=sync_call) for _ in range(10)]
+        threads += [threading.Thread(target=asyncio.run, args=(async_load(),)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(peak), 30)
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(governor.active, 0)
+
+    async def test_async_waiter_gets_slot_released_by_thread(self):
+        governor = ConcurrencyGovernor('test', 1, timeout=2)
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with governor.acquire():
+                held.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        async with governor.aacquire():
+            self.assertEqual(governor.active, 1)
+        thread.join()
@@ -0,0 +1,68 @@
+from django.test import SimpleTestCase
+
+from api.scenario_analyzer import analyze_scenario
+from api.scenario_compiler import CompiledState, KeywordMatcher
+
+
+def state(transitions, **config):
+    return CompiledState(0, 'state', {'transitions': transitions, 'default_next_state': 'default', **config})
+
+
+class KeywordMatcherTests(SimpleTestCase):
+    def test_earliest_declared_keyword_wins(self):
+        matcher = KeywordMatcher(['hers', 'she', 'he'])
+        # she и he заканчиваются раньше, но hers объявлено первым
+        self.assertEqual(matcher.first_match('ushers'), 0)
+        self.assertEqual(matcher.first_match('ahe'), 2)
+        self.assertEqual(matcher.first_match('xyz'), -1)
+
+    def test_match_through_failure_links(self):
+        matcher = KeywordMatcher(['abcd', 'bc'])
+        self.assertEqual(matcher.first_match('abce'), 1)
+
+    def test_empty_keyword_always_matches(self):
+        self.assertEqual(KeywordMatcher(['цена', '']).first_match('привет'), 1)
+
+
+class TransitionRuleTests(SimpleTestCase):
+    def test_legacy_dict_is_substring_match(self):
+        compiled = state({'цен': 'prices', 'ещё': 'more'})
+        self.assertEqual(compiled.next_state("Что с ЦЕНАМИ?"), 'prices')
+        self.assertEqual(compiled.next_state("еще вопрос"), 'more')
+        self.assertEqual(compiled.next_state("привет"), 'default')
+
+    def test_word_rule_needs_whole_word(self):
+        compiled = state([{'match': 'word', 'keywords': ['кот', 'добрый день'], 'next': 'cat'}])
+        self.assertEqual(compiled.next_state("который час"), 'default')
+        self.assertEqual(compiled.next_state("мой кот"), 'cat')
+        self.assertEqual(compiled.next_state("Добрый день!"), 'cat')
+
+    def test_stem_rule_matches_word_forms(self):
+        compiled = state([{'match': 'stem', 'keywords': ['доставка'], 'next': 'delivery'}])
+        self.assertEqual(compiled.next_state("нужна доставку"), 'delivery')
+        self.assertEqual(compiled.next_state("сроки доставки"), 'delivery')
+
+    def test_priority_then_declaration_order(self):
+        compiled = state([
+            {'match': 'word', 'keywords': ['кот'], 'next': 'cat'},
+            {'match': 'regex', 'pattern': r'\b\d{6}\b', 'next': 'zip', 'priority': 5},
+            {'match': 'word', 'keywords': ['индекс'], 'next': 'index'},
+        ])
+        self.assertEqual(compiled.next_state("индекс 123456 и кот"), 'zip')
+        self.assertEqual(compiled.next_state("индекс и кот"), 'cat')
+
+    def test_invalid_regex_is_skipped_and_reported(self):
+        rules = [{'match': 'regex', 'pattern': '(', 'next': 'broken'}, {'match': 'word', 'keywords': ['да'], 'next': 'yes'}]
+        self.assertEqual(state(rules).next_state("да"), 'yes')
+        analysis = analyze_scenario({'initial_state': 'a', 'states': {'a': {'transitions': rules}, 'broken': {},
+                                                                       'yes': {}}})
+        self.assertFalse(analysis.is_valid)
+
+    def test_analyzer_warns_about_shadowed_keyword(self):
+        analysis = analyze_scenario({'initial_state': 'a', 'states': {'a': {'transitions': [
+            {'match': 'substring', 'keywords': ['цен'], 'next': 'end'},
+            {'match': 'word', 'keywords': ['цена'], 'next': 'end'},
+        ]}}})
+        self.assertTrue(analysis.is_valid)
+        self.assertIn("Состояние a: ключевое слово 'цена' никогда не сработает, его перекрывает 'цен'",
+                      analysis.warnings)
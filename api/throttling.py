@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RATE_PERIODS = {
+    's': 1, 'sec': 1, 'second': 1,
+    'm': 60, 'min': 60, 'minute': 60,
+    'h': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400,
+}
+
+# (ключ, интервал между токенами, допустимый всплеск) — параметры GCRA-варианта token bucket
+Bucket = Tuple[str, float, float]
+
+
+def parse_rate(rate: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Разбирает лимит вида '20/min' в (число запросов, период в секундах)."""
+    if not rate:
+        return None
+    count, period = str(rate).split('/')
+    if int(count) <= 0:
+        raise ValueError(f"Неверный лимит: {rate}")
+    return int(count), RATE_PERIODS[period.strip().lower()]
+
+
+def make_bucket(key: str, rate: Optional[str]) -> Optional[Bucket]:
+    parsed = parse_rate(rate)
+    if parsed is None:
+        return None
+    count, period = parsed
+    interval = period / count
+    return key, interval, interval * count
+
+
+class LocalBucketStore:
+    """Корзины в памяти процесса; лимиты действуют отдельно в каждом воркере."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._tats: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def consume(self, buckets: List[Bucket], now: float) -> float:
+        with self._lock:
+            wait = 0.0
+            new_tats = []
+            for key, interval, burst in buckets:
+                tat = max(self._tats.get(key, now), now) + interval
+                wait = max(wait, tat - burst - now)
+                new_tats.append((key, tat))
+            if wait > 0:
+                return wait
+            if len(self._tats) > self.max_keys:
+                self._tats = {key: tat for key, tat in self._tats.items() if tat > now}
+            self._tats.update(new_tats)
+            return 0.0
+
+
+# Все корзины проверяются и списываются одним атомарным скриптом: либо все, либо ни одна
+_CONSUME_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tats = {}
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local tat = math.max(tonumber(redis.call('GET', key) or now), now) + interval
+    wait = math.max(wait, tat - burst - now)
+    tats[i] = tat
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, tostring(tats[i]), 'PX', math.ceil((tats[i] - now) * 1000) + 1)
+end
+return '0'
+"""
+
+
+class RedisBucketStore:
+    """Корзины в Redis, общие для всех воркеров gunicorn."""
+
+    def __init__(self, url: str, prefix: str = 'rl:'):
+        import redis
+
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_CONSUME_SCRIPT)
+
+    def consume(self, buckets: List[Bucket], now: float) -> float:
+        keys = [self.prefix + key for key, _, _ in buckets]
+        args = [now]
+        for _, interval, burst in buckets:
+            args.extend([interval, burst])
+        return float(self._script(keys=keys, args=args))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.RATE_LIMIT_REDIS_URL:
+                    _store = RedisBucketStore(settings.RATE_LIMIT_REDIS_URL)
+                else:
+                    _store = LocalBucketStore()
+    return _store
+
+
+def get_chat_buckets(bot, end_user_id: str) -> List[Bucket]:
+    # Лимит владельца задаётся только настройками: иначе его можно поднять через собственный bot_config
+    limits = {**settings.CHAT_RATE_LIMITS, **(bot.bot_config or {}).get('rate_limit', {})}
+    buckets = [
+        make_bucket(f"bot:{bot.pk}", limits.get('bot')),
+        make_bucket(f"owner:{bot.user_id}", settings.CHAT_RATE_LIMITS.get('owner')),
+        make_bucket(f"user:{bot.pk}:{end_user_id}", limits.get('end_user')),
+    ]
+    return [bucket for bucket in buckets if bucket is not None]
+
+
+def check_chat_rate(bot, end_user_id: str) -> Optional[float]:
+    """Списывает токен из корзин бота, владельца и собеседника.
+
+    Возвращает None, если запрос разрешён, иначе — сколько секунд подождать.
+    """
+    buckets = get_chat_buckets(bot, end_user_id)
+    if not buckets:
+        return None
+    try:
+        wait = get_bucket_store().consume(buckets, time.time())
+    except Exception as e:
+        # Недоступность хранилища лимитов не должна останавливать чат
+        logger.warning("Ошибка проверки лимита запросов: %s", e)
+        return None
+    return wait if wait > 0 else None
@@ -1,12 +1,18 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BotViewSet, ScenarioViewSet, StepViewSet
+from .views import BotViewSet, ScenarioViewSet, StepViewSet, ConversationViewSet, ChatJobViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'bots', BotViewSet, basename='bot')
 router.register(r'scenarios', ScenarioViewSet, basename='scenario')
 router.register(r'steps', StepViewSet, basename='step')
+router.register(r'conversations', ConversationViewSet, basename='conversation')
+router.register(r'jobs', ChatJobViewSet, basename='job')
 
 urlpatterns = [
+    path('bots/<int:pk>/achat/', async_views.bot_chat, name='bot-achat'),
+    path('jobs/<int:pk>/wait/', async_views.job_result, name='job-wait'),
+    path('telegram/<int:bot_id>/webhook/', async_views.telegram_webhook, name='telegram-webhook'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
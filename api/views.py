@@ -1,95 +1,107 @@
-from rest_framework import viewsets, status
+import hmac
+
+from rest_framework import exceptions, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .serializers import BotSerializer, ScenarioSerializer, StepSerializer, ChatSerializer
-from .models import Bot, Scenario, Step
+from .serializers import (
+    BotSerializer, BotListSerializer, ScenarioSerializer, ScenarioListSerializer, StepSerializer, ChatSerializer,
+    StepHistoryQuerySerializer, ChatJobSerializer, ConversationSerializer, ChatBatchSerializer,
+    ScenarioVersionSerializer, ScenarioPublishSerializer, StepSearchQuerySerializer, StepSearchResultSerializer,
+)
+from .models import Bot, Scenario, ScenarioVersion, Step, StepArchive, Conversation, ChatJob
+
+from django.conf import settings
+from django.db.models import Count, Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
 
-from .chatbot_service import chat_bot
-from .scenario_service import ScenarioEngine, ScenarioManager
+from .authentication import CHAT_AUTHENTICATION_CLASSES, bot_scope, issue_bot_token
+from .batch_chat import run_chat_batch
+from .chat_requests import chat_turn_errors, enforce_chat_rate, validate_chat_request
+from .chat_service import run_chat_turn, astream_chat_turn, event_stream_response
+from .history_service import get_history_page, iter_transcript
+from .job_queue import enqueue_chat_job, serialize_job
+from .metrics import collect, render
+from .pagination import StepCursorPagination
+from .scenario_analyzer import analyze_scenario
+from .scenario_service import ScenarioManager
+from .search_service import search_steps
 
-from django.db import transaction
-from django.db.models import Max
+RECENT_STEPS_LIMIT = 20
 
 class BotViewSet(viewsets.ModelViewSet):
     serializer_class = BotSerializer
+    bot_token_actions = ('chat', 'chat_batch')
 
     def get_queryset(self):
-        return Bot.objects.filter(user=self.request.user)
+        queryset = Bot.objects.filter(user=self.request.user).order_by('id')
+        if self.action == 'list':
+            return queryset.annotate(scenarios_count=Count('scenarios'))
+        if self.action == 'retrieve':
+            return queryset.prefetch_related(Prefetch(
+                'scenarios',
+                queryset=Scenario.objects.annotate(steps_count=Count('steps')).order_by('id'),
+            ))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return BotListSerializer
+        return super().get_serializer_class()
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-    @action(detail=True, methods=['post'], serializer_class=ChatSerializer)
+    @action(detail=True, methods=['post'])
+    def token(self, request, pk=None):
+        bot = self.get_object()
+        return Response(issue_bot_token(bot), status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], serializer_class=ChatSerializer,
+            authentication_classes=CHAT_AUTHENTICATION_CLASSES)
     def chat(self, request, pk=None):
+        chat = validate_chat_request(request.user, request.auth, pk, request.data)
         bot = self.get_object()
+        end_user_id = chat['end_user']
+        enforce_chat_rate(bot, end_user_id)
 
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True) 
-        user_message = serializer.validated_data['message']
+        if chat['stream']:
+            return event_stream_response(astream_chat_turn(bot, end_user_id, chat['message']))
+        if chat['enqueue']:
+            job = enqueue_chat_job(bot, end_user_id, chat['message'])
+            return Response(serialize_job(job), status=status.HTTP_202_ACCEPTED)
 
-        if not user_message:
-            return Response({'error': 'Сообщение пустое'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        active_scenario = self._get_or_create_active_scenario(bot)
-        conversation_context = self._get_conversation_context(active_scenario)
-        bot_response_data = self._process_message(
-            bot, active_scenario, user_message, conversation_context
-        )
-        self._save_conversation_steps(active_scenario, user_message, bot_response_data['response'])
+        with chat_turn_errors():
+            bot_response_data = run_chat_turn(bot, end_user_id, chat['message'])
         return Response(bot_response_data, status=status.HTTP_200_OK)
 
-    def _get_or_create_active_scenario(self, bot):
-        active_scenario = bot.scenarios.filter(is_active=True).first()
-        if not active_scenario:
-            active_scenario = Scenario.objects.create(
-                name=f"Активный сценарий для {bot.name}",
-                bot=bot,
-                is_active=True,
-                scenario_data=ScenarioManager.get_default_scenario()
-            )
-        return active_scenario
-
-    def _get_conversation_context(self, scenario, limit=3):
-        steps = scenario.steps.order_by('-order')[:limit*2]
-        context_lines = []
-        for step in reversed(steps):
-            role = "Пользователь" if step.step_type == 'user_input' else "Бот"
-            context_lines.append(f"{role}: {step.content}")
-        return "\n".join(context_lines)
-
-    def _process_message(self, bot, scenario, user_message, context):
-        if scenario.scenario_data:
-            scenario_engine = ScenarioEngine(scenario.scenario_data)
-            return scenario_engine.process_user_input(user_message, context)
-        else:
-            bot_response = chat_bot.generate_response(user_message)
-            return {
-                'response': bot_response,
-                'current_state': None,
-                'is_finished': False
-            }
-
-    @transaction.atomic
-    def _save_conversation_steps(self, scenario, user_message, bot_response):
-        max_order = scenario.steps.aggregate(Max('order'))['order__max'] or 0
-        
-        Step.objects.create(
-            order=max_order + 1,
-            content=user_message,
-            scenario=scenario,
-            step_type='user_input',
-        )
-        Step.objects.create(
-            order=max_order + 2,
-            content=bot_response,
-            scenario=scenario,
-            step_type='bot_response',
-        )
+    @action(detail=False, methods=['post'], url_path='chat/batch', serializer_class=ChatBatchSerializer,
+            authentication_classes=CHAT_AUTHENTICATION_CLASSES)
+    def chat_batch(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = run_chat_batch(request.user, serializer.validated_data['items'], bot_scope(request.auth))
+        return Response({'results': results}, status=status.HTTP_200_OK)
 
 class ScenarioViewSet(viewsets.ModelViewSet):
     serializer_class = ScenarioSerializer
 
     def get_queryset(self):
-        return Scenario.objects.filter(bot__user=self.request.user)
+        queryset = Scenario.objects.filter(bot__user=self.request.user).order_by('id')
+        if self.action == 'list':
+            # Граф сценария — самая тяжёлая колонка, а списку он не нужен
+            return queryset.defer('scenario_data', 'scenario_index').annotate(steps_count=Count('steps'))
+        if self.action == 'retrieve':
+            return queryset.annotate(steps_count=Count('steps')).prefetch_related(Prefetch(
+                'steps',
+                queryset=Step.objects.defer('search_vector').order_by('-id')[:RECENT_STEPS_LIMIT],
+                to_attr='recent_steps',
+            ))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ScenarioListSerializer
+        return super().get_serializer_class()
     
     def perform_create(self, serializer):
         scenario = serializer.save()
@@ -100,21 +112,61 @@ class ScenarioViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def steps(self, request, pk=None):
         scenario = self.get_object()
-        steps = scenario.step_set.all()
-        serializer = StepSerializer(steps, many=True)
-        return Response(serializer.data)
+        query = StepHistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        page = get_history_page(scenario, **query.validated_data)
+        return Response({
+            'results': StepSerializer(page['steps'], many=True).data,
+            'before': page['before'],
+            'after': page['after'],
+        })
+
+    @action(detail=True, methods=['get'], url_path='steps/export')
+    def export_steps(self, request, pk=None):
+        scenario = self.get_object()
+        response = StreamingHttpResponse(iter_transcript(scenario), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="scenario-{scenario.id}-steps.jsonl"'
+        return response
     
     @action(detail=True, methods=['post'])
     def validate(self, request, pk=None):
         scenario = self.get_object()
-        is_valid = ScenarioManager.validate_scenario_format(scenario.scenario_data)
+        analysis = analyze_scenario(scenario.scenario_data)
         
         return Response({
-            'is_valid': is_valid,
+            'is_valid': analysis.is_valid,
             'scenario_id': scenario.id,
-            'scenario_name': scenario.name
+            'scenario_name': scenario.name,
+            'errors': analysis.errors,
+            'warnings': analysis.warnings,
         })
     
+    @action(detail=True, methods=['get'])
+    def versions(self, request, pk=None):
+        scenario = self.get_object()
+        versions = scenario.versions.order_by('-id')
+        return Response({
+            'published_version': scenario.published_version_id,
+            'results': ScenarioVersionSerializer(versions, many=True).data,
+        })
+
+    @action(detail=True, methods=['post'], serializer_class=ScenarioPublishSerializer)
+    def publish(self, request, pk=None):
+        scenario = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        version = None
+        version_id = serializer.validated_data.get('version')
+        if version_id is not None:
+            version = ScenarioVersion.objects.filter(scenario=scenario, pk=version_id).first()
+            if version is None:
+                return Response({'error': 'Версия не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        version = scenario.publish(version)
+        return Response({
+            'scenario_id': scenario.id,
+            'published_version': version.pk if version else None,
+        })
+
     @action(detail=True, methods=['post'])
     def set_default(self, request, pk=None):
         scenario = self.get_object()
@@ -128,6 +180,77 @@ class ScenarioViewSet(viewsets.ModelViewSet):
 
 class StepViewSet(viewsets.ModelViewSet):
     serializer_class = StepSerializer
+    pagination_class = StepCursorPagination
     
     def get_queryset(self):
-        return Step.objects.filter(scenario__bot__user=self.request.user)
\ No newline at end of file
+        queryset = Step.objects.filter(scenario__bot__user=self.request.user).defer('search_vector')
+        scenario_id = self.request.query_params.get('scenario')
+        if scenario_id and scenario_id.isdigit():
+            queryset = queryset.filter(scenario_id=scenario_id)
+        conversation_id = self.request.query_params.get('conversation')
+        if conversation_id and conversation_id.isdigit():
+            queryset = queryset.filter(conversation_id=conversation_id)
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = StepSearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = dict(query.validated_data)
+        text = params.pop('q')
+        queryset = Step.objects.filter(scenario__bot__user=request.user)
+        archives = StepArchive.objects.filter(scenario__bot__user=request.user)
+        try:
+            page = search_steps(queryset, text, archives=archives, **params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'results': StepSearchResultSerializer(page['steps'], many=True).data,
+            'next': page['next'],
+            'partial': page['partial'],
+        })
+
+class ConversationViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ConversationSerializer
+
+    def get_queryset(self):
+        queryset = Conversation.objects.filter(bot__user=self.request.user).order_by('-updated_at', '-id')
+        bot_id = self.request.query_params.get('bot')
+        if bot_id and bot_id.isdigit():
+            queryset = queryset.filter(bot_id=bot_id)
+        end_user_id = self.request.query_params.get('end_user')
+        if end_user_id:
+            queryset = queryset.filter(end_user_id=end_user_id)
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def steps(self, request, pk=None):
+        conversation = self.get_object()
+        query = StepHistoryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        page = get_history_page(conversation, **query.validated_data)
+        return Response({
+            'results': StepSerializer(page['steps'], many=True).data,
+            'before': page['before'],
+            'after': page['after'],
+        })
+
+    @action(detail=True, methods=['get'], url_path='steps/export')
+    def export_steps(self, request, pk=None):
+        conversation = self.get_object()
+        response = StreamingHttpResponse(iter_transcript(conversation), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="conversation-{conversation.id}-steps.jsonl"'
+        return response
+
+class ChatJobViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ChatJobSerializer
+
+    def get_queryset(self):
+        return ChatJob.objects.filter(bot__user=self.request.user).order_by('-id')
+
+
+def metrics(request):
+    token = settings.METRICS_AUTH_TOKEN
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse("".join(render(collect())), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -46,11 +46,14 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
+    'rest_framework.authtoken',
     'api',
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,12 +66,15 @@ MIDDLEWARE = [
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
+        'api.authentication.BotScopePermission',
     ],
+    # Чат использует api.authentication.CHAT_AUTHENTICATION_CLASSES: без Basic и с токенами ботов
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.StandardPagination',
 }
 
 ROOT_URLCONF = 'bot_constructor.urls'
@@ -106,6 +112,15 @@ DATABASES = {
     }
 }
 
+# DB_ENGINE=sqlite — локальный запуск и бенчмарки без PostgreSQL
+if os.getenv('DB_ENGINE') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -159,3 +174,126 @@ if env_path.exists():
     load_dotenv()
 else:
     print("Файл .env не найден.")
+
+# Размер LRU кэша скомпилированных сценариев в каждом процессе
+SCENARIO_CACHE_SIZE = int(os.getenv('SCENARIO_CACHE_SIZE', '256'))
+
+# Хранилище состояния диалогов и длина скользящего контекста (в парах реплик)
+CHAT_SESSION_STORE = os.getenv('CHAT_SESSION_STORE', 'api.session_store.DatabaseSessionStore')
+# Сколько раз ход выполняется заново, если разговор успел сохранить параллельный запрос
+CHAT_SESSION_SAVE_ATTEMPTS = int(os.getenv('CHAT_SESSION_SAVE_ATTEMPTS', '3'))
+CHAT_CONTEXT_TURNS = int(os.getenv('CHAT_CONTEXT_TURNS', '3'))
+
+# Бюджеты токенов контекста по умолчанию (переопределяются в bot_config)
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv('CHAT_CONTEXT_TOKEN_BUDGET', '800'))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.getenv('CHAT_SUMMARY_TOKEN_BUDGET', '200'))
+CHAT_SUMMARY_LINE_TOKENS = int(os.getenv('CHAT_SUMMARY_LINE_TOKENS', '40'))
+
+# Кэш ответов LLM: LRU в процессе и общий уровень в Redis или таблице БД
+LLM_CACHE_SIZE = int(os.getenv('LLM_CACHE_SIZE', '1024'))
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', '3600'))
+LLM_CACHE_ALIAS = 'llm'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'llm': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('LLM_CACHE_REDIS_URL'),
+    } if os.getenv('LLM_CACHE_REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'llm_response_cache',
+    },
+}
+
+# Бэкенд LLM по умолчанию (переопределяется через bot_config['backend']) и пул HTTP-соединений к нему
+CHAT_BACKEND = os.getenv('CHAT_BACKEND', 'deepseek')
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv('LLM_HTTP_MAX_CONNECTIONS', '200'))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv('LLM_HTTP_MAX_KEEPALIVE', '50'))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('LLM_HTTP_KEEPALIVE_EXPIRY', '30'))
+LLM_HTTP_TIMEOUT = float(os.getenv('LLM_HTTP_TIMEOUT', '60'))
+LLM_HTTP_CONNECT_TIMEOUT = float(os.getenv('LLM_HTTP_CONNECT_TIMEOUT', '5'))
+
+# Отложенная (write-behind) запись шагов диалога фоновым потоком пачками
+CHAT_STEP_WRITE_BEHIND = os.getenv('CHAT_STEP_WRITE_BEHIND', 'false').lower() == 'true'
+CHAT_STEP_WRITE_BEHIND_BATCH = int(os.getenv('CHAT_STEP_WRITE_BEHIND_BATCH', '500'))
+CHAT_STEP_WRITE_BEHIND_INTERVAL = float(os.getenv('CHAT_STEP_WRITE_BEHIND_INTERVAL', '0.5'))
+
+# Архив шагов: разговоры без активности дольше STEP_ARCHIVE_AFTER_DAYS сжимаются командой archive_steps
+STEP_ARCHIVE_AFTER_DAYS = int(os.getenv('STEP_ARCHIVE_AFTER_DAYS', '30'))
+STEP_ARCHIVE_CODEC = os.getenv('STEP_ARCHIVE_CODEC', 'gzip')
+
+# Аутентификация API: кэш токенов и пользователей в процессе и срок жизни подписанных токенов ботов
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '60'))
+BOT_TOKEN_MAX_AGE = int(os.getenv('BOT_TOKEN_MAX_AGE', '3600'))
+
+# Пакетный чат: максимум сообщений в запросе и число разговоров, обрабатываемых параллельно
+CHAT_BATCH_MAX_ITEMS = int(os.getenv('CHAT_BATCH_MAX_ITEMS', '100'))
+CHAT_BATCH_CONCURRENCY = int(os.getenv('CHAT_BATCH_CONCURRENCY', '16'))
+
+# Шлюз Telegram: адрес Bot API (можно указать локальный фейковый сервер) и лимиты обработки
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org')
+TELEGRAM_MAX_WORKERS = int(os.getenv('TELEGRAM_MAX_WORKERS', '64'))
+TELEGRAM_MAX_PENDING = int(os.getenv('TELEGRAM_MAX_PENDING', '1000'))
+TELEGRAM_POLL_TIMEOUT = int(os.getenv('TELEGRAM_POLL_TIMEOUT', '30'))
+TELEGRAM_CONNECTION_POOL = int(os.getenv('TELEGRAM_CONNECTION_POOL', '64'))
+
+# Очередь задач чата: воркеры, повторы с экспоненциальной задержкой и лимит параллельных задач на бота
+CHAT_JOB_WORKERS = int(os.getenv('CHAT_JOB_WORKERS', '8'))
+CHAT_JOB_POLL_INTERVAL = float(os.getenv('CHAT_JOB_POLL_INTERVAL', '0.5'))
+CHAT_JOB_CLAIM_BATCH = int(os.getenv('CHAT_JOB_CLAIM_BATCH', '10'))
+CHAT_JOB_LEASE_SECONDS = int(os.getenv('CHAT_JOB_LEASE_SECONDS', '120'))
+CHAT_JOB_MAX_ATTEMPTS = int(os.getenv('CHAT_JOB_MAX_ATTEMPTS', '5'))
+CHAT_JOB_RETRY_BASE_DELAY = float(os.getenv('CHAT_JOB_RETRY_BASE_DELAY', '2'))
+CHAT_JOB_RETRY_MAX_DELAY = float(os.getenv('CHAT_JOB_RETRY_MAX_DELAY', '300'))
+CHAT_JOB_BOT_CONCURRENCY = int(os.getenv('CHAT_JOB_BOT_CONCURRENCY', '4'))
+CHAT_JOB_MAX_WAIT = int(os.getenv('CHAT_JOB_MAX_WAIT', '30'))
+
+# Ограничение частоты запросов к чату (token bucket): общие лимиты держатся в Redis, без него — в памяти воркера
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+CHAT_RATE_LIMITS = {
+    'bot': os.getenv('CHAT_RATE_LIMIT_BOT', '120/min'),
+    'owner': os.getenv('CHAT_RATE_LIMIT_OWNER', '600/min'),
+    'end_user': os.getenv('CHAT_RATE_LIMIT_END_USER', '20/min'),
+}
+
+# Предел одновременных запросов к бэкенду LLM в одном процессе и время ожидания свободного слота
+LLM_MAX_CONCURRENCY = {
+    'deepseek': int(os.getenv('LLM_MAX_CONCURRENCY', '32')),
+}
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '2'))
+
+# Метрики и журналирование: доля запросов с детальной трассировкой (SQL, фазы), порог медленного запроса,
+# каталог для объединения метрик воркеров gunicorn и токен доступа к /metrics
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', '0.05'))
+METRICS_SLOW_REQUEST_MS = float(os.getenv('METRICS_SLOW_REQUEST_MS', '2000'))
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+METRICS_AUTH_TOKEN = os.getenv('METRICS_AUTH_TOKEN')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'api.logging_utils.RequestIdFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'api.logging_utils.JsonFormatter'},
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['request_id'],
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.getenv('API_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
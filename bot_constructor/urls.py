@@ -2,11 +2,14 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken import views
 
+from api.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
     path('api-auth/', include('rest_framework.urls')),
     path('api-token-auth/', views.obtain_auth_token),
+    path('metrics', metrics, name='metrics'),
 ]
 
 from django.conf import settings
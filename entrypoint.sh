@@ -3,11 +3,16 @@ set -e
 
 echo "🚀 Running migrations..."
 python manage.py migrate --noinput
+python manage.py createcachetable
 
 echo "📦 Collecting static files..."
 python manage.py collectstatic --noinput
 
+if [ -n "$METRICS_DIR" ]; then
+    rm -rf "$METRICS_DIR" && mkdir -p "$METRICS_DIR"
+fi
+
 PORT=${PORT:-8000}
-echo "🌐 Starting Gunicorn on port $PORT..."
-exec gunicorn bot_constructor.wsgi:application --bind 0.0.0.0:$PORT
+echo "🌐 Starting Gunicorn (ASGI) on port $PORT..."
+exec gunicorn bot_constructor.asgi:application -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:$PORT
 